@@ -1,14 +1,190 @@
+import base64
+import binascii
+import heapq
+import ipaddress
+import json
+import uuid
+from itertools import islice
+
+from django.conf import settings
 from django.contrib import admin
-from .models import Session, Hit
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.forms.models import BaseInlineFormSet
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+
+from crena import sharding
+from .models import Session, Hit, DeletionJob
+
+CURSOR_VAR = "cursor"
+
+
+def estimated_count(queryset):
+    # the planner's row estimate on PostgreSQL, None elsewhere
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class EstimatedCountPaginator(Paginator):
+    # an exact COUNT(*) over millions of rows is what times out; large results get the
+    # planner's estimate, and counting never goes past ADMIN_EXACT_COUNT_LIMIT rows
+    @cached_property
+    def count(self):
+        # summed over the shards, each counted at once
+        counts = sharding.fan_out(lambda alias: self._count(self.object_list.using(alias))).values()
+        self.estimated = any(estimated for _, estimated in counts)
+        return sum(count for count, _ in counts)
+
+    def _count(self, queryset):
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        estimate = estimated_count(queryset)
+        if estimate is not None and estimate > limit:
+            return estimate, True
+        count = queryset.order_by()[: limit + 1].count()
+        return count, count > limit
+
+
+class KeysetChangeList(ChangeList):
+    # seeks on (start_time, id) like api.pagination.KeysetPagination, so a page deep
+    # in the list costs the same as the first one; ?cursor= replaces ?p=
+    keyset = True
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = request.GET.get(CURSOR_VAR)
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # filter and search links start over from the first page
+        return super().get_query_string(new_params, [CURSOR_VAR, *(remove or [])])
+
+    def encode_cursor(self, instance):
+        raw = f"{instance.start_time.isoformat()}|{instance.pk}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            start_time, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            start_time = parse_datetime(start_time)
+            pk = int(pk)
+        except (binascii.Error, UnicodeError, ValueError):
+            raise IncorrectLookupParameters("Invalid cursor")
+        if start_time is None:
+            raise IncorrectLookupParameters("Invalid cursor")
+        return start_time, pk
+
+    def _page(self, queryset):
+        queryset = queryset.order_by("-start_time", "-pk")
+        if self.cursor:
+            start_time, pk = self.decode_cursor(self.cursor)
+            queryset = queryset.filter(Q(start_time__lt=start_time) | Q(start_time=start_time, pk__lt=pk))
+        return list(queryset[: self.list_per_page + 1])
+
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        # a page from every shard, merged; ids are unique across shards, so the
+        # (start_time, id) cursor means the same on all of them
+        pages = sharding.fan_out(lambda alias: self._page(self.queryset.using(alias))).values()
+        page = list(
+            islice(
+                heapq.merge(*pages, key=lambda obj: (obj.start_time, obj.pk), reverse=True),
+                self.list_per_page + 1,
+            )
+        )
+        has_next = len(page) > self.list_per_page
+        self.result_list = page[: self.list_per_page]
+        self.result_count = paginator.count
+        self.count_estimated = paginator.estimated
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = has_next or bool(self.cursor)
+        self.paginator = paginator
+        self.next_url = (
+            self.get_query_string({CURSOR_VAR: self.encode_cursor(self.result_list[-1])}) if has_next else None
+        )
+        self.first_url = self.get_query_string() if self.cursor else None
+
+
+class KeysetAdminMixin:
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # any other order would need its own index to seek on
+    sortable_by = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_object(self, request, object_id, from_field=None):
+        # looked up on every shard; the object remembers its database for saving
+        found = sharding.fan_out(lambda alias: super(KeysetAdminMixin, self).get_object(request, object_id, from_field))
+        return next((obj for obj in found.values() if obj is not None), None)
+
+    def get_actions(self, request):
+        # bulk actions run on the default database's queryset only
+        if settings.SHARD_DATABASES:
+            return {}
+        return super().get_actions(request)
+
+
+def _search_uuid(term):
+    try:
+        return uuid.UUID(term)
+    except ValueError:
+        return None
+
+
+def _search_ip(term):
+    try:
+        return str(ipaddress.ip_address(term))
+    except ValueError:
+        return None
+
+
+class LimitedInlineFormSet(BaseInlineFormSet):
+    def get_queryset(self):
+        if not hasattr(self, "_limited_queryset"):
+            # the hits live on the shard the session was loaded from
+            queryset = super().get_queryset().using(self.instance._state.db)
+            self._limited_queryset = queryset[: settings.ADMIN_INLINE_HITS]
+        return self._limited_queryset
 
 
 class HitInline(admin.TabularInline):
+    # the newest ADMIN_INLINE_HITS hits only; the rest are a link away in the hit list
     model = Hit
     fk_name = "session"
+    formset = LimitedInlineFormSet
     extra = 0
+    can_delete = False
+    fields = ("start_time", "last_seen", "heartbeats", "tracker", "location", "referrer", "load_time")
+    readonly_fields = fields
+    ordering = ("-start_time", "-pk")
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
 
-class SessionAdmin(admin.ModelAdmin):
+class SessionAdmin(KeysetAdminMixin, admin.ModelAdmin):
     list_display = (
         "uuid",
         "service",
@@ -20,23 +196,38 @@ class SessionAdmin(admin.ModelAdmin):
         "country",
     )
     list_display_links = ("uuid",)
-    search_fields = (
-        "ip",
-        "user_agent",
-        "device",
-        "device_type",
-        "identifier",
-        "asn",
-        "time_zone",
-    )
+    list_select_related = ("service",)
+    # only indexed keys: a session uuid, an IP address or an identifier prefix
+    search_fields = ("uuid", "ip", "identifier")
+    search_help_text = "A session uuid, an IP address or the start of an identifier"
     list_filter = ("device_type",)
+    raw_id_fields = ("service",)
+    readonly_fields = ("all_hits",)
     inlines = [HitInline]
 
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        query = Q(identifier__startswith=term)
+        if (session_uuid := _search_uuid(term)) is not None:
+            query |= Q(uuid=session_uuid)
+        if (ip := _search_ip(term)) is not None:
+            query |= Q(ip=ip)
+        return queryset.filter(query), False
+
+    @admin.display(description="Hits")
+    def all_hits(self, obj):
+        if obj.pk is None:
+            return "-"
+        url = reverse("admin:analytics_hit_changelist")
+        return format_html('<a href="{}?session__id__exact={}">All hits of this session</a>', url, obj.pk)
+
 
 admin.site.register(Session, SessionAdmin)
 
 
-class HitAdmin(admin.ModelAdmin):
+class HitAdmin(KeysetAdminMixin, admin.ModelAdmin):
     list_display = (
         "session",
         "initial",
@@ -47,8 +238,53 @@ class HitAdmin(admin.ModelAdmin):
         "location",
     )
     list_display_links = ("session",)
-    search_fields = ("initial", "tracker", "location", "referrer")
+    list_select_related = ("session__service",)
+    # hits are found through their session, by its uuid or id
+    search_fields = ("session__uuid", "session__id")
+    search_help_text = "A session uuid or id"
     list_filter = ("initial", "tracker")
+    raw_id_fields = ("session", "service")
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if (session_uuid := _search_uuid(term)) is not None:
+            return queryset.filter(session__uuid=session_uuid), False
+        if term.isdigit():
+            return queryset.filter(session_id=int(term)), False
+        return queryset.none(), False
+
+
+admin.site.register(Hit, HitAdmin)
+
+
+class DeletionJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "service",
+        "kind",
+        "status",
+        "sessions_deleted",
+        "hits_deleted",
+        "created",
+        "finished",
+    )
+    list_filter = ("kind", "status")
+    readonly_fields = (
+        "status",
+        "cursor",
+        "sessions_deleted",
+        "hits_deleted",
+        "error",
+        "created",
+        "updated",
+        "finished",
+    )
+    actions = ["retry"]
+
+    @admin.action(description="Retry selected jobs from their cursor")
+    def retry(self, request, queryset):
+        queryset.filter(status=DeletionJob.FAILED).update(status=DeletionJob.PENDING, error="")
 
 
-admin.site.register(Hit, HitAdmin)
\ No newline at end of file
+admin.site.register(DeletionJob, DeletionJobAdmin)
@@ -0,0 +1,183 @@
+import logging
+import math
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from core.models import Service
+from .counters import get_minute_counts, minute_bucket
+
+logger = logging.getLogger(__name__)
+
+LAST_EVALUATED_MINUTE_PATH = "traffic_alerts_last_minute"
+EVALUATION_CHUNK_SIZE = 500
+
+
+@dataclass
+class Baseline:
+    mean: float
+    std: float
+    samples: int
+
+
+@dataclass
+class Alert:
+    service_pk: int
+    minute: int
+    kind: str
+    count: int
+    expected: float
+    std: float
+
+    def __str__(self):
+        return (
+            f"traffic {self.kind} on service {self.service_pk} at minute {self.minute}: "
+            f"{self.count} hits, expected {self.expected:.1f} ± {self.std:.1f}"
+        )
+
+
+class EWMADetector:
+    # exponentially weighted mean and variance; the state is three numbers per service
+    def __init__(self, alpha=None):
+        self.alpha = alpha if alpha is not None else settings.ALERT_EWMA_ALPHA
+
+    def initial_state(self):
+        return (0.0, 0.0, 0)
+
+    def baseline(self, state, minute):
+        mean, var, samples = state
+        return Baseline(mean=mean, std=math.sqrt(var), samples=samples)
+
+    def update(self, state, count, minute):
+        mean, var, samples = state
+        if samples == 0:
+            return (float(count), 0.0, 1)
+        diff = count - mean
+        incr = self.alpha * diff
+        return (mean + incr, (1 - self.alpha) * (var + diff * incr), samples + 1)
+
+
+class SeasonalEWMADetector(EWMADetector):
+    # one EWMA per hour of the day, so the nightly dip is not reported as a drop
+    SLOTS = 24
+
+    def initial_state(self):
+        return tuple(super(SeasonalEWMADetector, self).initial_state() for _ in range(self.SLOTS))
+
+    def _slot(self, minute):
+        return (minute // 60) % self.SLOTS
+
+    def baseline(self, state, minute):
+        return super().baseline(state[self._slot(minute)], minute)
+
+    def update(self, state, count, minute):
+        slot = self._slot(minute)
+        state = list(state)
+        state[slot] = super().update(state[slot], count, minute)
+        return tuple(state)
+
+
+class SpikeRule:
+    kind = "spike"
+
+    def __init__(self, threshold=None, min_count=None):
+        self.threshold = threshold if threshold is not None else settings.ALERT_STD_THRESHOLD
+        self.min_count = min_count if min_count is not None else settings.ALERT_MIN_COUNT
+
+    def __call__(self, service_pk, minute, count, baseline):
+        if count < self.min_count:
+            return None
+        if count > baseline.mean + self.threshold * max(baseline.std, 1.0):
+            return Alert(service_pk, minute, self.kind, count, baseline.mean, baseline.std)
+        return None
+
+
+class DropRule(SpikeRule):
+    kind = "drop"
+
+    def __call__(self, service_pk, minute, count, baseline):
+        if baseline.mean < self.min_count:
+            return None
+        if count < baseline.mean - self.threshold * max(baseline.std, 1.0):
+            return Alert(service_pk, minute, self.kind, count, baseline.mean, baseline.std)
+        return None
+
+
+def log_notifier(alert):
+    logger.warning(str(alert))
+
+
+def _load(path_or_obj):
+    if isinstance(path_or_obj, str):
+        path_or_obj = import_string(path_or_obj)
+    return path_or_obj() if isinstance(path_or_obj, type) else path_or_obj
+
+
+def _state_path(service_pk):
+    return f"traffic_detector_{service_pk}"
+
+
+class TrafficEvaluator:
+    def __init__(self, detector=None, rules=None, notifiers=None):
+        self.detector = _load(detector or settings.ALERT_DETECTOR)
+        self.rules = [_load(rule) for rule in (rules if rules is not None else settings.ALERT_RULES)]
+        self.notifiers = [
+            _load(notifier)
+            for notifier in (notifiers if notifiers is not None else settings.ALERT_NOTIFIERS)
+        ]
+
+    def notify(self, alert):
+        for notifier in self.notifiers:
+            try:
+                notifier(alert)
+            except Exception as e:
+                # a broken hook must not stop the evaluation of the other services
+                logger.exception(e)
+
+    def evaluate_minute(self, minute, service_pks):
+        alerts = []
+        service_pks = list(service_pks)
+        for offset in range(0, len(service_pks), EVALUATION_CHUNK_SIZE):
+            chunk = service_pks[offset:offset + EVALUATION_CHUNK_SIZE]
+            counts = get_minute_counts(chunk, minute)
+            states = cache.get_many([_state_path(pk) for pk in chunk])
+            new_states = {}
+
+            for pk in chunk:
+                state = states.get(_state_path(pk)) or self.detector.initial_state()
+                baseline = self.detector.baseline(state, minute)
+                count = counts[pk]
+
+                if baseline.samples >= settings.ALERT_WARMUP_MINUTES:
+                    for rule in self.rules:
+                        alert = rule(pk, minute, count, baseline)
+                        if alert is not None:
+                            alerts.append(alert)
+                            self.notify(alert)
+
+                new_states[_state_path(pk)] = self.detector.update(state, count, minute)
+
+            cache.set_many(new_states, timeout=None)
+        return alerts
+
+    def run_pending(self, service_pks=None):
+        # evaluate every closed minute since the last run, giving the queue some slack
+        target = minute_bucket() - 1 - settings.ALERT_EVALUATION_LAG_MINUTES
+        last = cache.get(LAST_EVALUATED_MINUTE_PATH)
+        if last is None or target - last > settings.ALERT_MAX_CATCHUP_MINUTES:
+            last = target - 1
+        if last >= target:
+            return []
+
+        if service_pks is None:
+            service_pks = list(
+                Service.objects.filter(status=Service.ACTIVE).values_list("pk", flat=True)
+            )
+
+        alerts = []
+        for minute in range(last + 1, target + 1):
+            alerts.extend(self.evaluate_minute(minute, service_pks))
+            cache.set(LAST_EVALUATED_MINUTE_PATH, minute, timeout=None)
+        return alerts
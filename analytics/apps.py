@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AnalyticsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'analytics'
+
+    def ready(self):
+        # connects the tracker script invalidation, the shard placement of new and
+        # deleted services and the removal of their archives to Service changes
+        from . import archive, scripts, shards  # noqa: F401
@@ -0,0 +1,575 @@
+import datetime
+import gzip
+import json
+import logging
+import math
+import os
+import shutil
+import uuid
+from array import array
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, router, transaction
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.models import Service
+from crena import sharding
+from . import deletion, versions
+from .models import Hit, SegmentBitmap, Session
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MICROSECOND = datetime.timedelta(microseconds=1)
+NULL_TIME = -(2**63)
+# chart buckets are found per quarter hour, the finest step of any time zone offset
+QUARTER_HOUR = 15 * 60 * 10**6
+FORMAT_VERSION = 1
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def _kind(field):
+    if isinstance(field, models.DateTimeField):
+        return "time"
+    if isinstance(field, models.BooleanField):
+        return "bool"
+    if isinstance(field, (models.FloatField, models.DecimalField)):
+        return "float"
+    if isinstance(field, models.UUIDField):
+        return "uuid"
+    if isinstance(field, (models.IntegerField, models.AutoField)) or field.is_relation:
+        return "int"
+    return "text"
+
+
+def columns(model):
+    # every column but the service, which the archive's directory stands for
+    return {field.attname: _kind(field) for field in model._meta.concrete_fields if field.name != "service"}
+
+
+def _us(value):
+    return (value - EPOCH) // MICROSECOND
+
+
+def _month_start(value):
+    return datetime.datetime(value.year, value.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def _next_month(start):
+    return (start + datetime.timedelta(days=32)).replace(day=1)
+
+
+class ColumnBuilder:
+    # one column being archived, appended to row by row in compact arrays. Integers
+    # and the codes of dictionary encoded text are stored in the narrowest type that
+    # fits; nulls are -1 codes, NaN floats and NULL_TIME times
+    def __init__(self, kind):
+        self.kind = kind
+        self.values = bytearray() if kind == "uuid" else array({"float": "d", "bool": "b"}.get(kind, "q"))
+        self.dictionary = {} if kind == "text" else None
+
+    def append(self, value):
+        if self.kind == "text":
+            self.values.append(-1 if value is None else self.dictionary.setdefault(str(value), len(self.dictionary)))
+        elif self.kind == "time":
+            self.values.append(NULL_TIME if value is None else _us(value))
+        elif self.kind == "float":
+            self.values.append(math.nan if value is None else value)
+        elif self.kind == "uuid":
+            self.values += uuid.UUID(str(value)).bytes
+        else:
+            self.values.append(value)
+
+    def finish(self):
+        if self.kind == "uuid":
+            return np.frombuffer(bytes(self.values), dtype="S16"), None
+        values = np.frombuffer(self.values, dtype={"float": np.float64, "bool": np.int8}.get(self.kind, np.int64))
+        if self.kind == "bool":
+            return values.astype(bool), None
+        if self.kind == "text":
+            return _narrow(values), list(self.dictionary)
+        if self.kind == "int":
+            return _narrow(values), None
+        return values.copy(), None
+
+
+def _narrow(values):
+    # into the smallest integer type holding every value
+    for dtype in (np.int8, np.int16, np.int32):
+        if len(values) == 0 or (values.min() >= np.iinfo(dtype).min and values.max() <= np.iinfo(dtype).max):
+            return values.astype(dtype)
+    return values.copy()
+
+
+class Part:
+    # one archived batch of a service's month: a directory with a .npy file per column,
+    # read memory-mapped, and the dictionaries of the text columns, read when needed
+    def __init__(self, path):
+        self.path = path
+        self.meta = json.loads((path / "meta.json").read_text())
+        self.month = datetime.date.fromisoformat(self.meta["month"] + "-01")
+        self._columns = {}
+        self._dictionaries = {}
+        self._codes = {}
+
+    def __repr__(self):
+        return f"<Part {self.path}>"
+
+    def column(self, table, name):
+        key = table, name
+        if key not in self._columns:
+            self._columns[key] = np.load(self.path / f"{table}.{name}.npy", mmap_mode="r")
+        return self._columns[key]
+
+    def dictionary(self, table, name):
+        key = table, name
+        if key not in self._dictionaries:
+            with gzip.open(self.path / f"{table}.{name}.json.gz", "rt") as f:
+                self._dictionaries[key] = json.load(f)
+        return self._dictionaries[key]
+
+    def code(self, table, name, value):
+        # the dictionary code of a text value, None when no row has it
+        key = table, name
+        if key not in self._codes:
+            self._codes[key] = {value: code for code, value in enumerate(self.dictionary(table, name))}
+        return self._codes[key].get(str(value))
+
+    def kind(self, table, name):
+        return self.meta["columns"][table][name]
+
+    def rows(self, table):
+        return self.meta["rows"][table]
+
+    def overlaps(self, start_time, end_time):
+        low, high = self.meta["time_range"]
+        return low < _us(end_time) and high > _us(start_time)
+
+    def decode(self, table, name, rows=None):
+        # python values of a column, as the ORM would return them
+        values = self.column(table, name)
+        values = values if rows is None else values[rows]
+        kind = self.kind(table, name)
+        if kind == "text":
+            dictionary = self.dictionary(table, name)
+            return [dictionary[code] if code >= 0 else None for code in values.tolist()]
+        if kind == "time":
+            return [EPOCH + datetime.timedelta(microseconds=value) if value != NULL_TIME else None for value in values.tolist()]
+        if kind == "float":
+            return [None if math.isnan(value) else value for value in values.tolist()]
+        if kind == "uuid":
+            return [uuid.UUID(bytes=value) for value in values.tolist()]
+        return values.tolist()
+
+
+_parts = {}
+
+
+def service_dir(service):
+    return Path(settings.ARCHIVE_ROOT) / str(service.uuid)
+
+
+def parts(service):
+    # a service's parts in month order; parts never change once written, so they stay
+    # open (and their pages mapped) for as long as their directory exists
+    root = service_dir(service)
+    if not root.is_dir():
+        return []
+    found = []
+    for path in sorted(root.iterdir()):
+        if path.suffix == ".tmp" or not (path / "meta.json").exists():
+            continue
+        part = _parts.get(path)
+        if part is None:
+            part = _parts.setdefault(path, Part(path))
+        found.append(part)
+    # parts another process rewrote or removed; their mappings are let go
+    current = {part.path for part in found}
+    for path in [path for path in _parts if path.parent == root and path not in current]:
+        _parts.pop(path, None)
+    return found
+
+
+def has_data(service):
+    return np is not None and bool(parts(service))
+
+
+def _write(root, month, tables, time_range):
+    # into a temporary directory renamed into place, so readers never see half a part
+    numbers = [int(path.suffix[1:]) for path in root.glob(f"{month:%Y-%m}.*") if path.suffix[1:].isdigit()]
+    path = root / f"{month:%Y-%m}.{max(numbers, default=0) + 1}"
+    tmp = path.with_suffix(".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    meta = {
+        "version": FORMAT_VERSION,
+        "month": f"{month:%Y-%m}",
+        "rows": {},
+        "columns": {},
+        "time_range": time_range,
+    }
+    for table, table_columns in tables.items():
+        meta["columns"][table] = {}
+        for name, (kind, values, dictionary) in table_columns.items():
+            np.save(tmp / f"{table}.{name}.npy", values)
+            if dictionary is not None:
+                with gzip.open(tmp / f"{table}.{name}.json.gz", "wt", compresslevel=6) as f:
+                    json.dump(dictionary, f)
+            if not name.startswith("_"):
+                meta["columns"][table][name] = kind
+            meta["rows"][table] = len(values)
+    (tmp / "meta.json").write_text(json.dumps(meta))
+    os.rename(tmp, path)
+    return path
+
+
+def _time_range(tables):
+    # the span of the part's session and hit start times, for picking parts by window
+    times = [
+        tables[table]["start_time"][1][tables[table]["start_time"][1] != NULL_TIME]
+        for table in ("sessions", "hits")
+    ]
+    times = [values for values in times if len(values)]
+    return [int(min(values.min() for values in times)), int(max(values.max() for values in times)) + 1]
+
+
+def _delete_rows(pks, using):
+    # hits first, so no hit is ever left pointing at a deleted session
+    deleted = 0
+    for offset in range(0, len(pks), settings.DELETION_BATCH_SIZE):
+        batch = pks[offset:offset + settings.DELETION_BATCH_SIZE]
+        with transaction.atomic(using=using):
+            deletion.raw_delete(Hit, "session_id", batch, using)
+            deleted += deletion.raw_delete(Session, "id", batch, using)
+    return deleted
+
+
+def archive_month(service, month, log=logger.info):
+    # moves the sessions a service started in a month, with all their hits, into a new
+    # part, then deletes them. Sessions a part already holds were archived by a run
+    # that stopped before deleting them, and are only deleted
+    start = _month_start(month)
+    end = _next_month(start)
+    using = router.db_for_write(Session)
+    sessions = Session.objects.filter(service=service, start_time__gte=start, start_time__lt=end)
+
+    pks = np.fromiter(sessions.order_by("pk").values_list("pk", flat=True), dtype=np.int64)
+    archived = [part.column("sessions", "id") for part in parts(service) if part.month == start.date()]
+    if archived and len(pks):
+        done = pks[np.isin(pks, np.concatenate(archived))]
+        if len(done):
+            log(f"Deleting {_delete_rows(done.tolist(), using)} sessions archived before")
+            versions.bump(service.pk)
+            pks = pks[~np.isin(pks, done)]
+    if not len(pks):
+        return 0
+
+    session_columns = columns(Session)
+    builders = {name: ColumnBuilder(kind) for name, kind in session_columns.items()}
+    rows = sessions.filter(pk__lte=int(pks[-1])).order_by("pk").values_list(*session_columns)
+    for row in rows.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+        for builder, value in zip(builders.values(), row):
+            builder.append(value)
+    tables = {"sessions": {name: (builders[name].kind, *builders[name].finish()) for name in builders}}
+    session_ids = tables["sessions"]["id"][1]
+
+    hit_columns = columns(Hit)
+    builders = {name: ColumnBuilder(kind) for name, kind in hit_columns.items()}
+    hits = Hit.objects.filter(
+        service=service,
+        start_time__gte=start,
+        session__start_time__gte=start,
+        session__start_time__lt=end,
+        session_id__lte=int(session_ids[-1]),
+    )
+    for row in hits.order_by("pk").values_list(*hit_columns).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+        for builder, value in zip(builders.values(), row):
+            builder.append(value)
+    tables["hits"] = {name: (builders[name].kind, *builders[name].finish()) for name in builders}
+    # each hit's row in the session columns, so hits are weighted and segmented by them
+    tables["hits"]["_session_row"] = (
+        "int",
+        np.searchsorted(session_ids, tables["hits"]["session_id"][1]).astype(np.int32),
+        None,
+    )
+
+    path = _write(service_dir(service), start.date(), tables, _time_range(tables))
+    deleted = _delete_rows(session_ids.tolist(), using)
+    SegmentBitmap.objects.filter(service=service, date__gte=start.date(), date__lt=end.date()).delete()
+    versions.bump(service.pk)
+    log(f"Archived {len(session_ids)} sessions and {len(tables['hits']['id'][1])} hits of {start:%Y-%m} to {path}")
+    return deleted
+
+
+def archive_service(service, before, log=logger.info):
+    # every month of the service that ended by `before`
+    shard, status = sharding.placement(service.uuid)
+    if status != sharding.ACTIVE:
+        raise ArchiveError(f"Service {service.uuid} is moving between shards ({status})")
+    with sharding.use_shard(shard):
+        first = Session.objects.filter(service=service).aggregate(first=models.Min("start_time"))["first"]
+        if first is None:
+            return 0
+        archived = 0
+        month = _month_start(first)
+        while _next_month(month) <= before:
+            archived += archive_month(service, month, log)
+            month = _next_month(month)
+    return archived
+
+
+def archive_closed_months(before=None, services=None, log=logger.info):
+    # the months that ended by `before`, ARCHIVE_AFTER_DAYS ago by default. One run at
+    # a time, and never next to a deletion job or a shard move, which delete rows too
+    if before is None:
+        if settings.ARCHIVE_AFTER_DAYS is None:
+            return 0
+        before = timezone.now() - datetime.timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+    if np is None:
+        raise ArchiveError("Archiving needs numpy")
+    if not cache.add(deletion.DELETION_LOCK_PATH, True, timeout=settings.DELETION_LOCK_TIMEOUT):
+        logger.debug("Deletion jobs are running")
+        return 0
+    try:
+        archived = 0
+        for service in services if services is not None else Service.objects.order_by("pk"):
+            try:
+                archived += archive_service(service, before, log)
+            except ArchiveError as e:
+                logger.info(str(e))
+        return archived
+    finally:
+        cache.delete(deletion.DELETION_LOCK_PATH)
+
+
+def _filter_part(part, keep):
+    # the part without the sessions outside `keep` and their hits; dictionaries are
+    # rebuilt, so no value of a removed row is left behind
+    hit_keep = keep[part.column("hits", "_session_row")]
+    new_rows = np.cumsum(keep) - 1
+    tables = {}
+    for table, mask in (("sessions", keep), ("hits", hit_keep)):
+        tables[table] = {}
+        for name, kind in part.meta["columns"][table].items():
+            values = np.asarray(part.column(table, name))[mask]
+            dictionary = None
+            if kind == "text":
+                used = np.unique(values[values >= 0])
+                dictionary = [part.dictionary(table, name)[code] for code in used.tolist()]
+                values = _narrow(np.where(values >= 0, np.searchsorted(used, values), -1))
+            tables[table][name] = (kind, values, dictionary)
+    tables["hits"]["_session_row"] = (
+        "int",
+        new_rows[np.asarray(part.column("hits", "_session_row"))[hit_keep]].astype(np.int32),
+        None,
+    )
+    return tables, int((~keep).sum()), int((~hit_keep).sum())
+
+
+def purge(service, identifier=None, before=None):
+    # removes archived sessions like a deletion job: a visitor's, those started before
+    # a date, or both. Returns the sessions and hits removed
+    sessions = hits = 0
+    for part in parts(service):
+        starts = part.column("sessions", "start_time")
+        drop = np.ones(len(starts), dtype=bool)
+        if identifier is not None:
+            code = part.code("sessions", "identifier", identifier)
+            drop &= part.column("sessions", "identifier") == (code if code is not None else -2)
+        if before is not None:
+            drop &= starts < _us(before)
+        if not drop.any():
+            continue
+        if drop.all():
+            sessions += part.rows("sessions")
+            hits += part.rows("hits")
+        else:
+            tables, removed_sessions, removed_hits = _filter_part(part, ~drop)
+            _write(part.path.parent, part.month, tables, _time_range(tables))
+            sessions += removed_sessions
+            hits += removed_hits
+        shutil.rmtree(part.path)
+        _parts.pop(part.path, None)
+    if sessions or hits:
+        versions.bump(service.pk)
+    return sessions, hits
+
+
+@receiver(pre_delete, sender=Service)
+def _delete_archive(sender, instance, using, **kwargs):
+    shutil.rmtree(service_dir(instance), ignore_errors=True)
+
+
+class ArchivedStats:
+    # the pieces get_relative_stats sums up, over the archived rows of a window. Each
+    # overlapping part contributes boolean masks of its sessions and hits in the window
+    # (and segment); the aggregates are numpy reductions over its mapped columns
+    def __init__(self, parts, start_time, end_time, segment=None):
+        start, end = _us(start_time), _us(end_time)
+        self.selections = []
+        for part in parts:
+            starts = part.column("sessions", "start_time")
+            sessions = (starts > start) & (starts < end)
+            hit_starts = part.column("hits", "start_time")
+            hits = (hit_starts > start) & (hit_starts < end)
+            if segment:
+                # sessions of the segment, and hits of those sessions, like the filters
+                in_segment = np.ones(len(starts), dtype=bool)
+                for dimension, value in segment.items():
+                    code = part.code("sessions", dimension, value)
+                    if code is None:
+                        in_segment[:] = False
+                        break
+                    in_segment &= part.column("sessions", dimension) == code
+                sessions &= in_segment
+                hits &= in_segment[part.column("hits", "_session_row")]
+            if sessions.any() or hits.any():
+                self.selections.append((part, sessions, hits))
+        self._totals = None
+
+    def __bool__(self):
+        return bool(self.selections)
+
+    def _rates(self, part, table, mask):
+        rates = part.column("sessions", "sample_rate")
+        if table == "sessions":
+            return np.asarray(rates[mask])
+        return np.asarray(rates)[part.column("hits", "_session_row")[mask]]
+
+    def _load_times(self, part, mask):
+        # parts archived while load_time was text keep it so; it is parsed once per dictionary
+        values = np.asarray(part.column("hits", "load_time"))[mask]
+        if part.kind("hits", "load_time") != "text":
+            return values.astype(np.float64)
+        parsed = []
+        for value in part.dictionary("hits", "load_time"):
+            try:
+                parsed.append(float(value))
+            except ValueError:
+                parsed.append(math.nan)
+        # code -1, a null, picks the trailing NaN
+        return np.array(parsed + [math.nan])[values]
+
+    def totals(self):
+        if self._totals is not None:
+            return self._totals
+        totals = Counter()
+        min_rate = None
+        for part, sessions, hits in self.selections:
+            rates = self._rates(part, "sessions", sessions)
+            if len(rates):
+                min_rate = min(min_rate or 1.0, float(rates.min()))
+            bounces = np.asarray(part.column("sessions", "is_bounce")[sessions])
+            totals["sessions"] += int(sessions.sum())
+            totals["weighted_sessions"] += float((1 / rates).sum())
+            totals["bounces"] += int(bounces.sum())
+            totals["weighted_bounces"] += float((1 / rates[bounces]).sum())
+            totals["variance"] += float(((1 - rates) / (rates * rates)).sum())
+
+            starts = np.asarray(part.column("sessions", "start_time")[sessions])
+            lasts = np.asarray(part.column("sessions", "last_seen")[sessions])
+            seen = lasts != NULL_TIME
+            totals["duration_sum"] += float((lasts[seen] - starts[seen]).sum()) / 10**6
+            totals["duration_count"] += int(seen.sum())
+
+            totals["hits"] += int(hits.sum())
+            totals["weighted_hits"] += float((1 / self._rates(part, "hits", hits)).sum())
+        self._totals = dict(totals, min_rate=min_rate)
+        return self._totals
+
+    def load_times(self):
+        # per part, the start times, location codes and dictionary, load times and
+        # weights of the window's hits that have a load time, for analytics.loadtimes
+        for part, sessions, hits in self.selections:
+            values = self._load_times(part, hits)
+            known = values > 0
+            yield (
+                np.asarray(part.column("hits", "start_time"))[hits][known],
+                np.asarray(part.column("hits", "location"))[hits][known],
+                part.dictionary("hits", "location"),
+                values[known],
+                (1 / self._rates(part, "hits", hits))[known],
+            )
+
+    def top(self, model, field, weighted=False):
+        # the count of every value, weighted by 1/sample_rate if asked
+        table = "hits" if model is Hit else "sessions"
+        counts = Counter()
+        for part, sessions, hits in self.selections:
+            mask = hits if table == "hits" else sessions
+            codes = np.asarray(part.column(table, field))[mask]
+            known = codes >= 0
+            weights = (1 / self._rates(part, table, mask))[known] if weighted else None
+            sums = np.bincount(codes[known].astype(np.intp), weights=weights)
+            dictionary = part.dictionary(table, field)
+            for code in np.flatnonzero(sums).tolist():
+                counts[dictionary[code]] += sums[code].item()
+        return counts
+
+    def chart(self, granularity, weighted=False):
+        # session and hit counts per hourly (aware datetime) or daily (date) bucket of
+        # the current time zone, the keys TruncHour and TruncDate give the live rows
+        tz = timezone.get_current_timezone()
+        charts = {"sessions": Counter(), "hits": Counter()}
+        for part, sessions, hits in self.selections:
+            for table, mask in (("sessions", sessions), ("hits", hits)):
+                times = np.asarray(part.column(table, "start_time"))[mask]
+                quarters, inverse = np.unique(times // QUARTER_HOUR, return_inverse=True)
+                sums = np.bincount(inverse, weights=1 / self._rates(part, table, mask) if weighted else None)
+                for quarter, count in zip(quarters.tolist(), sums.tolist()):
+                    local = (EPOCH + datetime.timedelta(microseconds=quarter * QUARTER_HOUR)).astimezone(tz)
+                    bucket = local.replace(minute=0) if granularity == "hourly" else local.date()
+                    charts[table][bucket] += count
+        return charts["sessions"], charts["hits"]
+
+
+def query(service, start_time, end_time, segment=None):
+    # the archived side of a stats window, None when no archived row falls into it
+    if np is None:
+        return None
+    overlapping = [part for part in parts(service) if part.overlaps(start_time, end_time)]
+    if not overlapping:
+        return None
+    return ArchivedStats(overlapping, start_time, end_time, segment) or None
+
+
+def export_rows(service, kind, columns, start_time=None, end_time=None):
+    # archived rows as analytics.exports reads them from the tables, oldest first
+    if np is None:
+        return
+    table = kind
+    for part in parts(service):
+        if start_time is not None and end_time is not None and not part.overlaps(start_time, end_time):
+            continue
+        starts = np.asarray(part.column(table, "start_time"))
+        mask = np.ones(len(starts), dtype=bool)
+        if start_time is not None:
+            mask &= starts >= _us(start_time)
+        if end_time is not None:
+            mask &= starts < _us(end_time)
+        rows = np.flatnonzero(mask)
+        rows = rows[np.argsort(starts[rows], kind="stable")]
+        for offset in range(0, len(rows), settings.EXPORT_CHUNK_SIZE):
+            chunk = rows[offset:offset + settings.EXPORT_CHUNK_SIZE]
+            values = []
+            for column in columns:
+                if column == "session__sample_rate":
+                    session_rows = np.asarray(part.column("hits", "_session_row"))[chunk]
+                    values.append(part.decode("sessions", "sample_rate", session_rows))
+                else:
+                    values.append(part.decode(table, column, chunk))
+            yield from zip(*values)
@@ -0,0 +1,112 @@
+import datetime
+import json
+import zlib
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+READ_SIZE = 64 * 1024
+
+
+class BatchError(ValueError):
+    status = 400
+
+
+class BatchTooLarge(BatchError):
+    status = 413
+
+
+def _read_chunks(stream):
+    while True:
+        chunk = stream.read(READ_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _limited(chunks):
+    total = 0
+    for chunk in chunks:
+        total += len(chunk)
+        if total > settings.BATCH_MAX_DECOMPRESSED_BYTES:
+            raise BatchTooLarge("Batch is too large")
+        yield chunk
+
+
+def _decompressed(chunks):
+    # wbits=47 accepts both gzip and zlib headers; max_length bounds every step, so a
+    # small compressed body cannot expand into an unbounded buffer
+    decompressor = zlib.decompressobj(wbits=47)
+    try:
+        for chunk in chunks:
+            data = decompressor.decompress(chunk, READ_SIZE)
+            yield data
+            while decompressor.unconsumed_tail:
+                data = decompressor.decompress(decompressor.unconsumed_tail, READ_SIZE)
+                yield data
+        yield decompressor.flush()
+    except zlib.error as e:
+        raise BatchError(f"Invalid compressed body: {e}")
+    if not decompressor.eof:
+        raise BatchError("Truncated compressed body")
+
+
+def _parse_line(line, events):
+    line = line.strip()
+    if not line:
+        return
+    try:
+        event = json.loads(line)
+    except ValueError:
+        raise BatchError("Invalid JSON line")
+    if not isinstance(event, dict):
+        raise BatchError("Every line must be a JSON object")
+    if len(events) >= settings.BATCH_MAX_EVENTS:
+        raise BatchTooLarge("Too many events in batch")
+    events.append(event)
+
+
+def read_ndjson(stream, compressed=False):
+    chunks = _read_chunks(stream)
+    if compressed:
+        chunks = _decompressed(chunks)
+
+    events = []
+    pending = b""
+    for data in _limited(chunks):
+        pending += data
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            _parse_line(line, events)
+    _parse_line(pending, events)
+    return events
+
+
+def event_time(value, received):
+    # client clocks drift; events from the future are pinned to the receive time and
+    # events older than the offline buffer window are dropped
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        try:
+            time = datetime.datetime.fromtimestamp(value / 1000, tz=datetime.timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+    elif isinstance(value, str):
+        try:
+            time = parse_datetime(value)
+        except ValueError:
+            return None
+        if time is None:
+            return None
+        if timezone.is_naive(time):
+            time = timezone.make_aware(time, datetime.timezone.utc)
+    else:
+        return None
+
+    if time > received:
+        return received
+    if received - time > datetime.timedelta(seconds=settings.BATCH_MAX_EVENT_AGE):
+        return None
+    return time
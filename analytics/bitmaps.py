@@ -0,0 +1,158 @@
+import struct
+from array import array
+
+# Roaring layout: values are split by their high bits into chunks of 65536, and each
+# chunk is stored as a sorted array of its low 16 bits while sparse, or as a
+# 65536-bit bitmap (a Python int, so AND/OR/popcount run in C) once dense
+ARRAY_MAX = 4096
+BITMAP_BYTES = 65536 // 8
+
+_MAGIC = b"RB1"
+_HEADER = struct.Struct("<3sI")
+_CONTAINER = struct.Struct("<QBI")
+
+
+def _array_to_bitmap(values):
+    buffer = bytearray(BITMAP_BYTES)
+    for value in values:
+        buffer[value >> 3] |= 1 << (value & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def _bitmap_to_array(bitmap):
+    values = array("H")
+    for index, byte in enumerate(bitmap.to_bytes(BITMAP_BYTES, "little")):
+        if byte:
+            base = index << 3
+            for bit in range(8):
+                if byte >> bit & 1:
+                    values.append(base + bit)
+    return values
+
+
+def _shrink(container):
+    # keep whichever representation is smaller
+    if isinstance(container, int) and container.bit_count() <= ARRAY_MAX:
+        return _bitmap_to_array(container)
+    if isinstance(container, array) and len(container) > ARRAY_MAX:
+        return _array_to_bitmap(container)
+    return container
+
+
+def _and(first, second):
+    if isinstance(first, int) and isinstance(second, int):
+        return _shrink(first & second)
+    if isinstance(first, int):
+        first, second = second, first
+    if isinstance(second, int):
+        return array("H", (value for value in first if second >> value & 1))
+    return array("H", sorted(set(first).intersection(second)))
+
+
+def _or(first, second):
+    if isinstance(first, int) or isinstance(second, int):
+        first = first if isinstance(first, int) else _array_to_bitmap(first)
+        second = second if isinstance(second, int) else _array_to_bitmap(second)
+        return first | second
+    return _shrink(array("H", sorted(set(first).union(second))))
+
+
+def _andnot(first, second):
+    if isinstance(first, int):
+        second = second if isinstance(second, int) else _array_to_bitmap(second)
+        return _shrink(first & ~second)
+    if isinstance(second, int):
+        return array("H", (value for value in first if not second >> value & 1))
+    removed = set(second)
+    return array("H", (value for value in first if value not in removed))
+
+
+def _cardinality(container):
+    return container.bit_count() if isinstance(container, int) else len(container)
+
+
+class RoaringBitmap:
+    __slots__ = ("containers",)
+
+    def __init__(self, values=()):
+        self.containers = {}
+        chunks = {}
+        for value in values:
+            chunks.setdefault(value >> 16, []).append(value & 0xFFFF)
+        for key, lows in chunks.items():
+            self.containers[key] = _shrink(array("H", sorted(set(lows))))
+
+    def __len__(self):
+        return sum(_cardinality(container) for container in self.containers.values())
+
+    def __bool__(self):
+        return bool(self.containers)
+
+    def __iter__(self):
+        for key in sorted(self.containers):
+            container = self.containers[key]
+            base = key << 16
+            for low in _bitmap_to_array(container) if isinstance(container, int) else container:
+                yield base + low
+
+    def _combine(self, other, operation):
+        # chunks present on one side only are decided by the operation itself
+        result = RoaringBitmap()
+        if operation is _and:
+            keys = self.containers.keys() & other.containers.keys()
+        elif operation is _or:
+            keys = self.containers.keys() | other.containers.keys()
+        else:
+            keys = self.containers.keys()
+        for key in keys:
+            mine = self.containers.get(key)
+            theirs = other.containers.get(key)
+            if mine is None or theirs is None:
+                container = theirs if mine is None else mine
+            else:
+                container = operation(mine, theirs)
+            if _cardinality(container):
+                result.containers[key] = container
+        return result
+
+    def __and__(self, other):
+        return self._combine(other, _and)
+
+    def __or__(self, other):
+        return self._combine(other, _or)
+
+    def __sub__(self, other):
+        return self._combine(other, _andnot)
+
+    def to_bytes(self):
+        parts = [_HEADER.pack(_MAGIC, len(self.containers))]
+        for key in sorted(self.containers):
+            container = self.containers[key]
+            if isinstance(container, int):
+                parts.append(_CONTAINER.pack(key, 1, container.bit_count()))
+                parts.append(container.to_bytes(BITMAP_BYTES, "little"))
+            else:
+                parts.append(_CONTAINER.pack(key, 0, len(container)))
+                parts.append(container.tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        magic, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("Not a serialized RoaringBitmap")
+        bitmap = cls()
+        offset = _HEADER.size
+        for _ in range(count):
+            key, kind, cardinality = _CONTAINER.unpack_from(data, offset)
+            offset += _CONTAINER.size
+            if kind == 1:
+                bitmap.containers[key] = int.from_bytes(data[offset:offset + BITMAP_BYTES], "little")
+                offset += BITMAP_BYTES
+            else:
+                values = array("H")
+                values.frombytes(data[offset:offset + cardinality * 2])
+                bitmap.containers[key] = values
+                offset += cardinality * 2
+        return bitmap
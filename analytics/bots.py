@@ -0,0 +1,101 @@
+import ipaddress
+import time as _time
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+@dataclass
+class BotVerdict:
+    score: float = 0.0
+    reasons: list = field(default_factory=list)
+
+    @property
+    def is_bot(self):
+        return self.score >= settings.BOT_SCORE_THRESHOLD
+
+    def flag(self, reason, weight):
+        self.score += weight
+        self.reasons.append(reason)
+
+
+class SlidingWindowCounter:
+    # approximates a sliding window with the current and previous fixed window, so each
+    # scope costs two cache keys no matter how many requests it sees
+    def __init__(self, name, window):
+        self.name = name
+        self.window = window
+
+    def _path(self, scope, index):
+        return f"bot_{self.name}_{scope}_{index}"
+
+    def paths(self, scope, now):
+        index = int(now // self.window)
+        return self._path(scope, index), self._path(scope, index - 1)
+
+    def increment(self, path):
+        try:
+            return cache.incr(path)
+        except ValueError:
+            # first request of the window; add() keeps a concurrent writer's count
+            if cache.add(path, 1, timeout=self.window * 2 + 1):
+                return 1
+            return cache.incr(path)
+
+    def estimate(self, current, previous, now):
+        elapsed = (now % self.window) / self.window
+        return current + previous * (1 - elapsed)
+
+
+def ip_prefix(ip):
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    prefix = settings.BOT_IPV4_PREFIX if address.version == 4 else settings.BOT_IPV6_PREFIX
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+
+_session_minute = SlidingWindowCounter("session_minute", 60)
+_session_pages = SlidingWindowCounter("session_pages", 10)
+_prefix_minute = SlidingWindowCounter("prefix_minute", 60)
+
+
+def score_request(service_pk, association_hash, ip, is_heartbeat, now=None):
+    if now is None:
+        now = _time.time()
+    verdict = BotVerdict()
+    scope = f"{service_pk}_{association_hash}"
+    prefix = ip_prefix(ip) if ip else None
+    heartbeat_path = f"bot_last_heartbeat_{scope}"
+
+    counters = [("session_rate", _session_minute, scope, settings.BOT_MAX_REQUESTS_PER_MINUTE, 1.0)]
+    if not is_heartbeat:
+        # humans do not read more than a page or so per second for ten seconds straight
+        counters.append(
+            ("page_rate", _session_pages, scope, settings.BOT_MAX_PAGES_PER_SECOND * _session_pages.window, 1.0)
+        )
+    if prefix is not None:
+        counters.append(
+            ("prefix_rate", _prefix_minute, f"{service_pk}_{prefix}", settings.BOT_MAX_REQUESTS_PER_PREFIX_MINUTE, 0.5)
+        )
+
+    # one round trip for every previous window, one increment per current window
+    paths = [counter.paths(counter_scope, now) for _, counter, counter_scope, _, _ in counters]
+    previous = cache.get_many([previous_path for _, previous_path in paths] + [heartbeat_path])
+
+    for (reason, counter, _, limit, weight), (current_path, previous_path) in zip(counters, paths):
+        rate = counter.estimate(counter.increment(current_path), previous.get(previous_path, 0), now)
+        if rate > limit:
+            verdict.flag(reason, settings.BOT_SCORE_THRESHOLD * weight)
+
+    if is_heartbeat:
+        # the tracker script cannot send heartbeats faster than its configured frequency
+        last_heartbeat = previous.get(heartbeat_path)
+        cache.set(heartbeat_path, now, timeout=settings.SESSION_MEMORY_TIMEOUT)
+        min_interval = settings.SCRIPT_HEARTBEAT_FREQUENCY / 1000 * settings.BOT_MIN_HEARTBEAT_RATIO
+        if last_heartbeat is not None and now - last_heartbeat < min_interval:
+            verdict.flag("heartbeat_interval", settings.BOT_SCORE_THRESHOLD * 0.5)
+
+    return verdict
@@ -0,0 +1,183 @@
+import logging
+
+from django.conf import settings
+from django.db import NotSupportedError, connections, router, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def _copy_supported(connection):
+    if connection.vendor != "postgresql":
+        return False
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+    return is_psycopg3
+
+
+def _reserve_ids(cursor, model, count):
+    # COPY cannot return generated keys, so draw them from the sequence up front
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+        [model._meta.db_table, model._meta.pk.column, count],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _copy_rows(cursor, connection, model, objs, raw):
+    fields = [field for field in model._meta.concrete_fields]
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    table = connection.ops.quote_name(model._meta.db_table)
+
+    with cursor.copy(f"COPY {table} ({columns}) FROM STDIN") as copy:
+        for obj in objs:
+            copy.write_row(
+                [
+                    field.get_db_prep_save(
+                        getattr(obj, field.attname) if raw else field.pre_save(obj, True),
+                        connection,
+                    )
+                    for field in fields
+                ]
+            )
+
+
+def bulk_insert(model, objs, using=None, batch_size=None, raw=False):
+    # COPY on PostgreSQL, bulk_create everywhere else; primary keys are set on objs.
+    # raw=True writes the stored values as they are, e.g. auto_now_add timestamps
+    objs = list(objs)
+    if not objs:
+        return objs
+
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    batch_size = batch_size or settings.BULK_INSERT_BATCH_SIZE
+
+    if not _copy_supported(connection):
+        if not raw:
+            return model.objects.using(using).bulk_create(objs, batch_size=batch_size)
+        for offset in range(0, len(objs), batch_size):
+            model._base_manager.using(using)._insert(
+                objs[offset:offset + batch_size], fields=model._meta.concrete_fields, raw=True
+            )
+        return objs
+
+    with connection.cursor() as cursor:
+        for offset in range(0, len(objs), batch_size):
+            batch = objs[offset:offset + batch_size]
+            missing = [obj for obj in batch if obj.pk is None]
+            if missing:
+                for obj, pk in zip(missing, _reserve_ids(cursor, model, len(missing))):
+                    obj.pk = pk
+            _copy_rows(cursor, connection, model, batch, raw)
+
+    for obj in objs:
+        obj._state.adding = False
+        obj._state.db = using
+    return objs
+
+
+def reserve_ids(model, count, using=None):
+    # primary keys for rows written with insert_rows, drawn from the table's sequence
+    # so rows inserted alongside never collide with them
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            return _reserve_ids(cursor, model, count)
+        if connection.vendor != "sqlite":
+            raise NotSupportedError(f"Cannot reserve ids on {connection.vendor}")
+        with transaction.atomic(using=using):
+            cursor.execute(
+                f"INSERT INTO sqlite_sequence (name, seq) SELECT %s, COALESCE(MAX(id), 0) FROM {table} "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                [table, table],
+            )
+            cursor.execute("UPDATE sqlite_sequence SET seq = seq + %s WHERE name = %s", [count, table])
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+            last = cursor.fetchone()[0]
+    return list(range(last - count + 1, last + 1))
+
+
+def insert_rows(model, fields, rows, using=None, batch_size=None):
+    # plain tuples in the order of fields, primary keys included; for generated data,
+    # where building model instances would cost more than the insert itself
+    rows = list(rows)
+    if not rows:
+        return 0
+
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    fields = [model._meta.get_field(name) for name in fields]
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    table = connection.ops.quote_name(model._meta.db_table)
+
+    with connection.cursor() as cursor:
+        if _copy_supported(connection):
+            # psycopg adapts the values itself
+            with cursor.copy(f"COPY {table} ({columns}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+            return len(rows)
+
+        batch_size = batch_size or settings.BULK_INSERT_BATCH_SIZE
+        sql = f"INSERT INTO {table} ({columns}) VALUES ({', '.join(['%s'] * len(fields))})"
+        for offset in range(0, len(rows), batch_size):
+            cursor.executemany(
+                sql,
+                [
+                    [field.get_db_prep_save(value, connection) for field, value in zip(fields, row)]
+                    for row in rows[offset:offset + batch_size]
+                ],
+            )
+    return len(rows)
+
+
+def update_rows(model, keys, fields, rows, using=None, batch_size=None):
+    # rows are tuples of the key values then the field values. On PostgreSQL they are
+    # copied into a temporary table and applied with one UPDATE ... FROM
+    rows = list(rows)
+    if not rows:
+        return 0
+
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    keys = [model._meta.get_field(name) for name in keys]
+    fields = [model._meta.get_field(name) for name in fields]
+    table = quote(model._meta.db_table)
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if _copy_supported(connection):
+            columns = ", ".join(quote(field.column) for field in keys + fields)
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE _update_rows ON COMMIT DROP AS "
+                f"SELECT {columns} FROM {table} WITH NO DATA"
+            )
+            with cursor.copy(f"COPY _update_rows ({columns}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+            assignments = ", ".join(f"{quote(field.column)} = u.{quote(field.column)}" for field in fields)
+            matches = " AND ".join(f"{table}.{quote(field.column)} = u.{quote(field.column)}" for field in keys)
+            cursor.execute(f"UPDATE {table} SET {assignments} FROM _update_rows u WHERE {matches}")
+            updated = cursor.rowcount
+            # dropped now, as an outer transaction may call again before it commits
+            cursor.execute("DROP TABLE _update_rows")
+            return updated
+
+        batch_size = batch_size or settings.BULK_INSERT_BATCH_SIZE
+        assignments = ", ".join(f"{quote(field.column)} = %s" for field in fields)
+        matches = " AND ".join(f"{quote(field.column)} = %s" for field in keys)
+        sql = f"UPDATE {table} SET {assignments} WHERE {matches}"
+        for offset in range(0, len(rows), batch_size):
+            cursor.executemany(
+                sql,
+                [
+                    [
+                        field.get_db_prep_save(value, connection)
+                        for field, value in zip(fields + keys, row[len(keys):] + row[:len(keys)])
+                    ]
+                    for row in rows[offset:offset + batch_size]
+                ],
+            )
+    return len(rows)
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+
+def minute_bucket(time=None):
+    if time is None:
+        time = timezone.now()
+    return int(time.timestamp()) // 60
+
+
+def _minute_counter_path(service_pk, minute):
+    return f"traffic_minute_{service_pk}_{minute}"
+
+
+def incr_minute_counter(service_pk, time=None, amount=1):
+    # counters are kept in the cache so the evaluator never has to query the Hit table
+    path = _minute_counter_path(service_pk, minute_bucket(time))
+    cache.add(path, 0, timeout=settings.TRAFFIC_COUNTER_TIMEOUT)
+    try:
+        return cache.incr(path, amount)
+    except ValueError:
+        # the key expired between add() and incr()
+        cache.set(path, amount, timeout=settings.TRAFFIC_COUNTER_TIMEOUT)
+        return amount
+
+
+def get_minute_counts(service_pks, minute):
+    paths = {_minute_counter_path(pk, minute): pk for pk in service_pks}
+    found = cache.get_many(list(paths))
+    return {pk: found.get(path, 0) for path, pk in paths.items()}
@@ -0,0 +1,138 @@
+import math
+import threading
+import time
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.redis import RedisCache
+
+from . import metrics
+
+
+def filter_params(memory_bytes, false_positive_rate):
+    # (bits, hashes, capacity) of a Bloom filter in a fixed amount of memory; past
+    # capacity beacons the false positive rate climbs above the configured one
+    bits = memory_bytes * 8
+    hashes = max(1, round(-math.log2(false_positive_rate)))
+    capacity = int(bits * math.log(2) ** 2 / -math.log(false_positive_rate))
+    return bits, hashes, capacity
+
+
+def positions(key, bits, hashes):
+    # double hashing: k positions from two 64-bit halves of one digest
+    digest = sha256(key.encode("utf-8")).digest()
+    first = int.from_bytes(digest[:8], "big")
+    second = int.from_bytes(digest[8:16], "big") | 1
+    return [(first + n * second) % bits for n in range(hashes)]
+
+
+class LocalStore:
+    # per process, like the default local memory cache
+    def __init__(self):
+        self._filters = {}
+        self._lock = threading.Lock()
+
+    def test_and_set(self, path, offsets, bits, timeout):
+        with self._lock:
+            if path not in self._filters:
+                self._filters[path] = [bytearray(bits // 8), 0, time.monotonic() + timeout]
+            entry = self._filters[path]
+            bitmap = entry[0]
+            seen = True
+            for offset in offsets:
+                byte, mask = offset >> 3, 1 << (offset & 7)
+                if not bitmap[byte] & mask:
+                    seen = False
+                    bitmap[byte] |= mask
+            entry[1] += 1
+            return seen, entry[1]
+
+    def test(self, path, offsets):
+        entry = self._filters.get(path)
+        return entry is not None and all(entry[0][offset >> 3] & 1 << (offset & 7) for offset in offsets)
+
+    def expire(self):
+        # the same lifetime the keys get in Redis
+        now = time.monotonic()
+        with self._lock:
+            for path in [path for path, entry in self._filters.items() if entry[2] < now]:
+                del self._filters[path]
+
+
+class RedisStore:
+    # shared by every worker; SETBIT returns the previous bit, so testing and adding
+    # is a single round trip
+    def __init__(self, client):
+        self.client = client
+
+    def test_and_set(self, path, offsets, bits, timeout):
+        pipeline = self.client.pipeline(transaction=False)
+        for offset in offsets:
+            pipeline.setbit(path, offset, 1)
+        pipeline.expire(path, timeout)
+        pipeline.incr(f"{path}_count")
+        pipeline.expire(f"{path}_count", timeout)
+        results = pipeline.execute()
+        return all(results[: len(offsets)]), results[len(offsets) + 1]
+
+    def test(self, path, offsets):
+        pipeline = self.client.pipeline(transaction=False)
+        for offset in offsets:
+            pipeline.getbit(path, offset)
+        return all(pipeline.execute())
+
+    def expire(self):
+        # keys expire by themselves
+        pass
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if isinstance(cache, RedisCache):
+                    _store = RedisStore(cache._cache.get_client(write=True))
+                else:
+                    _store = LocalStore()
+    return _store
+
+
+def _window_path(service_uuid, window):
+    return f"beacon_filter_{service_uuid}_{window}"
+
+
+def is_duplicate(service_uuid, fingerprint, now):
+    # a per-service filter per BEACON_FILTER_WINDOW; a beacon is looked up in the
+    # current and the previous window, so retries across a rotation are caught too
+    if not settings.BEACON_FILTER_ENABLED:
+        return False
+    bits, hashes, capacity = filter_params(
+        settings.BEACON_FILTER_MEMORY, settings.BEACON_FILTER_FALSE_POSITIVE_RATE
+    )
+    offsets = positions(fingerprint, bits, hashes)
+    window = int(now.timestamp()) // settings.BEACON_FILTER_WINDOW
+    store = get_store()
+    current = _window_path(service_uuid, window)
+    previous = _window_path(service_uuid, window - 1)
+
+    seen, count = store.test_and_set(current, offsets, bits, settings.BEACON_FILTER_WINDOW * 2)
+    if count == 1:
+        # a new window started, so older ones may have run out
+        store.expire()
+    if count == capacity + 1:
+        metrics.incr("beacon_filter", "saturated")
+    if not seen:
+        seen = store.test(previous, offsets)
+
+    metrics.incr("beacon_filter", "suppressed" if seen else "passed")
+    return seen
+
+
+def beacon_fingerprint(*parts):
+    return sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
@@ -0,0 +1,168 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from core.models import Service
+from crena import sharding
+from . import archive, segments, versions
+from .models import DeletionJob, Session, Hit
+
+logger = logging.getLogger(__name__)
+
+DELETION_LOCK_PATH = "deletion_jobs_lock"
+
+
+def _job_sessions(job):
+    sessions = Session.objects.filter(service_id=job.service_id, pk__gt=job.cursor)
+    if job.kind == DeletionJob.VISITOR:
+        sessions = sessions.filter(identifier=job.identifier)
+    if job.before is not None:
+        sessions = sessions.filter(start_time__lt=job.before)
+    return sessions
+
+
+def raw_delete(model, column, pks, using, since=None):
+    # a plain DELETE; Django's collector would load every row and cascade in Python.
+    # With since, only rows that start from then on: on the partitioned hit table the
+    # planner then skips the partitions before it
+    placeholders = ", ".join(["%s"] * len(pks))
+    sql = f"DELETE FROM {model._meta.db_table} WHERE {column} IN ({placeholders})"
+    params = list(pks)
+    connection = connections[using]
+    if since is not None:
+        sql += " AND start_time >= %s"
+        params.append(model._meta.get_field("start_time").get_db_prep_value(since, connection))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def delete_batch(job, batch_size=None):
+    batch_size = batch_size or settings.DELETION_BATCH_SIZE
+    using = router.db_for_write(Session)
+
+    rows = list(_job_sessions(job).order_by("pk").values_list("pk", "start_time")[:batch_size])
+    if not rows:
+        return 0
+    pks = [pk for pk, _ in rows]
+
+    # the shard commits first, so the cursor never gets ahead of the rows a shard deleted
+    with transaction.atomic(), transaction.atomic(using=using):
+        # hits first, so no hit is ever left pointing at a deleted session
+        # hits never start before their session
+        hits_deleted = raw_delete(Hit, "session_id", pks, using, since=min(start for _, start in rows))
+        sessions_deleted = raw_delete(Session, "id", pks, using)
+        segments.discard(job.service_id, rows)
+
+        job.cursor = pks[-1]
+        job.hits_deleted += max(hits_deleted, 0)
+        job.sessions_deleted += max(sessions_deleted, 0)
+        job.save(update_fields=["cursor", "hits_deleted", "sessions_deleted", "updated"])
+
+    versions.bump(job.service_id)
+    return len(pks)
+
+
+def run_job(job, max_batches=None, pause=None):
+    max_batches = max_batches if max_batches is not None else settings.DELETION_MAX_BATCHES_PER_RUN
+    pause = pause if pause is not None else settings.DELETION_BATCH_PAUSE
+
+    shard, shard_status = sharding.placement(job.service.uuid)
+    if shard_status != sharding.ACTIVE:
+        # picked up again by a later run, once the service has settled on its shard
+        logger.info(f"Deletion job {job.pk} waits for service {job.service_id} to finish moving")
+        return job
+
+    if job.status != DeletionJob.RUNNING:
+        job.status = DeletionJob.RUNNING
+        job.save(update_fields=["status", "updated"])
+
+    batches = 0
+    try:
+        with sharding.use_shard(shard):
+            while max_batches is None or batches < max_batches:
+                if delete_batch(job) == 0:
+                    # and the same sessions moved to cold storage
+                    sessions, hits = archive.purge(
+                        job.service,
+                        identifier=job.identifier if job.kind == DeletionJob.VISITOR else None,
+                        before=job.before,
+                    )
+                    job.sessions_deleted += sessions
+                    job.hits_deleted += hits
+                    if job.kind == DeletionJob.RETENTION:
+                        # the load times summed up from the deleted hits
+                        from .loadtimes import expire
+
+                        expire(job.service, job.before)
+                    job.status = DeletionJob.DONE
+                    job.finished = timezone.now()
+                    job.save(update_fields=["status", "finished", "sessions_deleted", "hits_deleted", "updated"])
+                    logger.info(
+                        f"Deletion job {job.pk} done: {job.sessions_deleted} sessions, {job.hits_deleted} hits"
+                    )
+                    break
+                batches += 1
+                # throttle, so ingestion and dashboards keep their share of the database
+                if pause:
+                    time.sleep(pause)
+    except Exception as e:
+        logger.exception(e)
+        job.status = DeletionJob.FAILED
+        job.error = str(e)
+        job.save(update_fields=["status", "error", "updated"])
+        raise
+
+    return job
+
+
+def run_pending_jobs(max_batches=None):
+    # one runner at a time; the lock expires in case a worker dies mid-run
+    if not cache.add(DELETION_LOCK_PATH, True, timeout=settings.DELETION_LOCK_TIMEOUT):
+        logger.debug("Deletion jobs are already running")
+        return []
+
+    try:
+        jobs = list(
+            DeletionJob.objects.filter(
+                status__in=[DeletionJob.PENDING, DeletionJob.RUNNING]
+            ).order_by("created")
+        )
+        for job in jobs:
+            run_job(job, max_batches=max_batches)
+        return jobs
+    finally:
+        cache.delete(DELETION_LOCK_PATH)
+
+
+def _retention_days(service):
+    # HIT_RETENTION_DAYS drops whole hit partitions; sessions past it are removed here
+    limits = [days for days in (service.retention_days, settings.HIT_RETENTION_DAYS) if days is not None]
+    return min(limits) if limits else None
+
+
+def schedule_retention_jobs(now=None):
+    now = now or timezone.now()
+    services = Service.objects.all()
+    if settings.HIT_RETENTION_DAYS is None:
+        services = services.filter(retention_days__isnull=False)
+
+    jobs = []
+    for service in services:
+        if service.deletion_jobs.filter(
+            kind=DeletionJob.RETENTION,
+            status__in=[DeletionJob.PENDING, DeletionJob.RUNNING],
+        ).exists():
+            continue
+        jobs.append(
+            DeletionJob.objects.create(
+                service=service,
+                kind=DeletionJob.RETENTION,
+                before=now - timezone.timedelta(days=_retention_days(service)),
+            )
+        )
+    return jobs
@@ -0,0 +1,123 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from . import loadtimes, metrics
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class EmbeddedWriter:
+    # INGRESS_MODE = "embedded": beacons go to a bounded in-process queue instead of
+    # Celery, and a single thread writes them, many per transaction. One writer means
+    # SQLite never sees two of our writes competing for its lock.
+
+    def __init__(self, maxsize=None, batch_size=None, batch_wait=None):
+        self.queue = queue.Queue(maxsize=maxsize or settings.EMBEDDED_QUEUE_SIZE)
+        self.batch_size = batch_size or settings.EMBEDDED_BATCH_SIZE
+        self.batch_wait = batch_wait if batch_wait is not None else settings.EMBEDDED_BATCH_WAIT
+        self.thread = None
+        self.pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # started lazily and per process, so forked web workers each get their own
+        if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+            return
+        with self._lock:
+            if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+                return
+            if self.pid is not None and self.pid != os.getpid():
+                # whatever the parent had queued is the parent's to write
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name="crena-ingress-writer", daemon=True)
+            self.thread.start()
+
+    def submit(self, task, *args, **kwargs):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait((task, args, kwargs))
+        except queue.Full:
+            # the request is never held up; a full queue means we are behind anyway
+            metrics.incr("events_dropped", "queue_full")
+            return False
+        return True
+
+    def _next_batch(self):
+        item = self.queue.get()
+        batch = [item]
+        deadline = time.monotonic() + self.batch_wait
+        while item is not _STOP and len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _write(self, batch):
+        with transaction.atomic():
+            for task, args, kwargs in batch:
+                # a savepoint per event, so one bad event does not take the batch with it
+                try:
+                    with transaction.atomic():
+                        task(*args, **kwargs)
+                except Exception as e:
+                    logger.exception(e)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is _STOP
+            if stop:
+                batch.pop()
+            if batch:
+                close_old_connections()
+                try:
+                    with metrics.timed("batch_write"):
+                        self._write(batch)
+                except Exception as e:
+                    logger.exception(e)
+                loadtimes.maybe_flush()
+            for _ in range(len(batch) + stop):
+                self.queue.task_done()
+            if stop:
+                loadtimes.flush()
+                connection.close()
+                return
+
+    def stop(self, timeout=None):
+        # drains what is queued, then ends the thread
+        if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout if timeout is not None else settings.EMBEDDED_SHUTDOWN_TIMEOUT)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    # built on first use, since the settings are not ready when this module is imported
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = EmbeddedWriter()
+                atexit.register(_writer.stop)
+    return _writer
+
+
+def submit(task, *args, **kwargs):
+    return get_writer().submit(task, *args, **kwargs)
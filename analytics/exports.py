@@ -0,0 +1,156 @@
+import csv
+import datetime
+import itertools
+import json
+import uuid
+import zlib
+
+from django.conf import settings
+
+from crena import sharding
+from crena.routers import replica_reads
+
+from . import archive
+from .models import Session, Hit
+
+SESSION_COLUMNS = (
+    "id",
+    "uuid",
+    "identifier",
+    "start_time",
+    "last_seen",
+    "browser",
+    "devices",
+    "device_type",
+    "os",
+    "ip",
+    "asn",
+    "country",
+    "longitude",
+    "latitude",
+    "time_zone",
+    "is_bounce",
+    # each row stands for 1/sample_rate sessions (hits) when the service samples
+    "sample_rate",
+)
+HIT_COLUMNS = (
+    "id",
+    "session_id",
+    "initial",
+    "start_time",
+    "last_seen",
+    "heartbeats",
+    "tracker",
+    "location",
+    "referrer",
+    "load_time",
+    "session__sample_rate",
+)
+EXPORTS = {
+    "sessions": (Session, SESSION_COLUMNS),
+    "hits": (Hit, HIT_COLUMNS),
+}
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+BUFFER_SIZE = 64 * 1024
+
+
+class ExportError(ValueError):
+    pass
+
+
+def get_columns(kind, columns=None):
+    if kind not in EXPORTS:
+        raise ExportError(f"Unknown export {kind!r}")
+    allowed = EXPORTS[kind][1]
+    if not columns:
+        return allowed
+    unknown = [column for column in columns if column not in allowed]
+    if unknown:
+        raise ExportError(f"Unknown columns for {kind}: {', '.join(unknown)}")
+    return tuple(columns)
+
+
+def export_rows(service, kind, columns=None, start_time=None, end_time=None, chunk_size=None):
+    # time range and columns go into the SQL; rows are fetched through a cursor in chunks
+    columns = get_columns(kind, columns)
+    model = EXPORTS[kind][0]
+
+    rows = model.objects.filter(service=service)
+    if start_time is not None:
+        rows = rows.filter(start_time__gte=start_time)
+    if end_time is not None:
+        rows = rows.filter(start_time__lt=end_time)
+    # the rows are read lazily while the response streams, so the shard and replica are
+    # picked now
+    with sharding.service_shard(service), replica_reads():
+        rows = rows.using(rows.db)
+
+    live = rows.order_by("start_time").values_list(*columns).iterator(
+        chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE
+    )
+    # months moved to cold storage are the oldest, so they come first
+    return itertools.chain(archive.export_rows(service, kind, columns, start_time, end_time), live)
+
+
+def _serialize(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def _csv_lines(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([_serialize(value) for value in row])
+
+
+def _ndjson_lines(columns, rows):
+    for row in rows:
+        yield json.dumps(
+            {column: _serialize(value) for column, value in zip(columns, row)}
+        ) + "\n"
+
+
+def _buffered(lines):
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= BUFFER_SIZE:
+            yield "".join(buffer).encode("utf-8")
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_export(service, kind, fmt="csv", columns=None, start_time=None, end_time=None, compress=False):
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown format {fmt!r}")
+    columns = get_columns(kind, columns)
+    rows = export_rows(service, kind, columns, start_time, end_time)
+
+    lines = _csv_lines(columns, rows) if fmt == "csv" else _ndjson_lines(columns, rows)
+    chunks = _buffered(lines)
+    return _gzipped(chunks) if compress else chunks
@@ -0,0 +1,83 @@
+import datetime
+import logging
+from collections import Counter
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from crena import sharding
+
+from .geohash import center, precision_for_zoom
+from .models import GeoCell, Session
+
+logger = logging.getLogger(__name__)
+
+
+def rollup_day(day):
+    # each shard rolls up the services placed on it, all of them at once
+    return sum(sharding.fan_out(lambda alias: _rollup_shard_day(day, alias)).values())
+
+
+def _rollup_shard_day(day, alias):
+    # one pass over the day's sessions at full precision; the coarser cells are
+    # prefixes of those, so they are summed here instead of in more queries
+    start = datetime.datetime.combine(day, datetime.time.min, tzinfo=datetime.timezone.utc)
+    end = start + datetime.timedelta(days=1)
+    placed = sharding.placed_on(alias)
+    rows = (
+        Session.objects.filter(placed, start_time__gte=start, start_time__lt=end)
+        .exclude(geohash="")
+        .order_by()
+        .values("service_id", "geohash")
+        .annotate(
+            # sampled sessions stand for 1/rate sessions, see analytics.sampling
+            sessions=models.Sum(
+                models.ExpressionWrapper(
+                    models.Value(1.0) / models.F("sample_rate"), output_field=models.FloatField()
+                )
+            )
+        )
+    )
+
+    cells = Counter()
+    for row in rows.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+        for precision in range(1, len(row["geohash"]) + 1):
+            cells[row["service_id"], precision, row["geohash"][:precision]] += row["sessions"]
+
+    with transaction.atomic():
+        GeoCell.objects.filter(placed, date=day).delete()
+        GeoCell.objects.bulk_create(
+            [
+                GeoCell(service_id=service_id, date=day, precision=precision, cell=cell, sessions=round(sessions))
+                for (service_id, precision, cell), sessions in cells.items()
+            ],
+            batch_size=settings.BULK_INSERT_BATCH_SIZE,
+        )
+    return len(cells)
+
+
+def rollup_recent(now=None):
+    # today, plus yesterday until its last sessions are surely in
+    now = now or timezone.now()
+    days = {now.date(), (now - datetime.timedelta(minutes=settings.GEO_ROLLUP_GRACE_MINUTES)).date()}
+    return {day: rollup_day(day) for day in sorted(days)}
+
+
+def map_cells(service, start, end, zoom, within=""):
+    precision = max(precision_for_zoom(zoom, settings.GEOHASH_PRECISION), len(within))
+    rows = GeoCell.objects.filter(service=service, precision=precision, date__gte=start, date__lte=end)
+    if within:
+        rows = rows.filter(cell__startswith=within)
+    rows = (
+        rows.values("cell")
+        .annotate(sessions=models.Sum("sessions"))
+        .order_by("-sessions")
+    )
+    cells = []
+    for row in rows:
+        latitude, longitude = center(row["cell"])
+        cells.append(
+            {"cell": row["cell"], "latitude": latitude, "longitude": longitude, "sessions": row["sessions"]}
+        )
+    return precision, cells
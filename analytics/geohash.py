@@ -0,0 +1,59 @@
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {char: index for index, char in enumerate(BASE32)}
+
+
+def encode(latitude, longitude, precision=12):
+    # standard geohash: bits alternate between longitude and latitude, five per char
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        current, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (current[0] + current[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            current[0] = middle
+        else:
+            current[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def bounds(cell):
+    # (south, west, north, east) of a cell
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in cell:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            current = lon_range if even else lat_range
+            middle = (current[0] + current[1]) / 2
+            if value >> shift & 1:
+                current[0] = middle
+            else:
+                current[1] = middle
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def center(cell):
+    south, west, north, east = bounds(cell)
+    return (south + north) / 2, (west + east) / 2
+
+
+def precision_for_zoom(zoom, max_precision):
+    # roughly one cell per 32-64 screen pixels of a 256px web map tile
+    for max_zoom, precision in ((2, 1), (5, 2), (7, 3), (10, 4), (12, 5)):
+        if zoom <= max_zoom:
+            return min(precision, max_precision)
+    return max_precision
@@ -0,0 +1,265 @@
+import datetime
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, models, router, transaction
+from django.utils import timezone
+
+from core.models import Service
+from crena import sharding
+from . import archive, versions
+from .deletion import raw_delete
+from .models import Hit, LoadTimeSketch
+from .sketches import DDSketch
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = {"p50": 0.5, "p75": 0.75, "p95": 0.95, "p99": 0.99}
+HOUR_US = 3600 * 10**6
+DAY_US = 24 * HOUR_US
+
+_lock = threading.Lock()
+_pending = {}
+_last_flush = time.monotonic()
+
+
+def _hour(value):
+    return value.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def _day(value):
+    return _hour(value).replace(hour=0)
+
+
+def _sketch():
+    return DDSketch(settings.LOAD_TIME_SKETCH_ACCURACY)
+
+
+def _keys(start_time, location):
+    # a hit counts for its service's hour and, with a location, for its page's day
+    yield _hour(start_time), ""
+    if location:
+        yield _day(start_time), location
+
+
+def record(service_id, location, start_time, load_time, sample_rate=1.0):
+    # called for every new hit; the process sums its hits up until the next flush
+    if load_time is None or load_time <= 0:
+        return
+    with _lock:
+        for period, page in _keys(start_time, location):
+            key = service_id, period, page
+            sketch = _pending.get(key)
+            if sketch is None:
+                sketch = _pending[key] = _sketch()
+            sketch.add(load_time, 1 / sample_rate)
+
+
+def maybe_flush():
+    # after a task or an embedded batch, outside the ingestion transaction
+    if time.monotonic() - _last_flush > settings.LOAD_TIME_FLUSH_INTERVAL:
+        flush()
+
+
+def flush():
+    # appends a row per key; compact() folds the rows of a key into one later
+    global _last_flush
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+    if not pending:
+        return 0
+
+    # services deleted in the meantime would fail the foreign key
+    services = set(Service.objects.filter(pk__in={key[0] for key in pending}).values_list("pk", flat=True))
+    rows = [
+        LoadTimeSketch(service_id=service_id, start_time=period, location=location, sketch=sketch.to_bytes())
+        for (service_id, period, location), sketch in pending.items()
+        if service_id in services
+    ]
+    try:
+        with transaction.atomic(using=router.db_for_write(LoadTimeSketch)):
+            LoadTimeSketch.objects.bulk_create(rows, batch_size=settings.BULK_INSERT_BATCH_SIZE)
+    except DatabaseError as e:
+        # kept for the next flush instead of lost
+        logger.exception(e)
+        with _lock:
+            for key, sketch in pending.items():
+                if key in _pending:
+                    sketch.merge(_pending[key])
+                _pending[key] = sketch
+        return 0
+    return len(rows)
+
+
+def compact(now=None):
+    # merges the rows of every key that has several; batches can carry hits back to
+    # BATCH_MAX_EVENT_AGE, so older keys get no new rows
+    now = now or timezone.now()
+    since = _day(now - datetime.timedelta(seconds=settings.BATCH_MAX_EVENT_AGE))
+    recent = LoadTimeSketch.objects.filter(start_time__gte=since)
+    duplicated = {
+        (service_id, start_time, location)
+        for service_id, start_time, location, rows in recent.order_by()
+        .values_list("service_id", "start_time", "location")
+        .annotate(rows=models.Count("pk"))
+        if rows > 1
+    }
+    if not duplicated:
+        return 0
+
+    using = router.db_for_write(LoadTimeSketch)
+    with transaction.atomic(using=using):
+        # locked, so a compaction running alongside waits and then skips the deleted rows
+        rows = (
+            recent.select_for_update()
+            .filter(service_id__in={key[0] for key in duplicated})
+            .values_list("pk", "service_id", "start_time", "location", "sketch")
+        )
+        datas = defaultdict(list)
+        pks = []
+        for pk, service_id, start_time, location, data in rows:
+            key = service_id, start_time, location
+            if key in duplicated:
+                datas[key].append(data)
+                pks.append(pk)
+        merged = {key: DDSketch.from_many(data, settings.LOAD_TIME_SKETCH_ACCURACY) for key, data in datas.items()}
+        for offset in range(0, len(pks), settings.DELETION_BATCH_SIZE):
+            raw_delete(LoadTimeSketch, "id", pks[offset:offset + settings.DELETION_BATCH_SIZE], using)
+        LoadTimeSketch.objects.bulk_create(
+            [
+                LoadTimeSketch(service_id=service_id, start_time=start_time, location=location, sketch=sketch.to_bytes())
+                for (service_id, start_time, location), sketch in merged.items()
+            ],
+            batch_size=settings.BULK_INSERT_BATCH_SIZE,
+        )
+    return len(pks) - len(merged)
+
+
+def expire(service, before):
+    # the rows whose whole hour or day lies before a retention cutoff; the ones that
+    # straddle it stay until the next run
+    rows = LoadTimeSketch.objects.filter(service=service).filter(
+        models.Q(location="", start_time__lt=_hour(before)) | models.Q(start_time__lt=_day(before))
+    )
+    deleted, _ = rows.delete()
+    if deleted:
+        versions.bump(service.pk)
+    return deleted
+
+
+def window(service, start_time, end_time, locations=()):
+    # the service's load times over the window, to the hour, and those of the given
+    # pages, to the day, merged from the sketch rows without touching any hit
+    # two range reads on the (service, location, start_time) index; OR-ed into one,
+    # the planners fall back to every row of the service
+    rows = LoadTimeSketch.objects.filter(service=service, start_time__lt=end_time)
+    accuracy = settings.LOAD_TIME_SKETCH_ACCURACY
+    total = DDSketch.from_many(
+        rows.filter(location="", start_time__gte=_hour(start_time)).values_list("sketch", flat=True), accuracy
+    )
+    datas = defaultdict(list)
+    pages = [location for location in locations if location]
+    if pages:
+        for location, data in rows.filter(location__in=pages, start_time__gte=_day(start_time)).values_list(
+            "location", "sketch"
+        ):
+            datas[location].append(data)
+    pages = {location: DDSketch.from_many(datas[location], accuracy) for location in pages}
+    return total, pages
+
+
+def from_hits(hits, archived=None, locations=()):
+    # a segment has no sketch rows of its own, so its hits are summed up in one
+    # unsorted pass, and so are its archived ones
+    total = _sketch()
+    pages = {location: _sketch() for location in locations if location}
+    rows = hits.filter(load_time__isnull=False).order_by().values_list("location", "load_time", "session__sample_rate")
+    for location, load_time, rate in rows.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+        total.add(load_time, 1 / rate)
+        if location in pages:
+            pages[location].add(load_time, 1 / rate)
+    if archived:
+        for _, codes, dictionary, values, weights in archived.load_times():
+            total.add_many(values, weights)
+            for code, location in enumerate(dictionary):
+                if location in pages:
+                    matched = codes == code
+                    pages[location].add_many(values[matched], weights[matched])
+    return total, pages
+
+
+def _groups(keys, values, weights):
+    # the values and weights of every distinct key, from one sort
+    order = np.argsort(keys, kind="stable")
+    keys, values, weights = keys[order], values[order], weights[order]
+    unique, starts = np.unique(keys, return_index=True)
+    ends = np.append(starts[1:], len(keys))
+    for key, start, end in zip(unique.tolist(), starts.tolist(), ends.tolist()):
+        yield key, values[start:end], weights[start:end]
+
+
+def summary(sketch):
+    if not sketch:
+        return None
+    return {name: round(sketch.quantile(q), 1) for name, q in QUANTILES.items()}
+
+
+def rebuild(service, start_time, end_time, log=logger.info):
+    # recomputes a service's sketch rows over whole UTC days from its live and archived
+    # hits: those from before sketches were kept, or from before an accuracy change.
+    # Today is left to ingestion, whose rows would otherwise count twice
+    start = _day(start_time)
+    end = min(_day(end_time) + datetime.timedelta(days=1), _day(timezone.now()))
+    if start >= end:
+        return 0
+
+    sketches = defaultdict(_sketch)
+    with sharding.service_shard(service):
+        hits = (
+            Hit.objects.filter(service=service, start_time__gte=start, start_time__lt=end, load_time__gt=0)
+            .order_by()
+            .values_list("start_time", "location", "load_time", "session__sample_rate")
+        )
+        for hit_time, location, load_time, rate in hits.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+            for key in _keys(hit_time, location):
+                sketches[key].add(load_time, 1 / rate)
+
+    archived = archive.query(service, start, end)
+    if archived:
+        epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+        for times, codes, dictionary, values, weights in archived.load_times():
+            for hour, hour_values, hour_weights in _groups(times // HOUR_US, values, weights):
+                sketches[epoch + datetime.timedelta(microseconds=hour * HOUR_US), ""].add_many(
+                    hour_values, hour_weights
+                )
+            paged = codes >= 0
+            days = (times[paged] // DAY_US) * len(dictionary) + codes[paged]
+            for group, page_values, page_weights in _groups(days, values[paged], weights[paged]):
+                day, code = divmod(group, len(dictionary))
+                if dictionary[code]:
+                    sketches[epoch + datetime.timedelta(microseconds=day * DAY_US), dictionary[code]].add_many(
+                        page_values, page_weights
+                    )
+
+    with transaction.atomic(using=router.db_for_write(LoadTimeSketch)):
+        LoadTimeSketch.objects.filter(service=service, start_time__gte=start, start_time__lt=end).delete()
+        LoadTimeSketch.objects.bulk_create(
+            [
+                LoadTimeSketch(service=service, start_time=period, location=location, sketch=sketch.to_bytes())
+                for (period, location), sketch in sketches.items()
+            ],
+            batch_size=settings.BULK_INSERT_BATCH_SIZE,
+        )
+    versions.bump(service.pk)
+    log(f"Rebuilt {len(sketches)} load time sketches of {service.uuid} from {start.date()} to {end.date()}")
+    return len(sketches)
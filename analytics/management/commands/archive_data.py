@@ -0,0 +1,32 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import Service
+from analytics.archive import archive_closed_months
+
+
+class Command(BaseCommand):
+    help = "Move closed months of sessions and hits into the columnar cold storage under ARCHIVE_ROOT."
+
+    def add_arguments(self, parser):
+        parser.add_argument("service_uuids", nargs="*", help="The services to archive; all without any.")
+        parser.add_argument(
+            "--after-days",
+            type=int,
+            default=settings.ARCHIVE_AFTER_DAYS,
+            help="Archive the months that ended at least this many days ago.",
+        )
+
+    def handle(self, *args, **options):
+        if options["after_days"] is None:
+            raise CommandError("Set ARCHIVE_AFTER_DAYS or pass --after-days")
+        services = Service.objects.order_by("pk")
+        if options["service_uuids"]:
+            services = services.filter(uuid__in=options["service_uuids"])
+
+        before = timezone.now() - datetime.timedelta(days=options["after_days"])
+        archived = archive_closed_months(before, list(services), log=self.stdout.write)
+        self.stdout.write(f"Archived {archived} sessions")
@@ -0,0 +1,113 @@
+import random
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.utils import timezone
+
+from core.models import Service, User
+from analytics.bulk import bulk_insert
+from analytics.models import Session, Hit
+from crena.db import parse_database_url
+
+PAGES = [f"/page/{n}" for n in range(200)]
+REFERRERS = ["", "https://www.google.com/", "https://news.ycombinator.com/", "https://t.co/"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare insert and aggregate throughput of database backends, e.g. "
+        "--url sqlite:///tmp/bench.sqlite3 --url postgres://user@localhost/bench"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", action="append", required=True, help="Database url to benchmark.")
+        parser.add_argument("--sessions", type=int, default=20000)
+        parser.add_argument("--hits-per-session", type=int, default=5)
+        parser.add_argument("--batch", type=int, default=2000, help="Sessions per insert batch.")
+        parser.add_argument("--keep", action="store_true", help="Keep the generated rows.")
+
+    def handle(self, *args, **options):
+        results = []
+        for n, url in enumerate(options["url"]):
+            alias = f"benchmark_{n}"
+            try:
+                connections.databases[alias] = {
+                    **connections.databases[DEFAULT_DB_ALIAS],
+                    **parse_database_url(url),
+                }
+            except ValueError as e:
+                raise CommandError(str(e))
+            try:
+                call_command("migrate", database=alias, verbosity=0)
+                results.append((url, *self.run(alias, options)))
+            finally:
+                connections[alias].close()
+                del connections.databases[alias]
+
+        self.stdout.write(f"{'backend':<40} {'insert rows/s':>14} {'aggregates s':>13}")
+        for url, insert_rate, aggregate_time in results:
+            self.stdout.write(f"{url.split('@')[-1]:<40} {insert_rate:>14,.0f} {aggregate_time:>13.3f}")
+
+    def run(self, alias, options):
+        rng = random.Random(0)
+        owner = User.objects.db_manager(alias).create(email=f"benchmark-{time.time_ns()}@localhost")
+        service = Service.objects.db_manager(alias).create(
+            owner=owner, collaborators=owner, name="benchmark"
+        )
+        now = timezone.now()
+
+        rows = 0
+        started = time.perf_counter()
+        for offset in range(0, options["sessions"], options["batch"]):
+            count = min(options["batch"], options["sessions"] - offset)
+            with transaction.atomic(using=alias):
+                sessions = bulk_insert(
+                    Session,
+                    [
+                        Session(
+                            service=service,
+                            start_time=now - timezone.timedelta(seconds=rng.randrange(30 * 86400)),
+                            browser=rng.choice(["Firefox", "Chrome", "Safari"]),
+                            device_type=rng.choice(["PHONE", "DESKTOP", "TABLET"]),
+                            country=rng.choice(["DE", "US", "IN", "FR"]),
+                        )
+                        for _ in range(count)
+                    ],
+                    using=alias,
+                )
+                hits = [
+                    Hit(
+                        session=session,
+                        service=service,
+                        start_time=session.start_time + timezone.timedelta(seconds=15 * n),
+                        location=rng.choice(PAGES),
+                        referrer=rng.choice(REFERRERS),
+                    )
+                    for session in sessions
+                    for n in range(options["hits_per_session"])
+                ]
+                bulk_insert(Hit, hits, using=alias)
+            rows += len(sessions) + len(hits)
+        insert_rate = rows / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        start_time = now - timezone.timedelta(days=30)
+        sessions = Session.objects.using(alias).filter(service=service, start_time__gt=start_time)
+        hits = Hit.objects.using(alias).filter(service=service, start_time__gt=start_time)
+        sessions.count()
+        hits.count()
+        list(hits.values("location").annotate(count=models.Count("location")).order_by("-count")[:300])
+        list(hits.values("referrer").annotate(count=models.Count("referrer")).order_by("-count")[:300])
+        for field in ("country", "browser", "device_type"):
+            list(sessions.values(field).annotate(count=models.Count(field)).order_by("-count")[:300])
+        aggregate_time = time.perf_counter() - started
+
+        if not options["keep"]:
+            Hit.objects.using(alias).filter(service=service)._raw_delete(alias)
+            Session.objects.using(alias).filter(service=service)._raw_delete(alias)
+            service.delete()
+            owner.delete()
+
+        return insert_rate, aggregate_time
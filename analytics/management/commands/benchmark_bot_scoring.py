@@ -0,0 +1,49 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from analytics.bots import score_request
+
+TARGET_RATE = 10000
+
+
+class Command(BaseCommand):
+    help = "Measure the throughput of the bot scoring stage against the configured cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=100000)
+        parser.add_argument("--sessions", type=int, default=5000)
+        parser.add_argument("--services", type=int, default=50)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        sessions = [
+            (
+                rng.randrange(options["services"]),
+                "%064x" % rng.getrandbits(256),
+                f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}",
+            )
+            for _ in range(options["sessions"])
+        ]
+
+        # replay the requests on a simulated clock spread at the target rate
+        flagged = 0
+        now = time.time()
+        started = time.perf_counter()
+        for n in range(options["requests"]):
+            service_pk, association_hash, ip = rng.choice(sessions)
+            verdict = score_request(
+                service_pk, association_hash, ip, rng.random() < 0.6, now=now + n / TARGET_RATE
+            )
+            flagged += verdict.is_bot
+        elapsed = time.perf_counter() - started
+
+        rate = options["requests"] / elapsed
+        self.stdout.write(f"requests:  {options['requests']}")
+        self.stdout.write(f"elapsed:   {elapsed:.2f}s")
+        self.stdout.write(f"rate:      {rate:,.0f} req/s (target {TARGET_RATE:,} req/s)")
+        self.stdout.write(f"flagged:   {flagged}")
+        if rate < TARGET_RATE:
+            self.stdout.write(self.style.WARNING("below target rate for a single process"))
@@ -0,0 +1,93 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from core.models import Service, User
+from analytics.embedded import EmbeddedWriter
+from analytics.models import Session, Hit
+from analytics.tasks import ingress_request
+
+USER_AGENTS = [
+    "Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/126.0 Safari/537.36",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare ingestion throughput of concurrent per-event writers (what several "
+        "Celery worker processes do) with the single embedded writer thread."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=5000)
+        parser.add_argument("--concurrency", type=int, default=4, help="Concurrent per-event writers.")
+
+    def handle(self, *args, **options):
+        owner = User.objects.create(email=f"embedded-benchmark-{time.time_ns()}@localhost")
+        service = Service.objects.create(owner=owner, collaborators=owner, name="embedded benchmark")
+        try:
+            events = self.events(service, options["events"])
+            concurrent_rate, errors = self.run_concurrent(events, options["concurrency"])
+            embedded_rate = self.run_embedded(events)
+        finally:
+            Hit.objects.filter(service=service)._raw_delete(Hit.objects.db)
+            Session.objects.filter(service=service)._raw_delete(Session.objects.db)
+            service.delete()
+            owner.delete()
+
+        self.stdout.write(
+            f"{options['concurrency']} concurrent writers: {concurrent_rate:,.0f} events/s, {errors} failed"
+        )
+        self.stdout.write(f"embedded writer:      {embedded_rate:,.0f} events/s")
+
+    def events(self, service, count):
+        rng = random.Random(0)
+        return [
+            (
+                str(service.uuid),
+                "JS",
+                timezone.now(),
+                {"location": f"/page/{rng.randrange(50)}"},
+                f"10.0.{rng.randrange(64)}.{rng.randrange(1, 255)}",
+                "",
+                rng.choice(USER_AGENTS),
+            )
+            for _ in range(count)
+        ]
+
+    def run_concurrent(self, events, concurrency):
+        errors = []
+
+        def work(chunk):
+            for event in chunk:
+                try:
+                    ingress_request(*event)
+                except Exception as e:
+                    errors.append(e)
+            connection.close()
+
+        threads = [
+            threading.Thread(target=work, args=(events[n::concurrency],)) for n in range(concurrency)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(events) / (time.perf_counter() - started), len(errors)
+
+    def run_embedded(self, events):
+        writer = EmbeddedWriter(maxsize=len(events) + 1)
+        started = time.perf_counter()
+        for event in events:
+            writer.submit(ingress_request, *event)
+        writer.queue.join()
+        elapsed = time.perf_counter() - started
+        writer.stop()
+        return len(events) / elapsed
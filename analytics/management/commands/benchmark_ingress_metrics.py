@@ -0,0 +1,66 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from core.models import Service, User
+from analytics.models import Session, Hit
+from analytics.tasks import ingress_request
+
+USER_AGENTS = [
+    "Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/126.0 Safari/537.36",
+]
+
+
+class Command(BaseCommand):
+    help = "Measure the overhead of ingestion metrics by running ingress_request with and without them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500, help="Requests per round.")
+        parser.add_argument("--rounds", type=int, default=6)
+
+    def handle(self, *args, **options):
+        owner = User.objects.create(email=f"metrics-benchmark-{time.time_ns()}@localhost")
+        service = Service.objects.create(owner=owner, collaborators=owner, name="metrics benchmark")
+        rng = random.Random(0)
+        timings = {True: [], False: []}
+
+        try:
+            # round 0 only warms up; the others alternate so drift (table growth, cache
+            # churn) hits both sides
+            for round_number in range(options["rounds"] + 1):
+                enabled = round_number % 2 == 1
+                with override_settings(METRICS_ENABLED=enabled):
+                    started = time.perf_counter()
+                    for n in range(options["requests"]):
+                        ingress_request(
+                            str(service.uuid),
+                            "JS",
+                            timezone.now(),
+                            {"location": f"/page/{rng.randrange(50)}", "loadTime": 100},
+                            f"10.0.{rng.randrange(256)}.{rng.randrange(1, 255)}",
+                            "",
+                            rng.choice(USER_AGENTS),
+                        )
+                    if round_number:
+                        timings[enabled].append(time.perf_counter() - started)
+        finally:
+            Hit.objects.filter(service=service)._raw_delete(Hit.objects.db)
+            Session.objects.filter(service=service)._raw_delete(Session.objects.db)
+            service.delete()
+            owner.delete()
+
+        per_request = {
+            enabled: sum(values) / (len(values) * options["requests"])
+            for enabled, values in timings.items()
+        }
+        overhead = (per_request[True] - per_request[False]) / per_request[False] * 100
+        self.stdout.write(f"without metrics: {per_request[False] * 1000:.3f} ms/request")
+        self.stdout.write(f"with metrics:    {per_request[True] * 1000:.3f} ms/request")
+        self.stdout.write(f"overhead:        {overhead:.2f}%")
+        if overhead >= 2:
+            self.stdout.write(self.style.WARNING("overhead is above the 2% budget"))
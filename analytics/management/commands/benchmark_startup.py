@@ -0,0 +1,133 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+# run in a fresh interpreter per profile and run, so nothing is imported yet. It times
+# the stages a Celery worker's main process or a preloading server goes through, then
+# forks a child like the prefork pool does and times its first hit and the memory it
+# stops sharing with the parent by the time it has collected garbage
+PROBE = """
+import gc, json, os, sys, time
+
+def memory_kb(path, prefix):
+    try:
+        with open(path) as lines:
+            return sum(int(line.split()[1]) for line in lines if line.startswith(prefix))
+    except OSError:
+        return None
+
+preload = sys.argv[1] == "1"
+stages = {}
+started = time.perf_counter()
+import django
+django.setup()
+stages["setup_ms"] = time.perf_counter() - started
+from django.conf import settings
+from django.urls import get_resolver
+mark = time.perf_counter()
+from analytics import tasks
+stages["tasks_ms"] = time.perf_counter() - mark
+mark = time.perf_counter()
+get_resolver().url_patterns
+stages["urls_ms"] = time.perf_counter() - mark
+mark = time.perf_counter()
+if preload:
+    tasks.preload()
+stages["preload_ms"] = time.perf_counter() - mark
+stages["ready_ms"] = time.perf_counter() - started
+
+read, write = os.pipe()
+pid = os.fork()
+if not pid:
+    before = memory_kb("/proc/self/smaps_rollup", "Private_")
+    mark = time.perf_counter()
+    tasks.user_agents.parse(sys.argv[2])
+    tasks._geoip_lookup("203.0.113.7")
+    first_hit = time.perf_counter() - mark
+    gc.collect()
+    after = memory_kb("/proc/self/smaps_rollup", "Private_")
+    os.write(write, json.dumps([first_hit, None if before is None else after - before]).encode())
+    os._exit(0)
+os.waitpid(pid, 0)
+first_hit, private = json.loads(os.read(read, 4096))
+stages["first_hit_ms"] = first_hit
+for name in stages:
+    stages[name] = round(stages[name] * 1000, 2)
+stages.update(
+    child_private_kb=private,
+    apps=len(settings.INSTALLED_APPS),
+    modules=len(sys.modules),
+    rss_kb=memory_kb("/proc/self/status", "VmRSS"),
+)
+print(json.dumps(stages))
+"""
+
+CHILD_USER_AGENT = (
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 "
+    "(KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Report the cold start of each PROCESS_PROFILE, with and without preloading: the "
+        "time to set Django up, load the URLs and the ingestion tasks and preload, and a "
+        "forked child's first hit and unshared memory. Every run is a fresh interpreter."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", default="ingest,full", help="Comma-separated PROCESS_PROFILE values.")
+        parser.add_argument("--runs", type=int, default=5, help="Runs per profile; medians are reported.")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        if not hasattr(os, "fork"):
+            raise CommandError("The startup benchmark forks like the prefork pool, which needs os.fork")
+        results = []
+        for profile in options["profiles"].split(","):
+            for preload in (False, True):
+                runs = [self.probe(profile, preload) for _ in range(options["runs"])]
+                results.append(
+                    {
+                        "profile": profile,
+                        "preload": preload,
+                        **{
+                            name: statistics.median(run[name] for run in runs) if runs[0][name] is not None else None
+                            for name in runs[0]
+                        },
+                    }
+                )
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for result in results:
+            self.write_result(result)
+
+    def probe(self, profile, preload):
+        env = {**os.environ, "PROCESS_PROFILE": profile}
+        done = subprocess.run(
+            [sys.executable, "-c", PROBE, "1" if preload else "0", CHILD_USER_AGENT],
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if done.returncode:
+            raise CommandError(f"The {profile} profile failed to start:\n{done.stderr[-2000:]}")
+        return json.loads(done.stdout.splitlines()[-1])
+
+    def write_result(self, result):
+        self.stdout.write(
+            f"{result['profile']}{' with preload' if result['preload'] else ''}: "
+            f"{result['apps']:.0f} apps, {result['modules']:.0f} modules"
+        )
+        for name in ("setup_ms", "tasks_ms", "urls_ms", "preload_ms", "ready_ms", "first_hit_ms"):
+            self.stdout.write(f"  {name[:-3]:<10} {result[name]:>9.2f} ms")
+        if result["rss_kb"] is not None:
+            self.stdout.write(f"  {'rss':<10} {result['rss_kb'] / 1024:>9.2f} MB when ready")
+        if result["child_private_kb"] is not None:
+            self.stdout.write(f"  {'child':<10} {result['child_private_kb'] / 1024:>9.2f} MB unshared after its first hit")
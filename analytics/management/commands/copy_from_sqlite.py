@@ -0,0 +1,102 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import Max, Min
+
+from analytics import partitions, versions
+from analytics.bulk import bulk_insert
+from core.models import Service
+
+SOURCE_ALIAS = "sqlite_source"
+DEFAULT_MODELS = [
+    "core.User",
+    "core.Service",
+    "analytics.Session",
+    "analytics.Hit",
+    "analytics.DeletionJob",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy users, services and analytics data from an existing SQLite file into the "
+        "configured (migrated, empty) database, keeping primary keys."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="Path of the SQLite database file.")
+        parser.add_argument("--database", default="default", help="Target database alias.")
+        parser.add_argument("--models", nargs="*", default=DEFAULT_MODELS)
+        parser.add_argument("--chunk-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        target = options["database"]
+        connections.databases[SOURCE_ALIAS] = {
+            **connections.databases[target],
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": options["source"],
+        }
+        try:
+            models = [apps.get_model(label) for label in options["models"]]
+        except LookupError as e:
+            raise CommandError(str(e))
+
+        try:
+            for model in list(models):
+                models.extend(
+                    field.remote_field.through
+                    for field in model._meta.local_many_to_many
+                    if field.remote_field.through._meta.auto_created
+                )
+            for model in models:
+                self.copy_model(model, target, options["chunk_size"])
+        finally:
+            connections[SOURCE_ALIAS].close()
+            del connections.databases[SOURCE_ALIAS]
+
+        # the copied rows kept their ids, so move the sequences past them
+        connection = connections[target]
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        if statements:
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+
+        # API clients may hold validators of the services' data from before the copy
+        for pk in Service.objects.using(target).values_list("pk", flat=True):
+            versions.bump(pk)
+
+    def copy_model(self, model, target, chunk_size):
+        if model._meta.label == "analytics.Hit":
+            self.partition_hits(model, target)
+        rows = model._base_manager.using(SOURCE_ALIAS).order_by("pk").iterator(chunk_size=chunk_size)
+        copied = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= chunk_size:
+                copied += self.write(model, batch, target)
+                batch = []
+        if batch:
+            copied += self.write(model, batch, target)
+
+        self.stdout.write(f"{model._meta.label}: {copied} rows")
+
+    def partition_hits(self, model, target):
+        # the history usually predates every partition; without these it would all land
+        # in the default partition
+        connection = connections[target]
+        if not partitions.is_partitioned(connection):
+            return
+        span = model._base_manager.using(SOURCE_ALIAS).aggregate(oldest=Min("start_time"), newest=Max("start_time"))
+        if span["oldest"] is None:
+            return
+        created = partitions.cover_range(span["oldest"], span["newest"], connection)
+        if created:
+            self.stdout.write(f"Created {len(created)} hit partitions")
+
+    def write(self, model, batch, target):
+        with transaction.atomic(using=target):
+            bulk_insert(model, batch, using=target, raw=True)
+        return len(batch)
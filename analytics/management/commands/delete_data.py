@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import Service
+from analytics.deletion import run_job
+from analytics.models import DeletionJob
+
+
+class Command(BaseCommand):
+    help = "Queue (or run) the batched deletion of a visitor's data or of data past a retention limit."
+
+    def add_arguments(self, parser):
+        parser.add_argument("service_uuid")
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument("--identifier", help="Delete every session with this identifier.")
+        group.add_argument("--older-than-days", type=int, help="Delete sessions older than this.")
+        parser.add_argument("--now", action="store_true", help="Run the job here instead of queueing it.")
+
+    def handle(self, *args, **options):
+        try:
+            service = Service.objects.get(uuid=options["service_uuid"])
+        except Service.DoesNotExist:
+            raise CommandError(f"Service {options['service_uuid']} does not exist")
+
+        if options["identifier"] is not None:
+            if not options["identifier"].strip():
+                raise CommandError("The identifier must not be empty")
+            job = DeletionJob.objects.create(
+                service=service, kind=DeletionJob.VISITOR, identifier=options["identifier"].strip()
+            )
+        else:
+            job = DeletionJob.objects.create(
+                service=service,
+                kind=DeletionJob.RETENTION,
+                before=timezone.now() - timezone.timedelta(days=options["older_than_days"]),
+            )
+
+        if not options["now"]:
+            self.stdout.write(f"Queued deletion job {job.pk}")
+            return
+
+        run_job(job, max_batches=None)
+        self.stdout.write(
+            f"Deleted {job.sessions_deleted} sessions and {job.hits_deleted} hits (job {job.pk})"
+        )
@@ -0,0 +1,64 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from core.models import Service
+from analytics.exports import EXPORTS, FORMATS, ExportError, stream_export
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        # well-formed, but not a date, like 2024-02-30
+        parsed = None
+    if parsed is None:
+        raise CommandError(f"Invalid timestamp {value!r}")
+    return parsed
+
+
+class Command(BaseCommand):
+    help = "Stream the sessions or hits of a service as CSV or NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("service_uuid")
+        parser.add_argument("kind", choices=sorted(EXPORTS))
+        parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+        parser.add_argument("--columns", default="", help="Comma separated list of columns.")
+        parser.add_argument("--start", help="ISO 8601 start time (inclusive).")
+        parser.add_argument("--end", help="ISO 8601 end time (exclusive).")
+        parser.add_argument("--gzip", action="store_true")
+        parser.add_argument("--output", "-o", help="Output file, defaults to stdout.")
+
+    def handle(self, *args, **options):
+        try:
+            service = Service.objects.get(uuid=options["service_uuid"])
+        except Service.DoesNotExist:
+            raise CommandError(f"Service {options['service_uuid']} does not exist")
+
+        columns = [column for column in options["columns"].split(",") if column]
+        try:
+            chunks = stream_export(
+                service,
+                options["kind"],
+                options["format"],
+                columns=columns,
+                start_time=_parse_time(options["start"]),
+                end_time=_parse_time(options["end"]),
+                compress=options["gzip"],
+            )
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        output = open(options["output"], "wb") if options["output"] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options["output"]:
+                output.close()
+            else:
+                output.flush()
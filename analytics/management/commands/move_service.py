@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Service
+from crena import sharding
+from analytics.shards import MoveError, move_service
+
+
+class Command(BaseCommand):
+    help = "Move a service's sessions and hits to another shard while it keeps collecting data."
+
+    def add_arguments(self, parser):
+        parser.add_argument("service_uuid")
+        parser.add_argument("database", help="The database alias of the target shard.")
+        parser.add_argument("--chunk-size", type=int, help="Rows per copy and delete batch.")
+        parser.add_argument("--grace", type=float, help="Seconds writes are held before the last round, after the placement cache timeout.")
+
+    def handle(self, *args, **options):
+        try:
+            service = Service.objects.get(uuid=options["service_uuid"])
+        except Service.DoesNotExist:
+            raise CommandError(f"Service {options['service_uuid']} does not exist")
+
+        source, _ = sharding.placement(service.uuid)
+        self.stdout.write(f"Moving {service} from {source} to {options['database']}")
+        try:
+            move_service(
+                service,
+                options["database"],
+                chunk_size=options["chunk_size"],
+                grace=options["grace"],
+                log=self.stdout.write,
+            )
+        except MoveError as e:
+            raise CommandError(str(e))
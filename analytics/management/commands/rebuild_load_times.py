@@ -0,0 +1,37 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import Service
+from analytics.loadtimes import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the load time sketches of whole past days from the hits, live and archived, "
+        "e.g. for hits from before sketches were kept or after LOAD_TIME_SKETCH_ACCURACY changed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("service_uuids", nargs="*", help="The services to rebuild; all without any.")
+        parser.add_argument("--days", type=int, default=30, help="Length of the window, ending today.")
+        parser.add_argument("--start", type=datetime.date.fromisoformat, help="First day of the window.")
+        parser.add_argument("--end", type=datetime.date.fromisoformat, help="Day after the window.")
+
+    def handle(self, *args, **options):
+        services = Service.objects.order_by("pk")
+        if options["service_uuids"]:
+            services = services.filter(uuid__in=options["service_uuids"])
+            if services.count() != len(set(options["service_uuids"])):
+                raise CommandError("Not every service exists")
+
+        end = timezone.now()
+        if options["end"]:
+            end = datetime.datetime.combine(options["end"], datetime.time.min, tzinfo=datetime.timezone.utc)
+        start = end - datetime.timedelta(days=options["days"])
+        if options["start"]:
+            start = datetime.datetime.combine(options["start"], datetime.time.min, tzinfo=datetime.timezone.utc)
+
+        for service in services:
+            rebuild(service, start, end - datetime.timedelta(microseconds=1), log=self.stdout.write)
@@ -0,0 +1,26 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from analytics.segments import rollup_day
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the segment bitmaps of whole days for every service, e.g. for days from "
+        "before bitmaps were kept or days that took many late sessions. Until a day is "
+        "rebuilt, segment filters match its missing sessions by their columns."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=30, help="Length of the window, ending today.")
+        parser.add_argument("--start", type=datetime.date.fromisoformat, help="First day of the window.")
+        parser.add_argument("--end", type=datetime.date.fromisoformat, help="Day after the window.")
+
+    def handle(self, *args, **options):
+        end = options["end"] or timezone.now().date() + datetime.timedelta(days=1)
+        day = options["start"] or end - datetime.timedelta(days=options["days"])
+        while day < end:
+            self.stdout.write(f"{day}: {rollup_day(day)} bitmaps")
+            day += datetime.timedelta(days=1)
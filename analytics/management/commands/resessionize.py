@@ -0,0 +1,51 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import Service
+from analytics.resessionize import ResessionizeError, resessionize
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild sessions from their hits over a window, e.g. after association cache "
+        "evictions or a SESSION_MEMORY_TIMEOUT change left them split up."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("service_uuids", nargs="*", help="The services to rebuild; all without any.")
+        parser.add_argument("--days", type=int, default=7, help="Length of the window, ending now.")
+        parser.add_argument("--start", type=datetime.date.fromisoformat, help="First day of the window.")
+        parser.add_argument("--end", type=datetime.date.fromisoformat, help="Day after the window.")
+        parser.add_argument("--timeout", type=int, help="Idle seconds that end a session.")
+        parser.add_argument("--chunk-size", type=int, help="Hits processed at a time.")
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would change.")
+
+    def handle(self, *args, **options):
+        services = Service.objects.order_by("pk")
+        if options["service_uuids"]:
+            services = services.filter(uuid__in=options["service_uuids"])
+            if services.count() != len(set(options["service_uuids"])):
+                raise CommandError("Not every service exists")
+
+        end = timezone.now()
+        if options["end"]:
+            end = datetime.datetime.combine(options["end"], datetime.time.min, tzinfo=datetime.timezone.utc)
+        start = end - datetime.timedelta(days=options["days"])
+        if options["start"]:
+            start = datetime.datetime.combine(options["start"], datetime.time.min, tzinfo=datetime.timezone.utc)
+
+        for service in services:
+            try:
+                resessionize(
+                    service,
+                    start,
+                    end,
+                    timeout=options["timeout"],
+                    chunk_size=options["chunk_size"],
+                    dry_run=options["dry_run"],
+                    log=self.stdout.write,
+                )
+            except ResessionizeError as e:
+                self.stderr.write(f"{service.uuid}: {e}")
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import Service
+from analytics.alerts import TrafficEvaluator
+
+SERVICE_REFRESH_SECONDS = 300
+
+
+class Command(BaseCommand):
+    help = "Evaluate the per-minute traffic counters of every active service and send alerts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Evaluate pending minutes and exit.")
+        parser.add_argument("--interval", type=float, default=10.0, help="Seconds between polls.")
+
+    def handle(self, *args, **options):
+        evaluator = TrafficEvaluator()
+        service_pks = None
+        refreshed = 0.0
+
+        while True:
+            if service_pks is None or time.monotonic() - refreshed > SERVICE_REFRESH_SECONDS:
+                service_pks = list(
+                    Service.objects.filter(status=Service.ACTIVE).values_list("pk", flat=True)
+                )
+                refreshed = time.monotonic()
+
+            alerts = evaluator.run_pending(service_pks)
+            for alert in alerts:
+                self.stdout.write(str(alert))
+
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,160 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+# the series are fixed up front, so the exporter knows every cache key without a registry
+STAGES = (
+    "service_lookup",
+    "ip_filter",
+    "bot_scoring",
+    "session_cache",
+    "ua_parse",
+    "geoip",
+    "session_write",
+    "hit_write",
+    "batch_write",
+    "total",
+)
+COUNTERS = {
+    "events": (),
+    "events_dropped": ("dnt", "ignored_ip", "robot", "bot_score", "inactive_service", "duplicate", "shed", "queue_full", "sampled"),
+    # held back while their service is cut over to another shard
+    "events_deferred": (),
+    "session_cache": ("hit", "miss"),
+    "idempotency_cache": ("hit", "miss"),
+    "beacon_filter": ("passed", "suppressed", "saturated"),
+}
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+_lock = threading.Lock()
+_pending = {}
+_last_flush = time.monotonic()
+
+
+def _path(*parts):
+    return "metrics_" + "_".join(str(part) for part in parts)
+
+
+def _stage_paths(stage):
+    return (
+        tuple(_path("stage", stage, "bucket", index) for index in range(len(BUCKETS))),
+        _path("stage", stage, "sum"),
+        _path("stage", stage, "count"),
+    )
+
+
+# built once, so the hot path does not format keys per event
+_STAGE_PATHS = {stage: _stage_paths(stage) for stage in STAGES}
+
+
+def _maybe_flush():
+    if time.monotonic() - _last_flush > settings.METRICS_FLUSH_INTERVAL:
+        flush()
+
+
+def incr(name, label=None, amount=1):
+    if not settings.METRICS_ENABLED:
+        return
+    path = _path(name, label) if label else _path(name)
+    with _lock:
+        _pending[path] = _pending.get(path, 0) + amount
+    _maybe_flush()
+
+
+def observe(stage, seconds):
+    if not settings.METRICS_ENABLED:
+        return
+    buckets, sum_path, count_path = _STAGE_PATHS[stage]
+    index = bisect_left(BUCKETS, seconds)
+    with _lock:
+        if index < len(buckets):
+            _pending[buckets[index]] = _pending.get(buckets[index], 0) + 1
+        # sums are kept in integer microseconds, since cache backends only incr integers
+        _pending[sum_path] = _pending.get(sum_path, 0) + int(seconds * 1_000_000)
+        _pending[count_path] = _pending.get(count_path, 0) + 1
+    _maybe_flush()
+
+
+@contextmanager
+def timed(stage):
+    if not settings.METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+def flush():
+    # every process adds its local deltas to shared cache counters, which is how the
+    # numbers of all Celery worker processes end up in one place
+    global _last_flush
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+
+    for path, amount in pending.items():
+        if not amount:
+            continue
+        try:
+            cache.incr(path, amount)
+        except ValueError:
+            if not cache.add(path, amount, timeout=None):
+                cache.incr(path, amount)
+
+
+def _series():
+    for buckets, sum_path, count_path in _STAGE_PATHS.values():
+        yield from buckets
+        yield sum_path
+        yield count_path
+    for name, labels in COUNTERS.items():
+        if labels:
+            for label in labels:
+                yield _path(name, label)
+        else:
+            yield _path(name)
+
+
+def render_prometheus():
+    values = cache.get_many(list(_series()))
+    lines = [
+        "# HELP crena_ingress_stage_seconds Time spent in each ingestion stage.",
+        "# TYPE crena_ingress_stage_seconds histogram",
+    ]
+    for stage in STAGES:
+        cumulative = 0
+        for index, bound in enumerate(BUCKETS):
+            cumulative += values.get(_path("stage", stage, "bucket", index), 0)
+            lines.append(f'crena_ingress_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        count = values.get(_path("stage", stage, "count"), 0)
+        lines.append(f'crena_ingress_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+        lines.append(
+            f'crena_ingress_stage_seconds_sum{{stage="{stage}"}} '
+            f'{values.get(_path("stage", stage, "sum"), 0) / 1_000_000}'
+        )
+        lines.append(f'crena_ingress_stage_seconds_count{{stage="{stage}"}} {count}')
+
+    for name, labels in COUNTERS.items():
+        metric = f"crena_ingress_{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        if not labels:
+            lines.append(f"{metric} {values.get(_path(name), 0)}")
+            continue
+        label_name = "reason" if name == "events_dropped" else "result"
+        for label in labels:
+            lines.append(f'{metric}{{{label_name}="{label}"}} {values.get(_path(name, label), 0)}')
+
+    from .queues import get_queue_depths
+
+    lines.append("# TYPE crena_ingress_queue_depth gauge")
+    for queue, depth in sorted(get_queue_depths().items()):
+        lines.append(f'crena_ingress_queue_depth{{queue="{queue}"}} {depth}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-19 11:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0002_initial'),
+        ('core', '0006_service_retention_days'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('VISITOR', 'Visitor data'), ('RETENTION', 'Retention limit')], default='VISITOR', max_length=10, verbose_name='kind')),
+                ('identifier', models.TextField(blank=True, verbose_name='identifier')),
+                ('before', models.DateTimeField(blank=True, null=True, verbose_name='before')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('DONE', 'Done'), ('FAILED', 'Failed')], db_index=True, default='PENDING', max_length=7, verbose_name='status')),
+                ('cursor', models.BigIntegerField(default=0, verbose_name='cursor')),
+                ('sessions_deleted', models.BigIntegerField(default=0, verbose_name='sessions deleted')),
+                ('hits_deleted', models.BigIntegerField(default=0, verbose_name='hits deleted')),
+                ('error', models.TextField(blank=True, verbose_name='error')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='updated')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='finished')),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deletion_jobs', to='core.service', verbose_name='service')),
+            ],
+            options={
+                'verbose_name': 'Deletion job',
+                'verbose_name_plural': 'Deletion jobs',
+                'ordering': ['-created'],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.6 on 2026-10-19 11:53
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0003_deletionjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='hit',
+            name='last_seen',
+            field=models.DateTimeField(default=django.utils.timezone.now, null=True, verbose_name='last seen'),
+        ),
+        migrations.AlterField(
+            model_name='hit',
+            name='start_time',
+            field=models.DateTimeField(default=django.utils.timezone.now, null=True, verbose_name='start time'),
+        ),
+        migrations.AlterField(
+            model_name='hit',
+            name='tracker',
+            field=models.CharField(choices=[('JS', 'JavaScript'), ('PIXEL', 'Pixel (noscript)'), ('SDK', 'Mobile SDK')], default='JS', max_length=10, verbose_name='tracker'),
+        ),
+        migrations.AlterField(
+            model_name='session',
+            name='last_seen',
+            field=models.DateTimeField(default=django.utils.timezone.now, null=True, verbose_name='last seen'),
+        ),
+        migrations.AlterField(
+            model_name='session',
+            name='start_time',
+            field=models.DateTimeField(default=django.utils.timezone.now, null=True, verbose_name='start time'),
+        ),
+    ]
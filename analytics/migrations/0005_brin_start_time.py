@@ -0,0 +1,52 @@
+# Generated by Django 5.2.6 on 2026-10-19 11:55
+
+from django.db import migrations, models
+
+BRIN_INDEXES = [
+    ("analytics_hit_start_time_brin", "analytics_hit"),
+    ("analytics_session_start_time_brin", "analytics_session"),
+]
+
+
+def create_brin_indexes(apps, schema_editor):
+    # start_time only ever grows, so a BRIN index of a few pages replaces a full B-tree
+    # for time-range scans; other backends have no BRIN and keep the composite indexes
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, table in BRIN_INDEXES:
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING brin (start_time) WITH (pages_per_range = 32)"
+        )
+
+
+def drop_brin_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, table in BRIN_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0004_alter_hit_last_seen_alter_hit_start_time_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='hit',
+            name='location',
+            field=models.TextField(blank=True, verbose_name='location'),
+        ),
+        migrations.AlterField(
+            model_name='hit',
+            name='referrer',
+            field=models.TextField(blank=True, verbose_name='referrer'),
+        ),
+        migrations.AlterField(
+            model_name='session',
+            name='user_agent',
+            field=models.TextField(null=True, verbose_name='user agent'),
+        ),
+        migrations.RunPython(create_brin_indexes, drop_brin_indexes),
+    ]
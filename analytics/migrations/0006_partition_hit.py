@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-19 11:57
+
+import django.utils.timezone
+from django.db import migrations, models
+
+from analytics.partitions import partition_hit_table
+
+
+def partition_hits(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    partition_hit_table(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0005_brin_start_time'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='hit',
+            name='start_time',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='start time'),
+        ),
+        # a partitioned table serves the old schema as well, so there is nothing to undo
+        migrations.RunPython(partition_hits, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0006_partition_hit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='sample_rate',
+            field=models.FloatField(default=1.0, verbose_name='sample rate'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0007_session_sample_rate'),
+        ('core', '0007_service_sampling'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='geohash',
+            field=models.CharField(blank=True, default='', max_length=12, verbose_name='geohash'),
+        ),
+        migrations.CreateModel(
+            name='GeoCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='date')),
+                ('precision', models.PositiveSmallIntegerField(verbose_name='precision')),
+                ('cell', models.CharField(max_length=12, verbose_name='cell')),
+                ('sessions', models.PositiveIntegerField(default=0, verbose_name='sessions')),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='geo_cells', to='core.service', verbose_name='service')),
+            ],
+            options={
+                'verbose_name': 'Geo cell',
+                'verbose_name_plural': 'Geo cells',
+                'constraints': [models.UniqueConstraint(fields=('service', 'precision', 'date', 'cell'), name='analytics_geocell_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0008_geo_cells'),
+        ('core', '0007_service_sampling'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SegmentBitmap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='date')),
+                ('dimension', models.CharField(max_length=20, verbose_name='dimension')),
+                ('value', models.TextField(verbose_name='value')),
+                ('sessions', models.PositiveIntegerField(default=0, verbose_name='sessions')),
+                ('bitmap', models.BinaryField(verbose_name='bitmap')),
+                ('through_pk', models.BigIntegerField(default=0, verbose_name='through pk')),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segment_bitmaps', to='core.service', verbose_name='service')),
+            ],
+            options={
+                'verbose_name': 'Segment bitmap',
+                'verbose_name_plural': 'Segment bitmaps',
+                'constraints': [models.UniqueConstraint(fields=('service', 'date', 'dimension', 'value'), name='analytics_segmentbitmap_unique')],
+            },
+        ),
+    ]
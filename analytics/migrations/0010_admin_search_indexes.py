@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0009_segment_bitmaps'),
+        ('core', '0007_service_sampling'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['uuid'], name='analytics_session_uuid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['identifier'], name='analytics_session_ident_like', opclasses=['text_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.6 on 2026-10-19 13:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# hits stored before this migration get no sketches here; the rebuild_load_times
+# command sums them up afterwards, from the shards and the archive too
+
+
+def clear_unparsable_load_times(apps, schema_editor):
+    # anything but a plain positive number becomes NULL, so the cast below cannot fail
+    # and SQLite does not carry text over into the REAL column
+    table = apps.get_model("analytics", "Hit")._meta.db_table
+    if schema_editor.connection.vendor == "postgresql":
+        condition = r"load_time !~ '^\s*[0-9]*\.?[0-9]+\s*$' OR load_time ~ '^[\s0.]*$'"
+    else:
+        condition = "load_time = '' OR load_time GLOB '*[^0-9.]*' OR load_time GLOB '*.*.*' OR CAST(load_time AS REAL) <= 0"
+    schema_editor.execute(f"UPDATE {table} SET load_time = NULL WHERE load_time IS NOT NULL AND ({condition})")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0010_admin_search_indexes'),
+        ('core', '0008_service_placement'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_unparsable_load_times, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='hit',
+            name='load_time',
+            field=models.FloatField(null=True, verbose_name='load time'),
+        ),
+        migrations.CreateModel(
+            name='LoadTimeSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_time', models.DateTimeField(verbose_name='start time')),
+                ('location', models.TextField(blank=True, verbose_name='location')),
+                ('sketch', models.BinaryField(verbose_name='sketch')),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='load_time_sketches', to='core.service', verbose_name='service')),
+            ],
+            options={
+                'verbose_name': 'Load time sketch',
+                'verbose_name_plural': 'Load time sketches',
+                'indexes': [models.Index(fields=['service', 'location', 'start_time'], name='analytics_l_service_12dbac_idx'), models.Index(fields=['start_time'], name='analytics_l_start_t_fb5572_idx')],
+            },
+        ),
+    ]
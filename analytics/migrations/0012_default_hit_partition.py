@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-19 14:02
+
+from django.db import migrations
+
+from analytics.partitions import DEFAULT_PARTITION, create_default_partition, is_partitioned
+
+
+def add_default_partition(apps, schema_editor):
+    connection = schema_editor.connection
+    if is_partitioned(connection):
+        create_default_partition(connection)
+
+
+def remove_default_partition(apps, schema_editor):
+    # only while it is empty; hits in it would have nowhere else to go
+    connection = schema_editor.connection
+    if is_partitioned(connection):
+        schema_editor.execute(
+            f"DO $$ BEGIN IF NOT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION}) THEN "
+            f"DROP TABLE {DEFAULT_PARTITION}; END IF; END $$"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0011_load_time_sketches'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_default_partition, remove_default_partition),
+    ]
@@ -15,10 +15,11 @@ class Session(models.Model):
     service = models.ForeignKey(Service, verbose_name=_("services"), related_name="sessions", on_delete=models.CASCADE)
     identifier = models.TextField(_("identifier"), blank=True)
 
-    start_time = models.DateTimeField(_("start time"), auto_now_add=True, null=True)
-    last_seen = models.DateTimeField(_("last seen"), auto_now=True, null=True)
+    # set explicitly by ingestion; batch uploads carry client timestamps
+    start_time = models.DateTimeField(_("start time"), default=timezone.now, null=True)
+    last_seen = models.DateTimeField(_("last seen"), default=timezone.now, null=True)
 
-    user_agent = models.CharField(_("user agent"), max_length=50, null=True)
+    user_agent = models.TextField(_("user agent"), null=True)
     browser = models.CharField(_("browser"), max_length=50, null=True)
     devices = models.CharField(_("devices"), max_length=50, null=True)
     device_type = models.CharField(
@@ -43,7 +44,11 @@ class Session(models.Model):
     longitude = models.FloatField(_("longitude"), null=True)
     latitude = models.FloatField(_("latitude"), null=True)
     time_zone = models.CharField(_("time zone"), max_length=100, db_index=True, null=True)
+    # GEOHASH_PRECISION characters; the map reads the GeoCell roll-ups built from it
+    geohash = models.CharField(_("geohash"), max_length=12, blank=True, default="")
     is_bounce = models.BooleanField(_("is bounce"), default=False)
+    # the service's sample rate when the session started; it stands for 1/rate sessions
+    sample_rate = models.FloatField(_("sample rate"), default=1.0)
 
     class Meta:
         verbose_name = _("Session")
@@ -53,6 +58,11 @@ class Session(models.Model):
             models.Index(fields=["service", "-start_time"]),
             models.Index(fields=["service", "-last_seen"]),
             models.Index(fields=["service", "identifier"]),
+            # admin search: sessions by uuid, and by identifier prefix across services
+            models.Index(fields=["uuid"], name="analytics_session_uuid_idx"),
+            models.Index(
+                fields=["identifier"], name="analytics_session_ident_like", opclasses=["text_pattern_ops"]
+            ),
         ]
 
     @property
@@ -73,7 +83,8 @@ class Session(models.Model):
         )
     
     def recalculate_bounce(self):
-        bounce = self.hit_set.count() == 1
+        # the start_time bound lets PostgreSQL skip hit partitions older than the session
+        bounce = self.hit_set.filter(start_time__gte=self.start_time).count() == 1
         if bounce != self.is_bounce:
             self.is_bounce = bounce
             self.save()
@@ -83,19 +94,23 @@ class Hit(models.Model):
     session = models.ForeignKey(Session, verbose_name=_("session"), on_delete=models.CASCADE)
     initial = models.BooleanField(_("initial"), db_index=True, default=False)
 
-    start_time = models.DateTimeField(_("start time"), auto_now_add=True, null=True)
-    last_seen = models.DateTimeField(_("last seen"), auto_now=True, null=True)
+    # partition key of the hit table on PostgreSQL, see analytics.partitions
+    start_time = models.DateTimeField(_("start time"), default=timezone.now)
+    last_seen = models.DateTimeField(_("last seen"), default=timezone.now, null=True)
     heartbeats = models.IntegerField(_("heartbeats"), default=0)
     tracker = models.CharField(
         _("tracker"),
         max_length=10,
-        choices=[("JS", "JavaScript"), ("PIXEL", "Pixel (noscript)")],
+        choices=[("JS", "JavaScript"), ("PIXEL", "Pixel (noscript)"), ("SDK", "Mobile SDK")],
         default="JS",
     )
 
-    location = models.TextField(_("location"), db_index=True, blank=True)
-    referrer = models.TextField(_("referrer"), db_index=True, blank=True)
-    load_time = models.CharField(_("load time"), max_length=50, null=True, db_index=True)
+    # no single-column indexes on these wide text columns; stats always narrow by
+    # service and time first (BRIN on start_time for PostgreSQL, see migration 0005)
+    location = models.TextField(_("location"), blank=True)
+    referrer = models.TextField(_("referrer"), blank=True)
+    # milliseconds; percentiles come from the LoadTimeSketch rows, not from this column
+    load_time = models.FloatField(_("load time"), null=True)
 
     service = models.ForeignKey(Service, verbose_name=_("services"), on_delete=models.CASCADE, db_index=True)
 
@@ -119,3 +134,116 @@ class Hit(models.Model):
             "dashboard:service_session",
             kwargs={"pk": self.service.pk, "session_pk": self.session.pk},
         )
+
+
+class GeoCell(models.Model):
+    # sessions per service, day and geohash cell, at every precision up to
+    # GEOHASH_PRECISION, so a map at any zoom is one indexed range read
+    service = models.ForeignKey(Service, verbose_name=_("service"), related_name="geo_cells", on_delete=models.CASCADE)
+    date = models.DateField(_("date"))
+    precision = models.PositiveSmallIntegerField(_("precision"))
+    cell = models.CharField(_("cell"), max_length=12)
+    sessions = models.PositiveIntegerField(_("sessions"), default=0)
+
+    class Meta:
+        verbose_name = _("Geo cell")
+        verbose_name_plural = _("Geo cells")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["service", "precision", "date", "cell"], name="analytics_geocell_unique"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.cell} @ {self.service_id} on {self.date}: {self.sessions}"
+
+
+class SegmentBitmap(models.Model):
+    # the ids of one service's sessions of one day that share a value of one of the
+    # SEGMENT_DIMENSIONS, as a serialized analytics.bitmaps.RoaringBitmap
+    service = models.ForeignKey(
+        Service, verbose_name=_("service"), related_name="segment_bitmaps", on_delete=models.CASCADE
+    )
+    date = models.DateField(_("date"))
+    dimension = models.CharField(_("dimension"), max_length=20)
+    value = models.TextField(_("value"))
+    sessions = models.PositiveIntegerField(_("sessions"), default=0)
+    bitmap = models.BinaryField(_("bitmap"))
+    # the highest session id when the day was built; newer sessions are not in the bitmap
+    through_pk = models.BigIntegerField(_("through pk"), default=0)
+
+    class Meta:
+        verbose_name = _("Segment bitmap")
+        verbose_name_plural = _("Segment bitmaps")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["service", "date", "dimension", "value"], name="analytics_segmentbitmap_unique"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.dimension}={self.value} @ {self.service_id} on {self.date}: {self.sessions}"
+
+
+class LoadTimeSketch(models.Model):
+    # a serialized analytics.sketches.DDSketch of the load times of one service's hits:
+    # of all its pages per hour when location is blank, else of one page per UTC day.
+    # Ingestion appends rows, and analytics.loadtimes merges those of the same key
+    service = models.ForeignKey(
+        Service, verbose_name=_("service"), related_name="load_time_sketches", on_delete=models.CASCADE
+    )
+    start_time = models.DateTimeField(_("start time"))
+    location = models.TextField(_("location"), blank=True)
+    sketch = models.BinaryField(_("sketch"))
+
+    class Meta:
+        verbose_name = _("Load time sketch")
+        verbose_name_plural = _("Load time sketches")
+        indexes = [
+            models.Index(fields=["service", "location", "start_time"]),
+            models.Index(fields=["start_time"]),
+        ]
+
+    def __str__(self):
+        return f"{self.location or '*'} @ {self.service_id} from {self.start_time}"
+
+
+class DeletionJob(models.Model):
+    VISITOR = "VISITOR"
+    RETENTION = "RETENTION"
+    KINDS = [(VISITOR, _("Visitor data")), (RETENTION, _("Retention limit"))]
+
+    PENDING = "PENDING"
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+    STATUSES = [
+        (PENDING, _("Pending")),
+        (RUNNING, _("Running")),
+        (DONE, _("Done")),
+        (FAILED, _("Failed")),
+    ]
+
+    service = models.ForeignKey(Service, verbose_name=_("service"), related_name="deletion_jobs", on_delete=models.CASCADE)
+    kind = models.CharField(_("kind"), max_length=10, choices=KINDS, default=VISITOR)
+    identifier = models.TextField(_("identifier"), blank=True)
+    before = models.DateTimeField(_("before"), null=True, blank=True)
+
+    status = models.CharField(_("status"), max_length=7, choices=STATUSES, default=PENDING, db_index=True)
+    # last deleted session pk; batches resume from here after a restart
+    cursor = models.BigIntegerField(_("cursor"), default=0)
+    sessions_deleted = models.BigIntegerField(_("sessions deleted"), default=0)
+    hits_deleted = models.BigIntegerField(_("hits deleted"), default=0)
+    error = models.TextField(_("error"), blank=True)
+
+    created = models.DateTimeField(_("created"), auto_now_add=True)
+    updated = models.DateTimeField(_("updated"), auto_now=True)
+    finished = models.DateTimeField(_("finished"), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("Deletion job")
+        verbose_name_plural = _("Deletion jobs")
+        ordering = ["-created"]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} @ {self.service_id} [{self.status}]"
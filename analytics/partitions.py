@@ -0,0 +1,223 @@
+import datetime
+import logging
+import re
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+HIT_TABLE = "analytics_hit"
+PARTITION_NAME = re.compile(rf"^{HIT_TABLE}_p(\d{{8}})$")
+# takes the hits no range partition covers (old batch events, copied history), so an
+# insert never fails; the name does not match PARTITION_NAME, so retention keeps it
+DEFAULT_PARTITION = f"{HIT_TABLE}_default"
+
+
+def _hit_connection():
+    from .models import Hit
+
+    return connections[router.db_for_write(Hit)]
+
+
+def interval_start(day, interval=None):
+    interval = interval or settings.HIT_PARTITION_INTERVAL
+    if interval == "month":
+        return day.replace(day=1)
+    if interval == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if interval == "day":
+        return day
+    raise ValueError(f"Unknown partition interval {interval!r}")
+
+
+def next_interval(start, interval=None):
+    interval = interval or settings.HIT_PARTITION_INTERVAL
+    if interval == "month":
+        return (start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    if interval == "week":
+        return start + datetime.timedelta(days=7)
+    return start + datetime.timedelta(days=1)
+
+
+def partition_name(start):
+    return f"{HIT_TABLE}_p{start:%Y%m%d}"
+
+
+def is_partitioned(connection=None):
+    connection = connection or _hit_connection()
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [HIT_TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def list_partitions(connection=None):
+    # [(start date, table name)] of the partitions we created, oldest first
+    connection = connection or _hit_connection()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass(%s)",
+            [HIT_TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((datetime.datetime.strptime(match.group(1), "%Y%m%d").date(), name))
+    return sorted(partitions)
+
+
+def create_default_partition(connection=None):
+    connection = connection or _hit_connection()
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {HIT_TABLE} DEFAULT")
+    return DEFAULT_PARTITION
+
+
+def create_partition(start, connection=None, interval=None):
+    connection = connection or _hit_connection()
+    end = next_interval(start, interval)
+    name = partition_name(start)
+    bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s), to_regclass(%s)", [name, DEFAULT_PARTITION])
+        existing, default = cursor.fetchone()
+        if existing is not None:
+            return name
+        if default is None:
+            cursor.execute(f"CREATE TABLE {name} PARTITION OF {HIT_TABLE} {bounds}")
+            return name
+
+        # the default partition may already hold hits of this range, and postgres refuses
+        # a partition that would leave them there. Hold new ones off, move the range over
+        # and attach the filled table
+        cursor.execute(f"LOCK TABLE {DEFAULT_PARTITION} IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute(f"CREATE TABLE {name} (LIKE {HIT_TABLE} INCLUDING DEFAULTS)")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE start_time >= %s AND start_time < %s "
+            f"RETURNING *) INSERT INTO {name} SELECT * FROM moved",
+            [start, end],
+        )
+        if cursor.rowcount:
+            logger.info(f"Moved {cursor.rowcount} hits from {DEFAULT_PARTITION} into {name}")
+        cursor.execute(f"ALTER TABLE {HIT_TABLE} ATTACH PARTITION {name} {bounds}")
+    return name
+
+
+def cover_range(oldest, newest, connection=None, interval=None):
+    # partitions for every interval between two times, e.g. before copying history in
+    connection = connection or _hit_connection()
+    existing = {name for _, name in list_partitions(connection)}
+    created = []
+    start = interval_start(oldest.date(), interval)
+    while start <= newest.date():
+        if partition_name(start) not in existing:
+            created.append(create_partition(start, connection, interval))
+        start = next_interval(start, interval)
+    return created
+
+
+def ensure_partitions(now=None, ahead=None, connection=None):
+    # hits are written at "now" (batches clamp client clocks to it), so the current
+    # interval plus a few ahead are enough
+    connection = connection or _hit_connection()
+    ahead = ahead if ahead is not None else settings.HIT_PARTITION_PREMAKE
+    start = interval_start((now or timezone.now()).date())
+
+    existing = {name for _, name in list_partitions(connection)}
+    created = []
+    for _ in range(ahead + 1):
+        if partition_name(start) not in existing:
+            created.append(create_partition(start, connection))
+        start = next_interval(start)
+    return created
+
+
+def drop_expired_partitions(before, connection=None):
+    # a partition is dropped only when all of its range lies before the cutoff
+    connection = connection or _hit_connection()
+    dropped = []
+    with connection.cursor() as cursor:
+        for start, name in list_partitions(connection):
+            if next_interval(start) > before.date():
+                break
+            cursor.execute(f"DROP TABLE IF EXISTS {name}")
+            dropped.append(name)
+            logger.info(f"Dropped hit partition {name}")
+    return dropped
+
+
+def maintain_partitions(now=None):
+    now = now or timezone.now()
+    connection = _hit_connection()
+    if not is_partitioned(connection):
+        return [], []
+
+    created = ensure_partitions(now, connection=connection)
+    dropped = []
+    if settings.HIT_RETENTION_DAYS is not None:
+        dropped = drop_expired_partitions(
+            now - timezone.timedelta(days=settings.HIT_RETENTION_DAYS), connection=connection
+        )
+    return created, dropped
+
+
+def partition_hit_table(schema_editor, interval=None):
+    # turn the plain hit table into a range-partitioned one, keeping index names so
+    # later migrations still find them
+    connection = schema_editor.connection
+    execute = schema_editor.execute
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s",
+            [HIT_TABLE, f"{HIT_TABLE}_pkey"],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+            [HIT_TABLE],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f"SELECT min(start_time), max(id) FROM {HIT_TABLE}")
+        oldest, max_id = cursor.fetchone()
+
+    legacy = f"{HIT_TABLE}_unpartitioned"
+    execute(f"UPDATE {HIT_TABLE} SET start_time = now() WHERE start_time IS NULL")
+    execute(f"ALTER TABLE {HIT_TABLE} RENAME TO {legacy}")
+    execute(
+        f"CREATE TABLE {HIT_TABLE} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING IDENTITY) "
+        f"PARTITION BY RANGE (start_time)"
+    )
+    execute(f"ALTER TABLE {HIT_TABLE} ALTER COLUMN start_time SET NOT NULL")
+
+    now = timezone.now()
+    start = interval_start((oldest or now).date(), interval)
+    while start <= interval_start(now.date(), interval):
+        create_partition(start, connection, interval)
+        start = next_interval(start, interval)
+    ensure_partitions(now, connection=connection)
+    create_default_partition(connection)
+
+    execute(f"INSERT INTO {HIT_TABLE} SELECT * FROM {legacy}")
+    execute(f"DROP TABLE {legacy}")
+    # the primary key has to include the partition key
+    execute(f"ALTER TABLE {HIT_TABLE} ADD CONSTRAINT {HIT_TABLE}_pkey PRIMARY KEY (id, start_time)")
+    if max_id is not None:
+        execute(
+            f"SELECT setval(pg_get_serial_sequence('{HIT_TABLE}', 'id'), {int(max_id)})"
+        )
+
+    for name, definition in indexes:
+        execute(definition)
+    for name, definition in foreign_keys:
+        execute(f"ALTER TABLE {HIT_TABLE} ADD CONSTRAINT {name} {definition}")
@@ -0,0 +1,101 @@
+import logging
+import random
+from hashlib import sha256
+
+from celery import current_app
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# every event of a visitor goes to the same visitor bucket, picked by a hash of the
+# visitor, and each bucket has a single worker process, so a visitor's page views,
+# heartbeats and batches are written in the order they came in instead of racing
+# each other for the session. A bucket has two queues: new sessions, page views and
+# batches in ingress_{n}_new, heartbeats in ingress_{n}_hb. Its worker consumes them
+# in -Q order (queue_order_strategy 'priority'), so a new session never waits behind
+# heartbeats, which only extend sessions already written. A heartbeat always follows
+# its own page view, so it cannot overtake it. More buckets spread visitors over more
+# workers, which is how ingestion scales:
+#   celery -A crena worker -Q ingress_0_new,ingress_0_hb -c 1
+#   celery -A crena worker -Q ingress_1_new,ingress_1_hb -c 1
+#   ...
+#   celery -A crena worker -Q maintenance,celery -c 1
+MAINTENANCE = "maintenance"
+INGRESS_BUCKETS = tuple(f"ingress_{n}" for n in range(settings.INGRESS_QUEUE_COUNT))
+INGRESS_QUEUES = tuple(f"{bucket}_{kind}" for bucket in INGRESS_BUCKETS for kind in ("new", "hb"))
+
+QUEUE_DEPTHS_PATH = "ingress_queue_depths"
+
+
+def visitor_queue(service_uuid, ip, user_agent, heartbeat=False):
+    visitor = sha256(f"{service_uuid}{ip}{user_agent}".encode("utf-8")).digest()
+    bucket = INGRESS_BUCKETS[int.from_bytes(visitor[:8], "big") % len(INGRESS_BUCKETS)]
+    return f"{bucket}_hb" if heartbeat else f"{bucket}_new"
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    # a Celery router, so deferred and retried events find their visitor's bucket too.
+    # Only the view can tell a heartbeat (see is_heartbeat) and it names the queue
+    # itself; anything routed here goes ahead in the bucket
+    if name == "analytics.tasks.ingress_request":
+        service_uuid, ip, user_agent = args[0], args[4], args[6]
+    elif name == "analytics.tasks.ingress_batch":
+        service_uuid, ip, user_agent = args[0], args[3], args[4]
+    else:
+        return None
+    return {"queue": visitor_queue(service_uuid, ip, user_agent)}
+
+
+def is_heartbeat(service_uuid, payload):
+    # a guess from a cache marker before the task runs; it only decides what is shed
+    idempotency = payload.get("idempotency")
+    return idempotency is not None and not cache.add(
+        f"ingress_route_hit_{service_uuid}_{idempotency}",
+        True,
+        timeout=settings.SESSION_MEMORY_TIMEOUT,
+    )
+
+
+def sample_queue_depths():
+    depths = {}
+    try:
+        with current_app.connection_for_read() as connection:
+            connection.ensure_connection(max_retries=1)
+            channel = connection.default_channel
+            for name in INGRESS_QUEUES:
+                try:
+                    depths[name] = channel.queue_declare(queue=name, passive=True).message_count
+                except connection.channel_errors:
+                    # nothing was ever routed there
+                    depths[name] = 0
+    except Exception as e:
+        logger.exception(e)
+        return None
+
+    # expires, so a stopped sampler turns shedding off instead of freezing it on
+    cache.set(QUEUE_DEPTHS_PATH, depths, timeout=settings.INGRESS_QUEUE_DEPTH_INTERVAL * 6)
+    return depths
+
+
+def get_queue_depths():
+    return cache.get(QUEUE_DEPTHS_PATH) or {}
+
+
+def should_shed(heartbeat, depths=None):
+    # heartbeats only extend a session, so they go first: sampled above one backlog,
+    # dropped above the next
+    if not heartbeat:
+        return False
+    backlog = sum((depths if depths is not None else get_queue_depths()).values())
+    if backlog >= settings.INGRESS_HEARTBEAT_DROP_DEPTH:
+        shed = True
+    elif backlog >= settings.INGRESS_HEARTBEAT_SAMPLE_DEPTH:
+        shed = random.random() >= settings.INGRESS_HEARTBEAT_SAMPLE_RATE
+    else:
+        shed = False
+    if shed:
+        metrics.incr("events_dropped", "shed")
+    return shed
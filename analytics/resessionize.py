@@ -0,0 +1,298 @@
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import models, router, transaction
+from django.utils import timezone
+
+from crena import sharding
+from . import geo, segments, versions
+from .bulk import bulk_insert, update_rows
+from .deletion import raw_delete
+from .models import Hit, Session
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# carried state of a visitor not seen yet; far enough below any time in ms that the
+# next hit's gap is always over the timeout, and still safe to subtract from
+NOT_SEEN = -(2**61)
+DAY_MS = 86400 * 1000
+
+
+class ResessionizeError(Exception):
+    pass
+
+
+def _ms(value):
+    return int(value.timestamp() * 1000)
+
+
+def split(keys, starts, lasts, carried_reached, carried_start, timeout, by_day=False):
+    # hits sorted by association key, then start time, as int64 arrays in ms. A hit
+    # starts a session when it is a visitor's first, or when it comes more than the
+    # timeout after the latest last_seen of the visitor's earlier hits, like the
+    # association cache expiring in ingress. carried_* hold each hit's visitor's state
+    # from the chunks before. Returns the session starts and the running last_seen
+    first = np.empty(len(keys), dtype=bool)
+    first[0] = True
+    np.not_equal(keys[1:], keys[:-1], out=first[1:])
+
+    # a running max per visitor in one pass: shifting every visitor's values above the
+    # ones before makes a plain cumulative max restart at each of them
+    seeded = np.where(first, np.maximum(lasts, carried_reached), lasts)
+    base = seeded.min()
+    span = seeded.max() - base + 1
+    offset = np.cumsum(first) * span
+    reached = np.maximum.accumulate(seeded - base + offset) - offset + base
+
+    previous = np.empty_like(reached)
+    previous[1:] = reached[:-1]
+    previous[first] = carried_reached[first]
+    new = starts - previous > timeout
+    if by_day:
+        # with AGGRESSIVE_HASH_SALTING a visitor's hash changes with the date
+        previous_start = np.empty_like(starts)
+        previous_start[1:] = starts[:-1]
+        previous_start[first] = carried_start[first]
+        new |= starts // DAY_MS != previous_start // DAY_MS
+    return first, new, reached
+
+
+class Resessionizer:
+    # rebuilds a service's sessions over a window from its hits, chunk by chunk in time
+    # order. Visitors are keyed by ip and user agent, like the association hash, so
+    # sessions without a stored ip are left as they are. A visitor's state carries over
+    # between chunks; memory holds one chunk plus a few ints per visitor and session
+    def __init__(self, service, start, end, timeout=None, chunk_size=None, dry_run=False):
+        if np is None:
+            raise ResessionizeError("Resessionizing needs numpy")
+        self.service = service
+        self.start = start
+        self.end = end
+        self.timeout = (timeout if timeout is not None else settings.SESSION_MEMORY_TIMEOUT) * 1000
+        self.chunk_size = chunk_size or settings.RESESSIONIZE_CHUNK_SIZE
+        self.dry_run = dry_run
+
+        self.keys = {}
+        self.carried_reached = np.full(0, NOT_SEEN, dtype=np.int64)
+        self.carried_start = np.full(0, NOT_SEEN, dtype=np.int64)
+        self.carried_session = np.zeros(0, dtype=np.int64)
+        # sessions kept by a rebuilt one; a later part of one gets a new session
+        self.claimed = set()
+        self.seen = set()
+        self.touched = set()
+        self.days = set()
+        self.placeholder = 0
+        self.counts = {
+            "hits": 0,
+            "hits_relinked": 0,
+            "sessions_before": 0,
+            "sessions_after": 0,
+            "sessions_created": 0,
+            "sessions_deleted": 0,
+        }
+
+    def chunks(self):
+        hits = Hit.objects.filter(
+            service=self.service, start_time__gte=self.start, start_time__lt=self.end, session__ip__isnull=False
+        )
+        after = None
+        while True:
+            page = hits
+            if after is not None:
+                page = page.filter(
+                    models.Q(start_time__gt=after[0]) | models.Q(start_time=after[0], pk__gt=after[1])
+                )
+            rows = list(
+                page.order_by("start_time", "pk").values_list(
+                    "pk", "start_time", "last_seen", "initial", "session_id", "session__ip", "session__user_agent"
+                )[: self.chunk_size]
+            )
+            if not rows:
+                return
+            yield rows
+            after = rows[-1][1], rows[-1][0]
+
+    def columns(self, rows):
+        pks, starts, lasts, initial, sessions, ips, user_agents = zip(*rows)
+        n = len(rows)
+        keys = self.keys
+        codes = np.fromiter(
+            (keys.setdefault(key, len(keys)) for key in zip(ips, user_agents)), dtype=np.int64, count=n
+        )
+        starts_ms = np.fromiter(map(_ms, starts), dtype=np.int64, count=n)
+        lasts_ms = np.fromiter((_ms(last) if last else 0 for last in lasts), dtype=np.int64, count=n)
+        columns = {
+            "pk": np.fromiter(pks, dtype=np.int64, count=n),
+            "start_time": np.array(starts, dtype=object),
+            "key": codes,
+            "start": starts_ms,
+            "last": np.maximum(lasts_ms, starts_ms),
+            "initial": np.fromiter(initial, dtype=bool, count=n),
+            "session": np.fromiter(sessions, dtype=np.int64, count=n),
+        }
+
+        grow = len(keys) - len(self.carried_reached)
+        if grow > 0:
+            self.carried_reached = np.concatenate([self.carried_reached, np.full(grow, NOT_SEEN, dtype=np.int64)])
+            self.carried_start = np.concatenate([self.carried_start, np.full(grow, NOT_SEEN, dtype=np.int64)])
+            self.carried_session = np.concatenate([self.carried_session, np.zeros(grow, dtype=np.int64)])
+        return columns
+
+    def new_sessions(self, templates):
+        # copies of the sessions a split started from; the times are set at the end
+        if self.dry_run:
+            pks = np.arange(self.placeholder - 1, self.placeholder - 1 - len(templates), -1, dtype=np.int64)
+            self.placeholder -= len(templates)
+            return pks
+        originals = Session.objects.in_bulk(set(templates.tolist()))
+        uuid = Session._meta.get_field("uuid")
+        created = []
+        for pk in templates.tolist():
+            session = Session(
+                **{
+                    field.attname: getattr(originals[pk], field.attname)
+                    for field in Session._meta.concrete_fields
+                    if not field.primary_key
+                }
+            )
+            session.uuid = uuid.get_default()
+            created.append(session)
+        return np.fromiter((session.pk for session in bulk_insert(Session, created)), dtype=np.int64)
+
+    def process(self, rows):
+        c = self.columns(rows)
+        order = np.lexsort((c["pk"], c["start"], c["key"]))
+        c = {name: column[order] for name, column in c.items()}
+        keys = c["key"]
+
+        first, new, reached = split(
+            keys,
+            c["start"],
+            c["last"],
+            self.carried_reached[keys],
+            self.carried_start[keys],
+            self.timeout,
+            by_day=settings.AGGRESSIVE_HASH_SALTING,
+        )
+
+        # every new session keeps the session of its first hit, unless an earlier one
+        # has it already; the rest of a visitor's first run continues the carried one
+        group_starts = np.flatnonzero(new | first)
+        group = np.cumsum(new | first) - 1
+        targets = self.carried_session[keys[group_starts]]
+        opened = new[group_starts]
+        candidates = c["session"][group_starts[opened]]
+        _, first_use = np.unique(candidates, return_index=True)
+        taken = np.ones(len(candidates), dtype=bool)
+        taken[first_use] = False
+        taken |= np.fromiter((pk in self.claimed for pk in candidates.tolist()), dtype=bool, count=len(candidates))
+        if taken.any():
+            candidates[taken] = self.new_sessions(candidates[taken])
+            self.counts["sessions_created"] += int(taken.sum())
+        targets[opened] = candidates
+        self.claimed.update(candidates.tolist())
+
+        target = targets[group]
+        changed = (target != c["session"]) | (new != c["initial"])
+
+        last = np.empty(len(keys), dtype=bool)
+        last[-1] = True
+        np.not_equal(keys[:-1], keys[1:], out=last[:-1])
+        self.carried_reached[keys[last]] = reached[last]
+        self.carried_start[keys[last]] = c["start"][last]
+        self.carried_session[keys[last]] = target[last]
+
+        self.counts["hits"] += len(keys)
+        self.counts["hits_relinked"] += int(changed.sum())
+        self.counts["sessions_after"] += int(new.sum())
+        self.seen.update(np.unique(c["session"]).tolist())
+        if not changed.any():
+            return
+        self.touched.update(np.unique(c["session"][changed]).tolist())
+        self.touched.update(np.unique(target[changed]).tolist())
+        self.days.update(start.date() for start in c["start_time"][changed])
+        if not self.dry_run:
+            update_rows(
+                Hit,
+                ["id", "start_time"],
+                ["session", "initial"],
+                zip(
+                    c["pk"][changed].tolist(),
+                    c["start_time"][changed].tolist(),
+                    target[changed].tolist(),
+                    new[changed].tolist(),
+                ),
+            )
+
+    def finish(self):
+        # times and bounce flags from all of each touched session's hits, the ones
+        # outside the window included; sessions left without hits are deleted
+        using = router.db_for_write(Session)
+        touched = sorted(self.touched)
+        for offset in range(0, len(touched), self.chunk_size):
+            pks = touched[offset:offset + self.chunk_size]
+            rows = (
+                Hit.objects.filter(session_id__in=pks)
+                .order_by()
+                .values_list("session_id")
+                .annotate(
+                    first=models.Min("start_time"), last=models.Max("last_seen"), hits=models.Count("pk")
+                )
+            )
+            update_rows(
+                Session,
+                ["id"],
+                ["start_time", "last_seen", "is_bounce"],
+                [(pk, first, last or first, hits == 1) for pk, first, last, hits in rows],
+            )
+            empty = list(
+                Session.objects.filter(pk__in=pks, service=self.service)
+                .exclude(pk__in=[row[0] for row in rows])
+                .values_list("pk", "start_time")
+            )
+            if empty:
+                with transaction.atomic(), transaction.atomic(using=using):
+                    self.counts["sessions_deleted"] += raw_delete(Session, "id", [pk for pk, _ in empty], using)
+                    segments.discard(self.service.pk, empty)
+
+    def run(self):
+        for rows in self.chunks():
+            self.process(rows)
+        self.counts["sessions_before"] = len(self.seen)
+        if not self.dry_run:
+            self.finish()
+        return self.counts
+
+
+def resessionize(service, start, end, timeout=None, chunk_size=None, dry_run=False, log=logger.info):
+    # the window ends before the association cache could still link new hits to its
+    # sessions, so ingestion and this never rewrite the same session
+    end = min(end, timezone.now() - datetime.timedelta(seconds=settings.SESSION_MEMORY_TIMEOUT))
+    if start >= end:
+        raise ResessionizeError("The window must end before the association cache's timeout")
+
+    shard, status = sharding.placement(service.uuid)
+    if status != sharding.ACTIVE:
+        raise ResessionizeError(f"Service {service.uuid} is moving between shards ({status})")
+
+    resessionizer = Resessionizer(service, start, end, timeout, chunk_size, dry_run)
+    with sharding.use_shard(shard):
+        counts = resessionizer.run()
+    log(
+        f"{'Would rebuild' if dry_run else 'Rebuilt'} {counts['sessions_before']} sessions of {service.uuid} "
+        f"into {counts['sessions_after']}: {counts['hits_relinked']} of {counts['hits']} hits relinked, "
+        f"{counts['sessions_created']} sessions created, {counts['sessions_deleted']} deleted"
+    )
+
+    # the visitor map counts sessions per day
+    if not dry_run:
+        versions.bump(service.pk)
+        for day in sorted(resessionizer.days):
+            geo.rollup_day(day)
+    return counts
@@ -0,0 +1,30 @@
+from hashlib import sha256
+
+from django.conf import settings
+
+from .counters import get_minute_counts, minute_bucket
+
+# kept under a visitor's session association instead of a session pk once they are
+# left out of the sample, so the rest of their session is dropped without deciding
+# again; with an adaptive rate a new decision could let the middle of a session in
+NOT_SAMPLED = 0
+
+
+def sample_rate(service, time=None):
+    # the configured rate, lowered to the per-minute target when the last full minute
+    # had more traffic than that; the minute counters see sampled-out traffic too
+    rate = service.sample_rate
+    target = service.sampling_target_per_minute
+    if target:
+        observed = get_minute_counts([service.pk], minute_bucket(time) - 1)[service.pk]
+        if observed > target:
+            rate = min(rate, target / observed)
+    return max(rate, settings.SAMPLING_MIN_RATE)
+
+
+def is_sampled(service, association_hash, rate):
+    # decided by the visitor hash, so all events of a visitor are kept or dropped together
+    if rate >= 1:
+        return True
+    digest = sha256(f"{service.uuid}{association_hash}".encode("utf-8")).hexdigest()
+    return int(digest[:13], 16) / 16 ** 13 < rate
@@ -0,0 +1,105 @@
+import gzip
+import threading
+import time
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+
+from core.models import Service
+
+try:
+    import brotli
+except ImportError:
+    # gzip alone until the Brotli package is installed
+    brotli = None
+
+
+class TrackerScript:
+    # one rendered script with its precompressed variants; each encoding gets its own
+    # strong ETag, since the bytes on the wire differ
+    __slots__ = ("variants", "version", "checked")
+
+    def __init__(self, body, version):
+        self.version = version
+        self.checked = time.monotonic()
+        if body is None:
+            # an unknown or archived service, remembered like a script so that
+            # requests for it do not each reach the database
+            self.variants = None
+            return
+        digest = sha256(body).hexdigest()[:32]
+        self.variants = {"identity": (body, f'"{digest}"')}
+        self.variants["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gzip"')
+        if brotli is not None:
+            self.variants["br"] = (brotli.compress(body, mode=brotli.MODE_TEXT), f'"{digest}-br"')
+
+    def negotiate(self, accept_encoding):
+        # (body, etag, content encoding); brotli first, it is the smaller one
+        accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.variants:
+                return (*self.variants[encoding], encoding)
+        return (*self.variants["identity"], None)
+
+
+_scripts = {}
+_lock = threading.Lock()
+
+
+def _version_path(service_uuid):
+    return f"tracker_script_version_{service_uuid}"
+
+
+def script_version(service_uuid):
+    return cache.get(_version_path(service_uuid), 0)
+
+
+def invalidate(service_uuid):
+    # a new version for every process; each renders again at its next version check
+    path = _version_path(service_uuid)
+    cache.add(path, 0, timeout=None)
+    try:
+        cache.incr(path)
+    except ValueError:
+        cache.set(path, 1, timeout=None)
+
+
+def render(service):
+    return render_to_string(
+        "analytics/scripts/page.js",
+        {
+            "heartbeat_frequency": settings.SCRIPT_HEARTBEAT_FREQUENCY,
+            "script_inject": service.script_inject,
+        },
+    ).encode("utf-8")
+
+
+def get_script(service_uuid):
+    # per process; the shared version is looked up at most every
+    # SCRIPT_VERSION_CHECK_INTERVAL seconds, so most requests never leave memory
+    service_uuid = str(service_uuid)
+    script = _scripts.get(service_uuid)
+    now = time.monotonic()
+    if script is None or now - script.checked >= settings.SCRIPT_VERSION_CHECK_INTERVAL:
+        version = script_version(service_uuid)
+        if script is not None and script.version == version:
+            script.checked = now
+        else:
+            with _lock:
+                service = Service.objects.filter(uuid=service_uuid, status=Service.ACTIVE).first()
+                script = TrackerScript(render(service) if service is not None else None, version)
+                if service_uuid not in _scripts and len(_scripts) >= settings.SCRIPT_CACHE_MAX_SERVICES:
+                    # the oldest entry goes, so made-up uuids cannot grow this forever
+                    _scripts.pop(next(iter(_scripts)))
+                _scripts[service_uuid] = script
+    return script if script.variants is not None else None
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def _service_changed(sender, instance, **kwargs):
+    invalidate(instance.uuid)
@@ -0,0 +1,170 @@
+import datetime
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from crena import sharding
+
+from .bitmaps import RoaringBitmap
+from .models import SegmentBitmap, Session
+
+logger = logging.getLogger(__name__)
+
+
+def _utc_date(value):
+    return value.astimezone(datetime.timezone.utc).date()
+
+
+def _day_bounds(day):
+    start = datetime.datetime.combine(day, datetime.time.min, tzinfo=datetime.timezone.utc)
+    return start, start + datetime.timedelta(days=1)
+
+
+def rollup_day(day):
+    # each shard rolls up the services placed on it, all of them at once
+    return sum(sharding.fan_out(lambda alias: _rollup_shard_day(day, alias)).values())
+
+
+def _rollup_shard_day(day, alias):
+    # one pass over the day's sessions builds every (service, dimension, value) bitmap;
+    # sessions newer than through_pk are matched by their columns until the next run.
+    # through_pk comes from the shard's own id range: rows copied in from another shard
+    # keep their ids, and ids above the new ones would hide the next sessions
+    start, end = _day_bounds(day)
+    placed = sharding.placed_on(alias)
+    low, high = sharding.id_range(alias)
+    through_pk = Session.objects.filter(pk__gte=low, pk__lt=high).aggregate(pk=models.Max("pk"))["pk"] or 0
+    rows = (
+        Session.objects.filter(placed, start_time__gte=start, start_time__lt=end, pk__lte=through_pk)
+        .order_by()
+        .values_list("pk", "service_id", *settings.SEGMENT_DIMENSIONS)
+    )
+
+    ids = defaultdict(list)
+    for pk, service_id, *values in rows.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+        for dimension, value in zip(settings.SEGMENT_DIMENSIONS, values):
+            if value is not None:
+                ids[service_id, dimension, value].append(pk)
+
+    bitmaps = []
+    for (service_id, dimension, value), pks in ids.items():
+        bitmap = RoaringBitmap(pks)
+        bitmaps.append(
+            SegmentBitmap(
+                service_id=service_id,
+                date=day,
+                dimension=dimension,
+                value=value,
+                sessions=len(bitmap),
+                bitmap=bitmap.to_bytes(),
+                through_pk=through_pk,
+            )
+        )
+
+    with transaction.atomic():
+        SegmentBitmap.objects.filter(placed, date=day).delete()
+        SegmentBitmap.objects.bulk_create(bitmaps, batch_size=settings.BULK_INSERT_BATCH_SIZE)
+    return len(bitmaps)
+
+
+def rollup_recent(now=None):
+    # today, plus yesterday until its last sessions are surely in
+    now = now or timezone.now()
+    days = {_utc_date(now), _utc_date(now - datetime.timedelta(minutes=settings.SEGMENT_ROLLUP_GRACE_MINUTES))}
+    return {day: rollup_day(day) for day in sorted(days)}
+
+
+def match(service, start_time, end_time, segment):
+    # the ids of the sessions in the segment, as the per-day AND of one bitmap per
+    # dimension OR-ed over the days, and {day: session id its bitmaps are complete up
+    # to} of the days that were rolled up. A day without any bitmap was not rolled up,
+    # or had no session with a value in any dimension
+    dates = {"date__gte": _utc_date(start_time), "date__lte": _utc_date(end_time)}
+    through_pks = dict(
+        SegmentBitmap.objects.filter(service=service, **dates)
+        .order_by()
+        .values("date")
+        .annotate(through_pk=models.Min("through_pk"))
+        .values_list("date", "through_pk")
+    )
+    if not through_pks:
+        return RoaringBitmap(), through_pks
+
+    query = models.Q()
+    for dimension, value in segment.items():
+        query |= models.Q(dimension=dimension, value=value)
+    rows = SegmentBitmap.objects.filter(query, service=service, **dates).values_list("date", "dimension", "bitmap")
+
+    days = defaultdict(dict)
+    for date, dimension, bitmap in rows:
+        days[date][dimension] = RoaringBitmap.from_bytes(bitmap)
+
+    matched = RoaringBitmap()
+    for bitmaps in days.values():
+        # a value missing from a day means no session that day had it
+        if len(bitmaps) < len(segment):
+            continue
+        day = None
+        for bitmap in sorted(bitmaps.values(), key=len):
+            day = bitmap if day is None else day & bitmap
+            if not day:
+                break
+        matched = matched | day
+    return matched, through_pks
+
+
+def session_filters(service, start_time, end_time, segment):
+    # (sessions filter, hits filter, bitmap). The bitmaps answer for the sessions of
+    # each rolled up day up to that day's through_pk; the rest, i.e. days not rolled up
+    # and sessions written after their day was (late batches, resessionize, moves), are
+    # matched by their columns, and so is everything when the segment is too broad for
+    # an id list to beat the plain predicates
+    matched, through_pks = match(service, start_time, end_time, segment)
+    predicate = models.Q(**segment)
+    hit_predicate = models.Q(**{f"session__{dimension}": value for dimension, value in segment.items()})
+    if not through_pks or len(matched) > settings.SEGMENT_MAX_IDS:
+        return predicate, hit_predicate, matched
+
+    indexed = models.Q()
+    hits_indexed = models.Q()
+    for day, through_pk in sorted(through_pks.items()):
+        day_start, day_end = _day_bounds(day)
+        indexed |= models.Q(start_time__gte=day_start, start_time__lt=day_end, pk__lte=through_pk)
+        hits_indexed |= models.Q(
+            session__start_time__gte=day_start, session__start_time__lt=day_end, session_id__lte=through_pk
+        )
+    ids = list(matched)
+    return (
+        models.Q(pk__in=ids) | (~indexed & predicate),
+        models.Q(session_id__in=ids) | (~hits_indexed & hit_predicate),
+        matched,
+    )
+
+
+def discard(service_id, sessions):
+    # drops deleted sessions, given as (pk, start_time) pairs, from their days' bitmaps
+    days = defaultdict(list)
+    for pk, start_time in sessions:
+        if start_time is not None:
+            days[_utc_date(start_time)].append(pk)
+    if not days:
+        return 0
+
+    removed = {day: RoaringBitmap(pks) for day, pks in days.items()}
+    changed = 0
+    for row in SegmentBitmap.objects.select_for_update().filter(service_id=service_id, date__in=list(days)):
+        bitmap = RoaringBitmap.from_bytes(row.bitmap)
+        remaining = bitmap - removed[row.date]
+        if len(remaining) == len(bitmap):
+            continue
+        if remaining:
+            row.bitmap = remaining.to_bytes()
+            row.sessions = len(remaining)
+            row.save(update_fields=["bitmap", "sessions"])
+        else:
+            row.delete()
+        changed += 1
+    return changed
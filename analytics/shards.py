@@ -0,0 +1,226 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max, Q
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.models import Service, ServicePlacement, User
+from crena import sharding
+from . import partitions
+from .deletion import DELETION_LOCK_PATH, raw_delete
+from .models import Hit, SegmentBitmap, Session
+
+logger = logging.getLogger(__name__)
+
+SESSION_FIELDS = [field.name for field in Session._meta.concrete_fields if not field.primary_key]
+# a hit's start_time never changes, and it is part of the key on a partitioned table
+HIT_FIELDS = [
+    field.name for field in Hit._meta.concrete_fields if not field.primary_key and field.name != "start_time"
+]
+
+
+class MoveError(Exception):
+    pass
+
+
+def mirror(service, alias):
+    # the shard's sessions and hits point at the service and its users, so those rows
+    # are copied over as they are on the default database
+    user_pks = [pk for pk in (service.owner_id, service.collaborators_id) if pk]
+    for user in User.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=user_pks):
+        user.save(using=alias)
+    Service.objects.using(DEFAULT_DB_ALIAS).get(pk=service.pk).save(using=alias)
+
+
+def prepare_shard(alias):
+    # moves the session and hit sequences into the shard's id range, so ids stay
+    # unique across shards and copied rows can keep theirs
+    low, _ = sharding.id_range(alias)
+    if low == 0:
+        return
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        for model in (Session, Hit):
+            table = model._meta.db_table
+            if connection.vendor == "postgresql":
+                cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+                sequence = cursor.fetchone()[0]
+                cursor.execute(
+                    f"SELECT setval(%s, %s, false) WHERE (SELECT last_value FROM {sequence}) < %s",
+                    [sequence, low + 1, low],
+                )
+            elif connection.vendor == "sqlite":
+                cursor.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) SELECT %s, 0 "
+                    "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                    [table, table],
+                )
+                cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s", [low, table])
+            else:
+                raise MoveError(f"Cannot set the id range of {alias} on {connection.vendor}")
+
+
+def _upsert(model, objs, target):
+    if model is Hit and partitions.is_partitioned(connections[target]):
+        for start in {partitions.interval_start(obj.start_time.date()) for obj in objs}:
+            partitions.create_partition(start, connections[target])
+        unique_fields = ["id", "start_time"]
+    else:
+        unique_fields = ["id"]
+    model.objects.using(target).bulk_create(
+        objs,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=SESSION_FIELDS if model is Session else HIT_FIELDS,
+    )
+
+
+def _copy(model, rows, target, chunk_size):
+    # in pk order and upserted, so rows read twice are simply written twice
+    copied = last = 0
+    while True:
+        chunk = list(rows.filter(pk__gt=last).order_by("pk")[:chunk_size])
+        if not chunk:
+            return copied
+        _upsert(model, chunk, target)
+        copied += len(chunk)
+        last = chunk[-1].pk
+
+
+def copy_round(service, source, target, since=None, after=None, chunk_size=None):
+    # every row if since is None, else the rows added past the `after` watermarks or
+    # touched since then. Hits are bounded before sessions, so each copied hit finds
+    # its session; a session changes only with a hit, so its hit's session is recopied
+    chunk_size = chunk_size or settings.SHARD_MOVE_CHUNK_SIZE
+    hit_top = Hit.objects.using(source).filter(service=service).aggregate(pk=Max("pk"))["pk"] or 0
+    session_top = Session.objects.using(source).filter(service=service).aggregate(pk=Max("pk"))["pk"] or 0
+
+    sessions = Session.objects.using(source).filter(service=service, pk__lte=session_top)
+    hits = Hit.objects.using(source).filter(service=service, pk__lte=hit_top)
+    if since is not None:
+        changed = Q(pk__gt=after[Hit]) | Q(last_seen__gte=since)
+        hits = hits.filter(changed)
+        touched = set(hits.values_list("session_id", flat=True))
+        sessions = sessions.filter(Q(pk__gt=after[Session]) | Q(last_seen__gte=since) | Q(pk__in=touched))
+
+    copied = _copy(Session, sessions, target, chunk_size) + _copy(Hit, hits, target, chunk_size)
+    return copied, {Session: session_top, Hit: hit_top}
+
+
+def _wait_for_deletions():
+    # a deletion pass that started before the move would delete from the source only;
+    # later ones see the placement and wait for the move to finish
+    while not cache.add(DELETION_LOCK_PATH, True, timeout=settings.DELETION_LOCK_TIMEOUT):
+        time.sleep(1)
+    cache.delete(DELETION_LOCK_PATH)
+
+
+def _place(service, alias, status, target=""):
+    ServicePlacement.objects.using(DEFAULT_DB_ALIAS).update_or_create(
+        service=service, defaults={"database": alias, "status": status, "target": target}
+    )
+    sharding.set_placement(service.uuid, alias, status)
+
+
+def delete_rows(service, alias, chunk_size=None):
+    # a service's sessions and hits on one database, in batches like a deletion job
+    chunk_size = chunk_size or settings.SHARD_MOVE_CHUNK_SIZE
+    deleted = 0
+    while True:
+        sessions = Session.objects.using(alias).filter(service=service).order_by("pk")
+        rows = list(sessions.values_list("pk", "start_time")[:chunk_size])
+        if not rows:
+            return deleted
+        pks = [pk for pk, _ in rows]
+        with transaction.atomic(using=alias):
+            raw_delete(Hit, "session_id", pks, alias, since=min(start for _, start in rows))
+            deleted += raw_delete(Session, "id", pks, alias)
+
+
+def move_service(service, target, chunk_size=None, grace=None, log=logger.info):
+    # online: ingestion keeps writing to the source while its rows are copied and
+    # caught up, then is held back for SHARD_CUTOVER_GRACE seconds and one last round.
+    # Every status change waits out SHARD_PLACEMENT_CACHE_TIMEOUT first, as processes
+    # may still act on the placement they read before it
+    source, status = sharding.placement(service.uuid)
+    if target not in sharding.shard_aliases():
+        raise MoveError(f"{target} is not one of the shards {', '.join(sharding.shard_aliases())}")
+    if status != sharding.ACTIVE:
+        raise MoveError(f"Service {service.uuid} is already moving ({status})")
+    if source == target:
+        raise MoveError(f"Service {service.uuid} is already on {target}")
+    grace = grace if grace is not None else settings.SHARD_CUTOVER_GRACE
+    settle = settings.SHARD_PLACEMENT_CACHE_TIMEOUT
+
+    _place(service, source, sharding.MOVING, target)
+    try:
+        # deletions, archiving and resessionizing that saw the service active
+        time.sleep(settle)
+        _wait_for_deletions()
+        mirror(service, target)
+        prepare_shard(target)
+
+        started = timezone.now()
+        copied, top = copy_round(service, source, target, chunk_size=chunk_size)
+        log(f"Copied {copied} rows from {source} to {target}")
+        # each round reaches back to the start of the one before it, so rows whose
+        # transactions were still open while that one read them are not lost
+        since, after, previous_top = started, top, top
+        for _ in range(settings.SHARD_MOVE_MAX_ROUNDS):
+            round_started = timezone.now()
+            copied, round_top = copy_round(service, source, target, since, after, chunk_size)
+            log(f"Caught up {copied} rows")
+            since, after, previous_top = round_started, previous_top, round_top
+            if copied < settings.SHARD_MOVE_CATCHUP_ROWS:
+                break
+
+        _place(service, source, sharding.LOCKED, target)
+        time.sleep(settle + grace)
+        copied, _ = copy_round(service, source, target, since, after, chunk_size)
+        log(f"Copied the last {copied} rows")
+
+        # sessions above the target's current ids were built into bitmaps on the
+        # source; lowering through_pk keeps the target's next sessions matched
+        low, high = sharding.id_range(target)
+        mark = (
+            Session.objects.using(target).filter(pk__gte=low, pk__lt=high).aggregate(pk=Max("pk"))["pk"] or low
+        )
+        SegmentBitmap.objects.filter(service=service, through_pk__gt=mark).update(through_pk=mark)
+    except Exception:
+        _place(service, source, sharding.ACTIVE)
+        raise
+
+    _place(service, target, sharding.ACTIVE)
+    log(f"Service {service.uuid} is on {target}")
+    deleted = delete_rows(service, source, chunk_size)
+    if source != DEFAULT_DB_ALIAS:
+        Service.objects.using(source).filter(pk=service.pk).delete()
+    log(f"Deleted {deleted} sessions from {source}")
+    return deleted
+
+
+@receiver(post_save, sender=Service)
+def _place_new_service(sender, instance, created, using, **kwargs):
+    if not created or using != DEFAULT_DB_ALIAS or settings.SHARD_NEW_SERVICES == DEFAULT_DB_ALIAS:
+        return
+    mirror(instance, settings.SHARD_NEW_SERVICES)
+    prepare_shard(settings.SHARD_NEW_SERVICES)
+    _place(instance, settings.SHARD_NEW_SERVICES, sharding.ACTIVE)
+
+
+@receiver(pre_delete, sender=Service)
+def _delete_from_shard(sender, instance, using, **kwargs):
+    # the default database cascades by itself; the shard's rows and mirror go here
+    if using != DEFAULT_DB_ALIAS:
+        return
+    alias, _ = sharding.placement(instance.uuid)
+    sharding.clear_placement(instance.uuid)
+    if alias == DEFAULT_DB_ALIAS:
+        return
+    delete_rows(instance, alias)
+    Service.objects.using(alias).filter(pk=instance.pk).delete()
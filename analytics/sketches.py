@@ -0,0 +1,137 @@
+import math
+import struct
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# DDSketch: a value x > 0 is counted in bucket ceil(log_gamma(x)), and every value of a
+# bucket is within the relative accuracy of the bucket's midpoint. Merging adds bucket
+# counts, so sketches of hours add up to any longer window without losing accuracy,
+# and a sketch stays a few hundred buckets from milliseconds to minutes
+_MAGIC = b"DD1"
+_HEADER = struct.Struct("<3sdddI")
+
+
+class DDSketch:
+    __slots__ = ("accuracy", "gamma", "log_gamma", "buckets", "count", "sum")
+
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        # counts are floats, so a sampled hit can stand for 1/rate hits
+        self.count = 0.0
+        self.sum = 0.0
+
+    def __bool__(self):
+        return self.count > 0
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def _key(self, value):
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def _value(self, key):
+        return 2 * self.gamma**key / (self.gamma + 1)
+
+    def add(self, value, weight=1.0):
+        if value is None or value <= 0:
+            return
+        key = self._key(value)
+        self.buckets[key] = self.buckets.get(key, 0.0) + weight
+        self.count += weight
+        self.sum += value * weight
+
+    def add_many(self, values, weights=None):
+        # numpy arrays at once; NaN and values <= 0 are skipped like add() skips them
+        values = np.asarray(values, dtype=np.float64)
+        known = values > 0
+        values = values[known]
+        if not len(values):
+            return
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64)[known]
+        keys, inverse = np.unique(np.ceil(np.log(values) / self.log_gamma).astype(np.int64), return_inverse=True)
+        for key, weight in zip(keys.tolist(), np.bincount(inverse, weights=weights).tolist()):
+            self.buckets[key] = self.buckets.get(key, 0.0) + weight
+        self.count += float(weights.sum())
+        self.sum += float((values * weights).sum())
+
+    def merge(self, other):
+        if other.accuracy != self.accuracy:
+            raise ValueError("Cannot merge sketches of different accuracies")
+        for key, weight in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0.0) + weight
+        self.count += other.count
+        self.sum += other.sum
+        return self
+
+    def quantile(self, q):
+        # the value at rank q * (count - 1), like an interpolation-free percentile
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.buckets))
+
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def to_bytes(self):
+        keys = sorted(self.buckets)
+        return b"".join(
+            (
+                _HEADER.pack(_MAGIC, self.accuracy, self.count, self.sum, len(keys)),
+                array("i", keys).tobytes(),
+                array("d", (self.buckets[key] for key in keys)).tobytes(),
+            )
+        )
+
+    @classmethod
+    def from_many(cls, datas, accuracy):
+        # the merge of many serialized sketches; with numpy their buckets are summed in
+        # one pass instead of a dict update per bucket
+        sketch = cls(accuracy)
+        if np is None:
+            for data in datas:
+                sketch.merge(cls.from_bytes(data))
+            return sketch
+        keys, weights = [], []
+        for data in datas:
+            magic, row_accuracy, count, total, size = _HEADER.unpack_from(data)
+            if magic != _MAGIC:
+                raise ValueError("Not a serialized DDSketch")
+            if row_accuracy != accuracy:
+                raise ValueError("Cannot merge sketches of different accuracies")
+            keys.append(np.frombuffer(data, dtype=np.int32, count=size, offset=_HEADER.size))
+            weights.append(np.frombuffer(data, dtype=np.float64, count=size, offset=_HEADER.size + 4 * size))
+            sketch.count += count
+            sketch.sum += total
+        if keys:
+            unique, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+            sums = np.bincount(inverse, weights=np.concatenate(weights))
+            sketch.buckets = dict(zip(unique.tolist(), sums.tolist()))
+        return sketch
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        magic, accuracy, count, total, size = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("Not a serialized DDSketch")
+        sketch = cls(accuracy)
+        offset = _HEADER.size
+        keys = array("i", data[offset:offset + 4 * size])
+        weights = array("d", data[offset + 4 * size:offset + 12 * size])
+        sketch.buckets = dict(zip(keys, weights))
+        sketch.count = count
+        sketch.sum = total
+        return sketch
@@ -1,6 +1,12 @@
+import gc
 import ipaddress
+import json
 import logging
+import math
+import threading
+from collections import Counter
 from hashlib import sha256
+from time import perf_counter
 
 import geoip2.database
 import user_agents
@@ -10,27 +16,62 @@ from django.db.models import Q
 from django.core.cache import cache
 from django.utils import timezone
 from celery import shared_task
+from celery.signals import task_postrun, worker_init, worker_process_shutdown
 
 from core.models import Service
+from crena import sharding
+from . import embedded, loadtimes, metrics, versions
+from .alerts import TrafficEvaluator
+from .archive import archive_closed_months
+from .batch import event_time
+from .bulk import bulk_insert
+from .bots import score_request
+from .counters import incr_minute_counter
+from .dedup import beacon_fingerprint, is_duplicate
+from .deletion import run_pending_jobs, schedule_retention_jobs
+from .geo import rollup_recent
+from .geohash import encode as geohash_encode
+from .segments import rollup_recent as rollup_recent_segments
+from .partitions import maintain_partitions
+from .sampling import NOT_SAMPLED, is_sampled, sample_rate
+from .queues import sample_queue_depths
 from .models import Session, Hit
 
 logger = logging.getLogger(__name__)
+PRELOAD_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+)
 _geoip2_city_reader = None
 _geoip2_asn_reader = None
+_geoip2_missing = False
+
+
+def _open_geoip_readers():
+    # once per process; a missing database turns lookups off instead of being retried
+    # and logged on every hit
+    global _geoip2_asn_reader, _geoip2_city_reader, _geoip2_missing
+    if _geoip2_city_reader is None and not _geoip2_missing:
+        if settings.MAXMIND_CITY_DB is None or settings.MAXMIND_ASN_DB is None:
+            _geoip2_missing = True
+            return False
+        try:
+            city_reader = geoip2.database.Reader(settings.MAXMIND_CITY_DB)
+            asn_reader = geoip2.database.Reader(settings.MAXMIND_ASN_DB)
+        except FileNotFoundError as e:
+            logger.error("GeoIP lookups are off, unable to find the file %s", e)
+            _geoip2_missing = True
+            return False
+        _geoip2_city_reader, _geoip2_asn_reader = city_reader, asn_reader
+    return _geoip2_city_reader is not None
 
 
 def _geoip_lookup(ip):
-    global _geoip2_asn_reader, _geoip2_city_reader
+    if not _open_geoip_readers():
+        return {}
     try:
-        if settings.MAXMIND_CITY_DB == None or settings.MAXMIND_ASN_DB == None:
-            return None
-        if _geoip2_asn_reader == None or _geoip2_city_reader ==  None:
-            _geoip2_city_reader = geoip2.database.Reader(settings.MAXMIND_CITY_DB)
-            _geoip2_asn_reader = geoip2.database.Reader(settings.MAXMIND_ASN_DB)
-
         city_results = _geoip2_city_reader.city(ip)
-        asn_results = _geoip2_city_reader.city(ip)
-        
+        asn_results = _geoip2_asn_reader.asn(ip)
+
         return {
             "asn": asn_results.autonomous_system_organization,
             "country": city_results.country.iso_code,
@@ -40,12 +81,101 @@ def _geoip_lookup(ip):
         }
     except geoip2.errors.AddressNotFoundError:
         return {}
-    
-    except FileNotFoundError as e:
-        logger.exception("Unable to find the file %s", e)
-        return {}
 
 
+def preload():
+    # loads what every hit needs before a prefork worker or a preloading server forks,
+    # so the children share it copy-on-write instead of each building its own on their
+    # first hits: the GeoIP readers, and the user agent regexes, compiled when
+    # user_agents is imported. gc.freeze() moves everything loaded so far out of the
+    # collector's generations, whose passes would otherwise write to, and so copy,
+    # those shared pages in every child
+    started = perf_counter()
+    _open_geoip_readers()
+    user_agents.parse(PRELOAD_USER_AGENT)
+    gc.collect()
+    gc.freeze()
+    logger.info("Preloaded ingestion in %.0f ms", (perf_counter() - started) * 1000)
+
+
+def _is_ignored_ip(service, ip):
+    try:
+        remote_ip = ipaddress.ip_network(ip)
+        for ignored_network in service.get_ignored_networks():
+            if (
+                ignored_network.version == remote_ip.version and ignored_network.supernet_of(remote_ip)
+            ):
+                return True
+    except ValueError as e:
+        logger.exception(e)
+    return False
+
+
+def _association_hash(service, ip, user_agent):
+    association_id_hash = sha256()
+    association_id_hash.update(str(ip).encode("utf-8"))
+    association_id_hash.update(str(user_agent).encode("utf-8"))
+    if settings.AGGRESSIVE_HASH_SALTING:
+        association_id_hash.update(str(service).encode("utf-8"))
+        association_id_hash.update(str(timezone.now().date().isoformat).encode("utf-8"))
+    return association_id_hash.hexdigest()
+
+
+def _defer(task, *args, **kwargs):
+    # a service in the last seconds of a move to another shard takes no writes; its
+    # events come back once the placement has switched
+    metrics.incr("events_deferred")
+    if settings.INGRESS_MODE == "embedded":
+        timer = threading.Timer(settings.SHARD_CUTOVER_RETRY, embedded.submit, (task, *args), kwargs)
+        timer.daemon = True
+        timer.start()
+    else:
+        task.apply_async(args, kwargs, countdown=settings.SHARD_CUTOVER_RETRY)
+
+
+def _session_fields(service, ip, user_agent, is_bot=False):
+    with metrics.timed("geoip"):
+        geiop_data = _geoip_lookup(ip) or {}
+    logger.debug("Found geoip data")
+
+    with metrics.timed("ua_parse"):
+        ua = user_agents.parse(user_agent)
+    device_type = "OTHER"
+
+    if (
+        is_bot
+        or ua.is_bot
+        or (ua.browser.family or "").strip().lower() == "googlebot"
+        or (ua.device.family or ua.device.model or "").strip().lower()
+        == "spider"
+    ):
+        device_type = "ROBOT"
+    elif ua.is_mobile:
+        device_type = "PHONE"
+    elif ua.is_tablet:
+        device_type = "TABLET"
+    elif ua.is_pc:
+        device_type = "DESKTOP"
+
+    return {
+        "ip": ip if service.collectd_ips and not settings.BLOCK_ALL_IPS else None,
+        "user_agent": user_agent,
+        "browser": ua.browser.family or "",
+        "devices": ua.device.family or ua.device.model or "",
+        "device_type": device_type,
+        "os": ua.os.family or "",
+        "asn": geiop_data.get("asn") or "",
+        "country": geiop_data.get("country") or "",
+        "longitude": geiop_data.get("longitude"),
+        "latitude": geiop_data.get("latitude"),
+        "time_zone": geiop_data.get("time_zone") or "",
+        "geohash": (
+            geohash_encode(geiop_data["latitude"], geiop_data["longitude"], settings.GEOHASH_PRECISION)
+            if geiop_data.get("latitude") is not None and geiop_data.get("longitude") is not None
+            else ""
+        ),
+    }
+
 
 @shared_task
 def ingress_request(
@@ -60,90 +190,116 @@ def ingress_request(
     identifier=""
 
 ):
+    started = perf_counter()
+    metrics.incr("events")
+    shard_token = None
     try:
-        service = Service.objects.get(pk=service_uuid, status=Service.ACTIVE)
+        shard, shard_status = sharding.placement(service_uuid)
+        if shard_status == sharding.LOCKED:
+            return _defer(
+                ingress_request, service_uuid, tracker, time, payload, ip, location, user_agent,
+                dnt=dnt, identifier=identifier,
+            )
+        shard_token = sharding.activate(shard)
+
+        # retried beacons are dropped before any database work; repeats carrying an
+        # idempotency key are heartbeats and handled below
+        if payload.get("idempotency") is None and is_duplicate(
+            service_uuid,
+            beacon_fingerprint(
+                tracker, ip, user_agent, location, json.dumps(payload, sort_keys=True, default=str)
+            ),
+            time,
+        ):
+            metrics.incr("events_dropped", "duplicate")
+            return
+
+        with metrics.timed("service_lookup"):
+            service = Service.objects.filter(uuid=service_uuid, status=Service.ACTIVE).first()
+        if service is None:
+            metrics.incr("events_dropped", "inactive_service")
+            return
         logger.debug(f"Linked to the service{service}")
 
         if dnt and service.respect_dnt:
             logger.debug("Ignoring this because of DNT")
+            metrics.incr("events_dropped", "dnt")
             return {}
         
-        try:
-            remote_ip = ipaddress.ip_network(ip)
-            for ignored_network in service.get_ignored_networks():
-                if (
-                    ignored_network.version == remote_ip.version and ignored_network.supernet_of(remote_ip)
-                ):
-                    logger.debug("Ignoring this because of ignored ip")
-                    return 
-        except ValueError as e:
-            logger.exception(e)
-
-        #validate payload
-        if payload.get["loadTime", 1] <= 0:
-            payload["loadTime"] = None
-        
-        association_id_hash = sha256()
-        association_id_hash.update(str(ip).encode("utf-8"))
-        association_id_hash.update(str(user_agent).encode("utf-8"))
-        if settings.AGGRESSIVE_HASH_SALTING:
-            association_id_hash.update(str(service).encode("utf-8"))
-            association_id_hash.update(str(timezone.now().date().isoformat).encode("utf-8"))
-        session_cache_path = (
-            f"session_association_{service.pk}_{association_id_hash.hexdigest()}"
-        )
+        with metrics.timed("ip_filter"):
+            ignored = _is_ignored_ip(service, ip)
+        if ignored:
+            logger.debug("Ignoring this because of ignored ip")
+            metrics.incr("events_dropped", "ignored_ip")
+            return
+
+        association_hash = _association_hash(service, ip, user_agent)
+        session_cache_path = f"session_association_{service.pk}_{association_hash}"
+
+        #score the request before touching the database
+        idempotency = payload.get("idempotency")
+        idempotency_path = f"hit_idempotency_{service.pk}_{idempotency}"
+        is_heartbeat = idempotency is not None and cache.get(idempotency_path) is not None
+        if idempotency is not None:
+            metrics.incr("idempotency_cache", "hit" if is_heartbeat else "miss")
+
+        with metrics.timed("bot_scoring"):
+            # at the event's time, so a drained backlog does not look like a burst
+            verdict = score_request(service.pk, association_hash, ip, is_heartbeat, now=time.timestamp())
+        if verdict.is_bot:
+            logger.debug(f"Request scored as bot: {', '.join(verdict.reasons)}")
+            if service.ignore_robots:
+                metrics.incr("events_dropped", "bot_score")
+                return
 
         #create or update session
-        session = None
-        if cache.get(session_cache_path) is not None:
-            cache.touch(session_cache_path, settings.SESSION_MEMORY_TIMEOUT)
-        
-        session = Session.objects.filter(pk=cache.get(session_cache_path), service=service).first()
+        with metrics.timed("session_cache"):
+            session = None
+            session_pk = cache.get(session_cache_path)
+            if session_pk is not None:
+                cache.touch(session_cache_path, settings.SESSION_MEMORY_TIMEOUT)
+                if session_pk != NOT_SAMPLED:
+                    session = Session.objects.filter(pk=session_pk, service=service).first()
+        metrics.incr("session_cache", "miss" if session is None and session_pk is None else "hit")
+
+        if session_pk == NOT_SAMPLED:
+            logger.debug("Visitor is not in the sample")
+            if not is_heartbeat:
+                incr_minute_counter(service.pk, time)
+            metrics.incr("events_dropped", "sampled")
+            return
+
         if session is None:
             initial = True
 
-            logger.debug("Cannot link to existing session. create new one..")
-
-            geiop_data = _geoip_lookup(ip)
-            logger.debug("Found geoip data")
+            rate = sample_rate(service, time)
+            if not is_sampled(service, association_hash, rate):
+                logger.debug("Visitor is not in the sample")
+                # still traffic, for the alerts and the adaptive rate
+                if not is_heartbeat:
+                    incr_minute_counter(service.pk, time)
+                if idempotency is not None:
+                    cache.set(idempotency_path, 0, timeout=settings.SESSION_MEMORY_TIMEOUT)
+                cache.set(session_cache_path, NOT_SAMPLED, timeout=settings.SESSION_MEMORY_TIMEOUT)
+                metrics.incr("events_dropped", "sampled")
+                return
 
-            ua = user_agents.parse(user_agent)
-            device_type = "OTHER"
+            logger.debug("Cannot link to existing session. create new one..")
 
-            if (
-                ua.is_bot
-                or (ua.browser.family or "").strip().lower() == "googlebot"
-                or (ua.device.family or ua.device.model or "").strip().lower()
-                == "spider"
-            ):
-                device_type = "ROBOT"
-            elif ua.is_mobile:
-                device_type = "PHONE"
-            elif ua.is_tablet:
-                device_type = "TABLET"
-            elif ua.is_pc:
-                device_type = "PC"
-            
-            if device_type == "ROBOT" and service.ignore_robots:
+            session_fields = _session_fields(service, ip, user_agent, verdict.is_bot)
+            if session_fields["device_type"] == "ROBOT" and service.ignore_robots:
+                metrics.incr("events_dropped", "robot")
                 return 
             
-            session = Session.objects.create(
-                service=service,
-                ip=ip if service.collect_ips and not settings.BLOCK_ALL_IPS else None,
-                user_agent=user_agent,
-                identifier=identifier.strip(),
-                browser=ua.browser.family or "",
-                device=ua.device.family or ua.device.model or "",
-                device_type=device_type,
-                start_time=time,
-                last_seen=time,
-                os=ua.os.family or "",
-                asn=geiop_data.get("asn") or "",
-                country=geiop_data.get("country") or "",
-                longitude=geiop_data.get("longitude"),
-                latitude=geiop_data.get("latitude"),
-                time_zone=geiop_data.get("time_zone") or "",
-            )
+            with metrics.timed("session_write"):
+                session = Session.objects.create(
+                    service=service,
+                    identifier=identifier.strip(),
+                    start_time=time,
+                    last_seen=time,
+                    sample_rate=rate,
+                    **session_fields,
+                )
             cache.set(
                 session_cache_path, session.pk, timeout=settings.SESSION_MEMORY_TIMEOUT
             )
@@ -152,51 +308,311 @@ def ingress_request(
 
             logger.debug("Updating the old session with new data")
 
+            # an event held up in the queue can be older than its session; no hit
+            # starts before its session, which bounds deletes to its partitions
+            session.start_time = min(session.start_time, time)
             session.last_seen = time
+            if verdict.is_bot:
+                session.device_type = "ROBOT"
             if session.identifier == "" and identifier.strip() != "":
                 session.identifier = identifier.strip()
-            session.save()
+            with metrics.timed("session_write"):
+                session.save()
 
         #create or udpate a hit
-        idempotency = payload.get("idempotency")
-        idempotency_path = f"hit_idempotency_{idempotency}"
         hit = None
 
-        if idempotency is not None:
-            if cache.get(idempotency_path) is not None:
-                cache.touch(idempotency_path, settings.SESSION_MEMORY_TIMEOUT)
-                hit = Hit.objects.filter(pk=cache.get(idempotency_path), session=session).first()
-                if hit is not None:
-                    logger.debug("Hit is heartbat; updating old hit with new data")
-                    hit.heartbeats += 1
-                    hit.last_seen = time
-                    hit.save()
-
-        if hit is None:
-            logger.debug("Hit was not linked to existing session, create new one")
-            
-            hit = Hit.objects.create(
-                session=session,
-                initial=initial,
-                tracker=tracker,
-                # At first, location is given by the HTTP referrer. Some browsers
-                # will send the source of the script, however, so we allow JS payloads
-                # to include the location.
-                location=payload.get("location", location),
-                referrer=payload.get("referrer", ""),
-                load_time=payload.get("loadTime"),
-                start_time=time,
-                last_seen=time,
-                service=service,
-            )
-            # calucatute the bounce of sessions
-            session.recalculate_bounce()
-
+        with metrics.timed("hit_write"):
             if idempotency is not None:
-                cache.set(
-                    idempotency_path, hit.pk, timeout=settings.SESSION_MEMORY_TIMEOUT
+                if is_heartbeat:
+                    cache.touch(idempotency_path, settings.SESSION_MEMORY_TIMEOUT)
+                    hit = Hit.objects.filter(
+                        pk=cache.get(idempotency_path),
+                        session=session,
+                        start_time__gte=session.start_time,
+                    ).first()
+                    if hit is not None:
+                        logger.debug("Hit is heartbat; updating old hit with new data")
+                        hit.heartbeats += 1
+                        hit.last_seen = time
+                        hit.save()
+
+            if hit is None:
+                logger.debug("Hit was not linked to existing session, create new one")
+                
+                hit = Hit.objects.create(
+                    session=session,
+                    initial=initial,
+                    tracker=tracker,
+                    # At first, location is given by the HTTP referrer. Some browsers
+                    # will send the source of the script, however, so we allow JS payloads
+                    # to include the location.
+                    location=payload.get("location", location),
+                    referrer=payload.get("referrer", ""),
+                    load_time=_load_time(payload.get("loadTime")),
+                    start_time=time,
+                    last_seen=time,
+                    service=service,
                 )
+                # calucatute the bounce of sessions
+                session.recalculate_bounce()
+                incr_minute_counter(service.pk, time)
+                loadtimes.record(service.pk, hit.location, time, hit.load_time, session.sample_rate)
+
+                if idempotency is not None:
+                    cache.set(
+                        idempotency_path, hit.pk, timeout=settings.SESSION_MEMORY_TIMEOUT
+                    )
+        versions.bump(service.pk)
     except Exception as e:
         logger.exception(e)
         print(e)
-        raise e
\ No newline at end of file
+        raise e
+    finally:
+        if shard_token is not None:
+            sharding.deactivate(shard_token)
+        metrics.observe("total", perf_counter() - started)
+
+
+def _load_time(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value <= 0:
+        return None
+    return value
+
+
+@shared_task
+def ingress_batch(
+    service_uuid,
+    received,
+    events,
+    ip,
+    user_agent,
+    dnt=False,
+    identifier=""
+):
+    metrics.incr("events", amount=len(events))
+    shard_token = None
+    try:
+        shard, shard_status = sharding.placement(service_uuid)
+        if shard_status == sharding.LOCKED:
+            return _defer(
+                ingress_batch, service_uuid, received, events, ip, user_agent,
+                dnt=dnt, identifier=identifier,
+            )
+        shard_token = sharding.activate(shard)
+
+        # an SDK that did not see our response uploads the same buffer again
+        if is_duplicate(
+            service_uuid,
+            beacon_fingerprint("batch", ip, user_agent, json.dumps(events, sort_keys=True, default=str)),
+            received,
+        ):
+            metrics.incr("events_dropped", "duplicate", len(events))
+            return 0
+
+        with metrics.timed("service_lookup"):
+            service = Service.objects.filter(uuid=service_uuid, status=Service.ACTIVE).first()
+        if service is None:
+            metrics.incr("events_dropped", "inactive_service", len(events))
+            return 0
+
+        if dnt and service.respect_dnt:
+            logger.debug("Ignoring batch because of DNT")
+            metrics.incr("events_dropped", "dnt", len(events))
+            return 0
+
+        if _is_ignored_ip(service, ip):
+            logger.debug("Ignoring batch because of ignored ip")
+            metrics.incr("events_dropped", "ignored_ip", len(events))
+            return 0
+
+        association_hash = _association_hash(service, ip, user_agent)
+        session_cache_path = f"session_association_{service.pk}_{association_hash}"
+
+        with metrics.timed("bot_scoring"):
+            verdict = score_request(service.pk, association_hash, ip, False, now=received.timestamp())
+        if verdict.is_bot and service.ignore_robots:
+            logger.debug(f"Ignoring batch scored as bot: {', '.join(verdict.reasons)}")
+            metrics.incr("events_dropped", "bot_score", len(events))
+            return 0
+
+        timed = []
+        for event in events:
+            time = event_time(event.get("time"), received)
+            if time is not None:
+                timed.append((time, event))
+        if not timed:
+            return 0
+        timed.sort(key=lambda item: item[0])
+
+        timeout = timezone.timedelta(seconds=settings.SESSION_MEMORY_TIMEOUT)
+        session_pk = cache.get(session_cache_path)
+        session = None
+        if session_pk is not None and session_pk != NOT_SAMPLED:
+            session = Session.objects.filter(pk=session_pk, service=service).first()
+        if session is not None and timed[0][0] - session.last_seen > timeout:
+            session = None
+
+        # split the buffered events into sessions wherever the device was idle too long
+        groups = [[session, []]]
+        for time, event in timed:
+            if groups[-1][1] and time - groups[-1][1][-1][0] > timeout:
+                groups.append([None, []])
+            groups[-1][1].append((time, event))
+
+        new_groups = [group for group in groups if group[0] is None]
+        rate = sample_rate(service, received) if new_groups and session_pk != NOT_SAMPLED else None
+        if new_groups and (rate is None or not is_sampled(service, association_hash, rate)):
+            # events of the continued session stay; new sessions are left out of the sample
+            dropped = [time for group in new_groups for time, event in group[1]]
+            for minute_time, count in Counter(
+                time.replace(second=0, microsecond=0) for time in dropped
+            ).items():
+                incr_minute_counter(service.pk, minute_time, count)
+            metrics.incr("events_dropped", "sampled", len(dropped))
+            groups = [group for group in groups if group[0] is not None]
+            new_groups = []
+            if not groups:
+                cache.set(session_cache_path, NOT_SAMPLED, timeout=settings.SESSION_MEMORY_TIMEOUT)
+                return 0
+        if new_groups:
+            session_fields = _session_fields(service, ip, user_agent, verdict.is_bot)
+            if session_fields["device_type"] == "ROBOT" and service.ignore_robots:
+                metrics.incr("events_dropped", "robot", len(events))
+                return 0
+            with metrics.timed("session_write"):
+                created = bulk_insert(
+                    Session,
+                    [
+                        Session(
+                            service=service,
+                            identifier=identifier.strip(),
+                            start_time=group[1][0][0],
+                            last_seen=group[1][-1][0],
+                            is_bounce=len(group[1]) == 1,
+                            sample_rate=rate,
+                            **session_fields,
+                        )
+                        for group in new_groups
+                    ]
+                )
+            for group, created_session in zip(new_groups, created):
+                group[0] = created_session
+
+        hits = []
+        for group_session, group_events in groups:
+            initial = group_session is not session
+            for index, (time, event) in enumerate(group_events):
+                hits.append(
+                    Hit(
+                        session=group_session,
+                        service=service,
+                        initial=initial and index == 0,
+                        tracker="SDK",
+                        location=str(event.get("location", "")),
+                        referrer=str(event.get("referrer", "")),
+                        load_time=_load_time(event.get("loadTime")),
+                        start_time=time,
+                        last_seen=time,
+                    )
+                )
+        with metrics.timed("batch_write"):
+            bulk_insert(Hit, hits)
+        for hit in hits:
+            loadtimes.record(service.pk, hit.location, hit.start_time, hit.load_time, hit.session.sample_rate)
+
+        if session is not None:
+            session.start_time = min(session.start_time, groups[0][1][0][0])
+            session.last_seen = max(session.last_seen, groups[0][1][-1][0])
+            if verdict.is_bot:
+                session.device_type = "ROBOT"
+            if session.identifier == "" and identifier.strip() != "":
+                session.identifier = identifier.strip()
+            session.save()
+            session.recalculate_bounce()
+
+        cache.set(session_cache_path, groups[-1][0].pk, timeout=settings.SESSION_MEMORY_TIMEOUT)
+
+        for minute_time, count in Counter(
+            hit.start_time.replace(second=0, microsecond=0) for hit in hits
+        ).items():
+            incr_minute_counter(service.pk, minute_time, count)
+
+        versions.bump(service.pk)
+        return len(hits)
+    except Exception as e:
+        logger.exception(e)
+        raise e
+    finally:
+        if shard_token is not None:
+            sharding.deactivate(shard_token)
+
+
+@shared_task
+def evaluate_traffic_alerts():
+    return len(TrafficEvaluator().run_pending())
+
+
+@shared_task
+def run_deletion_jobs():
+    return len(run_pending_jobs())
+
+
+@shared_task
+def enforce_retention():
+    jobs = schedule_retention_jobs()
+    if jobs:
+        run_deletion_jobs.delay()
+    return len(jobs)
+
+
+@shared_task
+def maintain_hit_partitions():
+    # every shard has its own hit table to keep partitioned
+    results = sharding.fan_out(lambda alias: maintain_partitions()).values()
+    return {
+        "created": [name for created, _ in results for name in created],
+        "dropped": [name for _, dropped in results for name in dropped],
+    }
+
+
+@shared_task
+def archive_cold_data():
+    return archive_closed_months()
+
+
+@shared_task
+def rollup_geo_cells():
+    return sum(rollup_recent().values())
+
+
+@shared_task
+def rollup_segment_bitmaps():
+    return sum(rollup_recent_segments().values())
+
+
+@shared_task
+def compact_load_time_sketches():
+    return loadtimes.compact()
+
+
+@shared_task
+def sample_ingress_queue_depths():
+    return sample_queue_depths()
+
+
+@task_postrun.connect
+def _flush_load_times(**kwargs):
+    loadtimes.maybe_flush()
+
+
+@worker_init.connect
+def _preload(**kwargs):
+    # sent in the worker's main process, before the pool forks its children
+    preload()
+
+
+@worker_process_shutdown.connect
+def _flush_metrics(**kwargs):
+    metrics.flush()
+    loadtimes.flush()
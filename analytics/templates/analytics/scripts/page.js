@@ -0,0 +1,57 @@
+// Lightweight, privacy-friendly analytics. This script is rendered once per service
+// and cached, so it holds nothing specific to the page or the visitor.
+(function () {
+  // beacons go back to the URL this script was loaded from
+  var endpoint = document.currentScript && document.currentScript.src;
+  if (!endpoint) {
+    return;
+  }
+
+  window.Crena = {
+    idempotency: null,
+    heartbeatTaskId: null,
+    skipHeartbeat: false,
+    sendHeartbeat: function () {
+      try {
+        if (document.hidden || Crena.skipHeartbeat) {
+          return;
+        }
+        Crena.skipHeartbeat = true;
+        var timing = window.performance && window.performance.timing;
+        var xhr = new XMLHttpRequest();
+        xhr.open("POST", endpoint, true);
+        // a simple request: cross-origin JSON would need a preflight before every beacon
+        xhr.setRequestHeader("Content-Type", "text/plain;charset=UTF-8");
+        xhr.onload = function () {
+          Crena.skipHeartbeat = false;
+        };
+        xhr.onerror = function () {
+          Crena.skipHeartbeat = false;
+        };
+        xhr.send(
+          JSON.stringify({
+            idempotency: Crena.idempotency,
+            referrer: document.referrer,
+            location: window.location.href,
+            loadTime: timing ? timing.domContentLoadedEventEnd - timing.navigationStart : null,
+          })
+        );
+      } catch (e) {}
+    },
+    newPageLoad: function () {
+      if (Crena.heartbeatTaskId != null) {
+        clearInterval(Crena.heartbeatTaskId);
+      }
+      Crena.idempotency = Math.random().toString(36).substring(2);
+      Crena.skipHeartbeat = false;
+      Crena.heartbeatTaskId = setInterval(Crena.sendHeartbeat, {{ heartbeat_frequency }});
+      Crena.sendHeartbeat();
+    },
+  };
+
+  window.addEventListener("load", Crena.newPageLoad);
+})();
+{% if script_inject %}
+// The following was added by this site's administrator.
+{{ script_inject|safe }}
+{% endif %}
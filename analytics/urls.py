@@ -1,6 +1,17 @@
 from django.urls import path
 
+from .views.ingress import BatchView, ScriptView
+from .views.metrics import MetricsView
+
+app_name = "analytics"
 
 urlpatterns = [
-    
+    path("ingress/<uuid:service_uuid>/batch", BatchView.as_view(), name="endpoint_batch"),
+    path("ingress/<uuid:service_uuid>/script.js", ScriptView.as_view(), name="endpoint_script"),
+    path(
+        "ingress/<uuid:service_uuid>/<str:identifier>/script.js",
+        ScriptView.as_view(),
+        name="endpoint_script_id",
+    ),
+    path("metrics", MetricsView.as_view(), name="metrics"),
 ]
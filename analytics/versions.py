@@ -0,0 +1,31 @@
+import secrets
+import time
+
+from django.core.cache import cache
+
+# a version of each service's stored data, behind the API's ETag and Last-Modified
+# validators. Every path that writes or removes sessions and hits bumps it, whatever
+# timestamps the rows carry; a version the cache lost is replaced by a new one, which
+# costs clients a full response, never a stale 304
+
+
+def _version_path(service_pk):
+    return f"service_data_version_{service_pk}"
+
+
+def _new_version():
+    # (token, unix time of the change)
+    return secrets.token_hex(8), time.time()
+
+
+def bump(service_pk):
+    cache.set(_version_path(service_pk), _new_version(), timeout=None)
+
+
+def data_version(service_pk):
+    path = _version_path(service_pk)
+    version = cache.get(path)
+    if version is None:
+        cache.add(path, _new_version(), timeout=None)
+        version = cache.get(path) or _new_version()
+    return tuple(version)
@@ -1,5 +1,6 @@
 import base64
 import json
+from functools import partial
 
 from django.conf import settings
 from django.core.cache import cache
@@ -8,6 +9,7 @@ from django.http.response import (
 )
 from django.shortcuts import render
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
@@ -16,11 +18,12 @@ from django.utils import timezone
 from ipware import get_client_ip
 
 from core.models import Service
-from ..tasks import ingress_request
+from .. import embedded, queues, scripts
+from ..batch import BatchError, read_ndjson
+from ..tasks import ingress_request, ingress_batch
 
 
-def ingress(request, service_uuid, tracker, identifier, payload):
-    time = timezone.now()
+def _request_context(request):
     client_ip, is_routeable = get_client_ip(request)
     location = request.META.get("HTTP_REFERER", "").strip()
     user_agent = request.META.get("HTTP_USER_AGENT", "").strip()
@@ -28,17 +31,37 @@ def ingress(request, service_uuid, tracker, identifier, payload):
     gpc = request.META.get("HTTP_SEC_GPC", "0").strip() == "1"
     if gpc or dnt:
         dnt = True
+    return client_ip, location, user_agent, dnt
 
-    ingress_request.delay(
-        service_uuid,
-        tracker,
-        time,
-        payload,
-        client_ip,
-        location,
-        user_agent,
-        dnt=dnt,
-        identifier=identifier,
+
+def ingress(request, service_uuid, tracker, identifier, payload):
+    time = timezone.now()
+    client_ip, location, user_agent, dnt = _request_context(request)
+
+    if settings.INGRESS_MODE == "embedded":
+        embedded.submit(
+            ingress_request,
+            service_uuid,
+            tracker,
+            time,
+            payload,
+            client_ip,
+            location,
+            user_agent,
+            dnt=dnt,
+            identifier=identifier,
+        )
+        return
+
+    heartbeat = queues.is_heartbeat(service_uuid, payload)
+    if queues.should_shed(heartbeat):
+        return
+
+    # queued by visitor, heartbeats behind new sessions; see analytics.queues
+    ingress_request.apply_async(
+        (service_uuid, tracker, time, payload, client_ip, location, user_agent),
+        {"dnt": dnt, "identifier": identifier},
+        queue=queues.visitor_queue(service_uuid, client_ip, user_agent, heartbeat),
     )
 
 
@@ -72,4 +95,71 @@ class PixelView(ValidateServiceOriginMixin, View):
 
 @method_decorator(csrf_exempt, name="dispatch")
 class ScriptView(ValidateServiceOriginMixin, View):
-    pass
\ No newline at end of file
+    def get(self, request, service_uuid, identifier=""):
+        # served from memory; the script is only rendered when its service changes
+        script = scripts.get_script(service_uuid)
+        if script is None:
+            raise Http404()
+
+        body, etag, encoding = script.negotiate(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(body, content_type="application/javascript; charset=utf-8")
+            if encoding is not None:
+                response["Content-Encoding"] = encoding
+        response["ETag"] = etag
+        response["Vary"] = "Accept-Encoding"
+        response["Cache-Control"] = (
+            f"public, max-age={settings.SCRIPT_CACHE_MAX_AGE}, "
+            f"stale-while-revalidate={settings.SCRIPT_STALE_WHILE_REVALIDATE}"
+        )
+        return response
+
+    def post(self, request, service_uuid, identifier=""):
+        try:
+            payload = json.loads(request.body)
+        except ValueError:
+            return HttpResponseBadRequest("Invalid JSON")
+        if not isinstance(payload, dict):
+            return HttpResponseBadRequest("Payload must be an object")
+        ingress(request, str(service_uuid), "JS", identifier, payload)
+        return HttpResponse(json.dumps({"status": "OK"}), content_type="application/json")
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class BatchView(View):
+    # offline buffers from the mobile SDKs: one request and one task per upload
+    http_method_names = ["post", "options"]
+
+    def post(self, request, service_uuid):
+        time = timezone.now()
+        try:
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            return HttpResponseBadRequest("Invalid Content-Length")
+        if length > settings.BATCH_MAX_BYTES:
+            return HttpResponse("Batch is too large", status=413)
+
+        compressed = request.META.get("HTTP_CONTENT_ENCODING", "").strip().lower() == "gzip"
+        try:
+            events = read_ndjson(request, compressed=compressed)
+        except BatchError as e:
+            return HttpResponse(str(e), status=e.status)
+
+        if events:
+            client_ip, location, user_agent, dnt = _request_context(request)
+            enqueue = (
+                partial(embedded.submit, ingress_batch)
+                if settings.INGRESS_MODE == "embedded"
+                else ingress_batch.delay
+            )
+            enqueue(
+                str(service_uuid),
+                time,
+                events,
+                client_ip,
+                user_agent,
+                dnt=dnt,
+                identifier=request.GET.get("identifier", ""),
+            )
+        return HttpResponse(status=202)
@@ -0,0 +1,27 @@
+import hmac
+
+from django.conf import settings
+from django.http import Http404
+from django.http.response import HttpResponse
+from django.views.generic import View
+
+from .. import metrics
+
+
+class MetricsView(View):
+    # Prometheus scrape target, for requests carrying METRICS_TOKEN as a bearer token.
+    # The client address proves nothing: behind a local proxy every request is local
+    http_method_names = ["get"]
+
+    def get(self, request):
+        if not settings.METRICS_TOKEN:
+            raise Http404
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode()):
+            response = HttpResponse("Unauthorized", status=401)
+            response["WWW-Authenticate"] = 'Bearer realm="metrics"'
+            return response
+        metrics.flush()
+        return HttpResponse(
+            metrics.render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
@@ -0,0 +1,65 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    # seeks on (start_time, id) so every page is an index range scan on
+    # (service, -start_time) no matter how deep the client pages
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, settings.API_PAGE_SIZE))
+        except ValueError:
+            page_size = settings.API_PAGE_SIZE
+        return max(1, min(page_size, settings.API_MAX_PAGE_SIZE))
+
+    def encode_cursor(self, instance):
+        raw = f"{instance.start_time.isoformat()}|{instance.pk}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            start_time, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            start_time = parse_datetime(start_time)
+            pk = int(pk)
+        except (binascii.Error, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if start_time is None:
+            raise NotFound(self.invalid_cursor_message)
+        return start_time, pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            start_time, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(start_time__lt=start_time) | Q(start_time=start_time, pk__lt=pk)
+            )
+
+        page = list(queryset.order_by("-start_time", "-pk")[:page_size + 1])
+        self.has_next = len(page) > page_size
+        self.page = page[:page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
@@ -0,0 +1,6 @@
+from rest_framework.routers import DefaultRouter
+
+from .views import ServiceViewSet
+
+router = DefaultRouter()
+router.register("services", ServiceViewSet, basename="service")
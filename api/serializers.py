@@ -0,0 +1,51 @@
+from rest_framework import serializers
+
+from analytics.models import Session, Hit
+from core.models import Service
+
+
+class ServiceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Service
+        fields = ("uuid", "name", "link", "status", "created")
+
+
+class SessionSerializer(serializers.ModelSerializer):
+    # plain column values only, so serializing a page never triggers related lookups
+    class Meta:
+        model = Session
+        fields = (
+            "id",
+            "uuid",
+            "identifier",
+            "start_time",
+            "last_seen",
+            "browser",
+            "devices",
+            "device_type",
+            "os",
+            "asn",
+            "country",
+            "time_zone",
+            "is_bounce",
+            "sample_rate",
+        )
+
+
+class HitSerializer(serializers.ModelSerializer):
+    session = serializers.IntegerField(source="session_id", read_only=True)
+
+    class Meta:
+        model = Hit
+        fields = (
+            "id",
+            "session",
+            "initial",
+            "start_time",
+            "last_seen",
+            "heartbeats",
+            "tracker",
+            "location",
+            "referrer",
+            "load_time",
+        )
@@ -1,3 +1,89 @@
-from django.test import TestCase
+import datetime
 
-# Create your tests here.
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from analytics import geohash
+from analytics.deletion import run_job
+from analytics.geo import rollup_day
+from analytics.models import DeletionJob, Session
+from analytics.tasks import ingress_batch
+from core.factories import HitFactory, ServiceFactory, SessionFactory
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+
+class ServiceApiTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.service = ServiceFactory()
+        self.client.force_authenticate(self.service.owner)
+        self.now = timezone.now().replace(microsecond=0)
+        self.sessions = [
+            SessionFactory(service=self.service, start_time=self.now - datetime.timedelta(minutes=minutes))
+            for minutes in range(25)
+        ]
+
+    def url(self, action):
+        return f"/api/services/{self.service.uuid}/{action}/"
+
+    def test_keyset_pages_cover_every_session_once(self):
+        seen = []
+        url = self.url("sessions") + "?page_size=7"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(session["uuid"] for session in response.data["results"])
+            url = response.data["next"]
+        self.assertEqual(seen, [str(session.uuid) for session in self.sessions])
+
+    def test_a_broken_cursor_is_a_404(self):
+        self.assertEqual(self.client.get(self.url("sessions") + "?cursor=notacursor").status_code, 404)
+
+    def test_malformed_dates_are_a_400(self):
+        for value in ("yesterday", "2024-02-30T00:00:00", "2024-13-01T00:00:00"):
+            response = self.client.get(self.url("sessions"), {"start": value})
+            self.assertEqual(response.status_code, 400, value)
+
+    def conditional(self, response):
+        return {"HTTP_IF_NONE_MATCH": response["ETag"]}
+
+    def test_unchanged_data_is_a_304(self):
+        first = self.client.get(self.url("hits"))
+        self.assertEqual(self.client.get(self.url("hits"), **self.conditional(first)).status_code, 304)
+
+    def test_late_batch_events_change_the_validator(self):
+        # events a day old leave the newest last_seen where it was
+        first = self.client.get(self.url("sessions"))
+        old = (self.now - datetime.timedelta(days=1)).isoformat()
+        ingress_batch(
+            str(self.service.uuid), self.now, [{"time": old, "location": "/offline"}], "198.51.100.2", USER_AGENT
+        )
+        response = self.client.get(self.url("sessions"), **self.conditional(first))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 26)
+
+    def test_deletions_change_the_validator(self):
+        # an older visitor's data; the newest session stays
+        visitor = self.sessions[10]
+        Session.objects.filter(pk=visitor.pk).update(identifier="visitor-1")
+        HitFactory(session=visitor)
+        first = self.client.get(self.url("hits"))
+        job = DeletionJob.objects.create(service=self.service, kind=DeletionJob.VISITOR, identifier="visitor-1")
+        run_job(job, pause=0)
+        self.assertFalse(Session.objects.filter(pk=visitor.pk).exists())
+        response = self.client.get(self.url("hits"), **self.conditional(first))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"], [])
+
+    def test_map_cells_by_zoom(self):
+        Session.objects.filter(service=self.service).update(geohash=geohash.encode(52.52, 13.40, 6))
+        for day in {self.now.date(), self.sessions[-1].start_time.date()}:
+            rollup_day(day)
+        response = self.client.get(self.url("map"), {"zoom": 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["precision"], 1)
+        self.assertEqual(response.data["cells"][0]["sessions"], 25)
+        self.assertEqual(self.client.get(self.url("map"), {"within": "u3a"}).status_code, 400)
+        self.assertEqual(self.client.get(self.url("map"), {"zoom": "far"}).status_code, 400)
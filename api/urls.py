@@ -1,5 +1,9 @@
-from django.urls import path
+from django.urls import path, include
+
+from .routers import router
+
+app_name = "api"
 
 urlpatterns = [
-    
+    path("", include(router.urls)),
 ]
@@ -1 +1,154 @@
-from django.shortcuts import render
\ No newline at end of file
+from hashlib import sha256
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
+from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from analytics.geo import map_cells
+from analytics.geohash import BASE32
+from analytics.models import Session, Hit
+from analytics.versions import data_version
+from core.models import Service
+from core.profiling import profile_queries
+from crena import sharding
+from crena.routers import replica_reads
+from .pagination import KeysetPagination
+from .serializers import ServiceSerializer, SessionSerializer, HitSerializer
+
+
+def _parse_time(request, name):
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        # well-formed, but not a date, like 2024-02-30
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: f"Invalid timestamp {value!r}"})
+    return parsed
+
+
+def _parse_segment(request):
+    # ?country=DE&device_type=PHONE narrows the stats to one segment
+    return {
+        dimension: request.query_params[dimension]
+        for dimension in settings.SEGMENT_DIMENSIONS
+        if request.query_params.get(dimension)
+    }
+
+
+class ServiceViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = ServiceSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = "uuid"
+
+    def dispatch(self, request, *args, **kwargs):
+        # the API only reads, so all of it can be served from a replica
+        with replica_reads():
+            return super().dispatch(request, *args, **kwargs)
+
+    def get_queryset(self):
+        user = self.request.user
+        services = Service.objects.all()
+        if not user.is_superuser:
+            services = services.filter(Q(owner=user) | Q(collaborators=user))
+        return services
+
+    def _conditional(self, request, service, build, salt=""):
+        with sharding.service_shard(service):
+            return self._conditional_response(request, service, build, salt)
+
+    def _conditional_response(self, request, service, build, salt):
+        # the service's data version changes with every write, late and deleted rows
+        # included, which the newest last_seen does not
+        token, changed = data_version(service.pk)
+        etag = quote_etag(
+            sha256(f"{request.get_full_path()}|{token}|{salt}".encode("utf-8")).hexdigest()[:32]
+        )
+        timestamp = int(changed)
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = build()
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(timestamp)
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+    def _listing(self, request, queryset, serializer_class):
+        start_time = _parse_time(request, "start")
+        end_time = _parse_time(request, "end")
+        if start_time is not None:
+            queryset = queryset.filter(start_time__gte=start_time)
+        if end_time is not None:
+            queryset = queryset.filter(start_time__lt=end_time)
+
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(serializer_class(page, many=True).data)
+
+    @action(detail=True)
+    def sessions(self, request, uuid=None):
+        service = self.get_object()
+        return self._conditional(
+            request,
+            service,
+            lambda: self._listing(request, Session.objects.filter(service=service), SessionSerializer),
+        )
+
+    @action(detail=True)
+    def hits(self, request, uuid=None):
+        service = self.get_object()
+        return self._conditional(
+            request,
+            service,
+            lambda: self._listing(request, Hit.objects.filter(service=service), HitSerializer),
+        )
+
+    @action(detail=True)
+    def map(self, request, uuid=None):
+        service = self.get_object()
+        end_time = _parse_time(request, "end") or timezone.now()
+        start_time = _parse_time(request, "start") or end_time - timezone.timedelta(days=30)
+        try:
+            zoom = int(request.query_params.get("zoom", 2))
+        except ValueError:
+            raise ValidationError({"zoom": "Must be an integer"})
+        # a geohash prefix limits the cells to the visible area at high zoom levels
+        within = request.query_params.get("within", "")
+        if not all(char in BASE32 for char in within):
+            raise ValidationError({"within": "Must be a geohash"})
+
+        precision, cells = map_cells(service, start_time.date(), end_time.date(), zoom, within)
+        return Response({"precision": precision, "cells": cells})
+
+    @action(detail=True)
+    def stats(self, request, uuid=None):
+        service = self.get_object()
+        start_time = _parse_time(request, "start")
+        end_time = _parse_time(request, "end")
+        segment = _parse_segment(request)
+        if request.query_params.get("profile") == "1" and request.user.is_staff:
+            # a per-request query report; never answered from a validator, since the
+            # point is to run the queries
+            with profile_queries("core_stats") as profile:
+                data = service.get_core_status(start_time, end_time, segment)
+            return Response({**data, "profile": profile.report()})
+        # relative windows and the online count move with the clock, so the minute is
+        # part of the validator as well
+        minute = timezone.now().replace(second=0, microsecond=0).isoformat()
+        return self._conditional(
+            request,
+            service,
+            lambda: Response(service.get_core_status(start_time, end_time, segment)),
+            salt=minute,
+        )
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import Service, User
+from .models import Service, ServicePlacement, User
 
 
 class UserAdmin(BaseUserAdmin):
@@ -20,4 +20,17 @@ class ServiceAdmin(admin.ModelAdmin):
     search_fields = ("name", "link", "owner")
 
 
-admin.site.register(Service, ServiceAdmin)
\ No newline at end of file
+admin.site.register(Service, ServiceAdmin)
+
+
+class ServicePlacementAdmin(admin.ModelAdmin):
+    # changed by the move_service command only, which copies the rows first
+    list_display = ("service", "database", "status", "target", "updated")
+    list_filter = ("database", "status")
+    readonly_fields = ("service", "database", "status", "target", "updated")
+
+    def has_add_permission(self, request):
+        return False
+
+
+admin.site.register(ServicePlacement, ServicePlacementAdmin)
@@ -1,8 +1,203 @@
+import ipaddress
+import math
+from bisect import bisect
+from itertools import accumulate
+
 import factory
+from django.conf import settings
+from django.utils import timezone
+from factory.random import randgen
+
+from analytics.geohash import encode as geohash_encode
+from analytics.models import Hit, Session
 from .models import Service, User
 
 
-class TestFactory(factory.django.DjangoModelFactory):
-    service = Service.objects.create(
-        
-    )
\ No newline at end of file
+class Zipf:
+    # values drawn with probability proportional to 1 / rank ** exponent, the shape of
+    # page, referrer and browser popularity on real sites
+    def __init__(self, values, exponent=1.1):
+        self.values = list(values)
+        self.cum_weights = list(accumulate(1 / rank**exponent for rank in range(1, len(self.values) + 1)))
+        self.total = self.cum_weights[-1]
+
+    def __call__(self, rng=randgen):
+        return self.values[bisect(self.cum_weights, rng.random() * self.total)]
+
+
+# user agent, browser, os, device type, device; ordered by share
+USER_AGENTS = Zipf(
+    [
+        ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36", "Chrome", "Windows", "DESKTOP", "Other"),
+        ("Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1", "Mobile Safari", "iOS", "PHONE", "iPhone"),
+        ("Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Mobile Safari/537.36", "Chrome Mobile", "Android", "PHONE", "Samsung SM-S918B"),
+        ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Safari/605.1.15", "Safari", "Mac OS X", "DESKTOP", "Mac"),
+        ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36 Edg/124.0", "Edge", "Windows", "DESKTOP", "Other"),
+        ("Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:125.0) Gecko/20100101 Firefox/125.0", "Firefox", "Windows", "DESKTOP", "Other"),
+        ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36", "Chrome", "Mac OS X", "DESKTOP", "Mac"),
+        ("Mozilla/5.0 (iPad; CPU OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1", "Mobile Safari", "iOS", "TABLET", "iPad"),
+        ("Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36", "Chrome", "Linux", "DESKTOP", "Other"),
+        ("Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Mobile Safari/537.36", "Chrome Mobile", "Android", "PHONE", "Pixel 8"),
+        ("Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0", "Firefox", "Ubuntu", "DESKTOP", "Other"),
+        ("Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)", "Googlebot", "Other", "ROBOT", "Spider"),
+    ]
+)
+
+# country, latitude, longitude, time zone
+COUNTRIES = Zipf(
+    [
+        ("US", 39.8, -98.6, "America/Chicago"),
+        ("DE", 51.2, 10.4, "Europe/Berlin"),
+        ("IN", 22.4, 79.1, "Asia/Kolkata"),
+        ("GB", 54.0, -2.5, "Europe/London"),
+        ("FR", 46.6, 2.4, "Europe/Paris"),
+        ("BR", -10.8, -52.9, "America/Sao_Paulo"),
+        ("CA", 56.1, -106.3, "America/Toronto"),
+        ("JP", 36.2, 138.3, "Asia/Tokyo"),
+        ("NL", 52.1, 5.3, "Europe/Amsterdam"),
+        ("ES", 40.5, -3.7, "Europe/Madrid"),
+        ("AU", -25.3, 133.8, "Australia/Sydney"),
+        ("PL", 51.9, 19.1, "Europe/Warsaw"),
+        ("IT", 41.9, 12.6, "Europe/Rome"),
+        ("SE", 60.1, 18.6, "Europe/Stockholm"),
+        ("NG", 9.1, 8.7, "Africa/Lagos"),
+    ]
+)
+
+ASNS = Zipf(["Comcast Cable", "Deutsche Telekom AG", "Reliance Jio", "Vodafone", "Orange", "AT&T", "Amazon.com", "Hetzner Online GmbH"])
+
+REFERRERS = Zipf(
+    [
+        "",
+        "https://www.google.com/",
+        "https://t.co/",
+        "https://www.bing.com/",
+        "https://duckduckgo.com/",
+        "https://news.ycombinator.com/",
+        "https://www.reddit.com/",
+        "https://www.facebook.com/",
+        "https://www.linkedin.com/",
+        "https://github.com/",
+        *(f"https://blog{n}.example.org/posts/{n * 7}" for n in range(200)),
+    ],
+    exponent=1.3,
+)
+
+PAGES = Zipf(
+    [
+        "/",
+        "/pricing",
+        "/docs",
+        "/blog",
+        "/about",
+        "/login",
+        "/signup",
+        *(f"/docs/{n}" for n in range(300)),
+        *(f"/blog/post-{n}" for n in range(2000)),
+    ]
+)
+
+
+def random_ip(rng=randgen):
+    return str(ipaddress.IPv4Address(rng.randrange(0x01000000, 0xDF000000)))
+
+
+def session_values(rng=randgen):
+    # the visitor side of a session: device, place and network
+    user_agent, browser, os, device_type, devices = USER_AGENTS(rng)
+    country, latitude, longitude, time_zone = COUNTRIES(rng)
+    latitude += rng.uniform(-3, 3)
+    longitude += rng.uniform(-3, 3)
+    return {
+        "identifier": f"user-{rng.randrange(10**6)}" if rng.random() < 0.05 else "",
+        "user_agent": user_agent,
+        "browser": browser,
+        "os": os,
+        "device_type": device_type,
+        "devices": devices,
+        "ip": random_ip(rng),
+        "asn": ASNS(rng),
+        "country": country,
+        "latitude": latitude,
+        "longitude": longitude,
+        "time_zone": time_zone,
+        "geohash": geohash_encode(latitude, longitude, settings.GEOHASH_PRECISION),
+    }
+
+
+def hit_values(link, initial, rng=randgen):
+    # a page view; only the first one of a session comes from another site
+    heartbeats = min(int(rng.expovariate(0.3)), 120)
+    return {
+        "initial": initial,
+        "heartbeats": heartbeats,
+        "tracker": "JS",
+        "location": f"{link}{PAGES(rng)}",
+        "referrer": REFERRERS(rng) if initial else "",
+        # milliseconds, log-normally spread around 800
+        "load_time": round(math.exp(rng.gauss(6.7, 0.6))),
+        "duration": timezone.timedelta(seconds=heartbeats * settings.SCRIPT_HEARTBEAT_FREQUENCY / 1000),
+    }
+
+
+class UserFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = User
+        django_get_or_create = ("username",)
+
+    username = factory.Sequence(lambda n: f"user-{n}")
+    email = factory.Sequence(lambda n: f"user-{n}@example.com")
+
+
+class ServiceFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = Service
+
+    owner = factory.SubFactory(UserFactory)
+    collaborators = factory.SelfAttribute("owner")
+    name = factory.Sequence(lambda n: f"Service {n}")
+    link = factory.Sequence(lambda n: f"https://site-{n}.example.com")
+
+
+class SessionFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = Session
+        exclude = ("values",)
+
+    service = factory.SubFactory(ServiceFactory)
+    values = factory.LazyFunction(session_values)
+    start_time = factory.LazyFunction(
+        lambda: timezone.now() - timezone.timedelta(seconds=randgen.randrange(30 * 86400))
+    )
+    last_seen = factory.SelfAttribute("start_time")
+    identifier = factory.LazyAttribute(lambda o: o.values["identifier"])
+    user_agent = factory.LazyAttribute(lambda o: o.values["user_agent"])
+    browser = factory.LazyAttribute(lambda o: o.values["browser"])
+    os = factory.LazyAttribute(lambda o: o.values["os"])
+    device_type = factory.LazyAttribute(lambda o: o.values["device_type"])
+    devices = factory.LazyAttribute(lambda o: o.values["devices"])
+    ip = factory.LazyAttribute(lambda o: o.values["ip"])
+    asn = factory.LazyAttribute(lambda o: o.values["asn"])
+    country = factory.LazyAttribute(lambda o: o.values["country"])
+    latitude = factory.LazyAttribute(lambda o: o.values["latitude"])
+    longitude = factory.LazyAttribute(lambda o: o.values["longitude"])
+    time_zone = factory.LazyAttribute(lambda o: o.values["time_zone"])
+    geohash = factory.LazyAttribute(lambda o: o.values["geohash"])
+
+
+class HitFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = Hit
+        exclude = ("values",)
+
+    session = factory.SubFactory(SessionFactory)
+    service = factory.SelfAttribute("session.service")
+    initial = True
+    values = factory.LazyAttribute(lambda o: hit_values(o.service.link, o.initial))
+    start_time = factory.SelfAttribute("session.start_time")
+    last_seen = factory.LazyAttribute(lambda o: o.start_time + o.values["duration"])
+    heartbeats = factory.LazyAttribute(lambda o: o.values["heartbeats"])
+    tracker = factory.LazyAttribute(lambda o: o.values["tracker"])
+    location = factory.LazyAttribute(lambda o: o.values["location"])
+    referrer = factory.LazyAttribute(lambda o: o.values["referrer"])
+    load_time = factory.LazyAttribute(lambda o: o.values["load_time"])
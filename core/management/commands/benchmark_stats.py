@@ -0,0 +1,165 @@
+import json
+import re
+import statistics
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+from django.db.models import Count
+from django.utils import timezone
+
+from analytics.models import Session
+from core.models import Service
+from core.profiling import profile_queries
+from crena import sharding
+
+# the component of get_relative_stats a query belongs to, by its fingerprint; the
+# first match wins, so the specific patterns come before the plain counts
+COMPONENTS = [
+    ("segment", re.compile(r"analytics_segmentbitmap")),
+    ("chart", re.compile(r"django_datetime_trunc|django_datetime_cast_date|DATE_TRUNC|AT TIME ZONE")),
+    ("load_time", re.compile(r"analytics_loadtimesketch|\"analytics_hit\"\.\"load_time\"")),
+    ("session_duration", re.compile(r"AVG\(.*\"last_seen\".*\"start_time\"")),
+    ("online", re.compile(r"\"analytics_session\"\.\"last_seen\" > \?")),
+    ("has_hits", re.compile(r"SELECT \? AS \"a\" FROM \"analytics_hit\"")),
+    ("bounces", re.compile(r"\"is_bounce\"")),
+    ("top", re.compile(r"^SELECT \"analytics_(?:session|hit)\"\.\"(\w+)\" AS \"\w+\", COUNT\(")),
+    ("session_count", re.compile(r"FROM \"analytics_session\"")),
+    ("hit_count", re.compile(r"FROM \"analytics_hit\"")),
+]
+
+
+def component(fingerprint):
+    for name, pattern in COMPONENTS:
+        match = pattern.search(fingerprint)
+        if match:
+            return f"top_{match.group(1)}" if name == "top" else name
+    return "other"
+
+
+class Command(BaseCommand):
+    help = (
+        "Time get_relative_stats on existing data, e.g. from generate_dataset, and report "
+        "the database time of each stats component per window."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--service", action="append", default=[], help="A service uuid; repeatable.")
+        parser.add_argument("--largest", type=int, default=3, help="Without --service, the N busiest services.")
+        parser.add_argument("--days", default="1,7,30", help="Comma-separated window lengths.")
+        parser.add_argument("--runs", type=int, default=3, help="Runs per window; medians are reported.")
+        parser.add_argument(
+            "--segment", action="append", default=[], help="dimension=value to filter by; repeatable."
+        )
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        services = self.get_services(options)
+        try:
+            windows = [int(days) for days in options["days"].split(",")]
+            segment = dict(item.split("=", 1) for item in options["segment"])
+        except ValueError:
+            raise CommandError("--days takes integers and --segment dimension=value")
+
+        results = []
+        for service in services:
+            for days in windows:
+                results.append(self.benchmark(service, days, segment or None, options["runs"]))
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for result in results:
+            self.write_result(result)
+
+    def get_services(self, options):
+        if options["service"]:
+            services = list(Service.objects.filter(uuid__in=options["service"]))
+            if len(services) != len(set(options["service"])):
+                raise CommandError("Not every --service exists")
+            return services
+
+        def busiest(alias):
+            return list(
+                Session.objects.filter(sharding.placed_on(alias))
+                .values("service_id")
+                .annotate(sessions=Count("pk"))
+                .order_by("-sessions")[: options["largest"]]
+            )
+
+        rows = sorted(
+            (row for rows in sharding.fan_out(busiest).values() for row in rows),
+            key=lambda row: row["sessions"],
+            reverse=True,
+        )[: options["largest"]]
+        if not rows:
+            raise CommandError("No sessions to benchmark; run generate_dataset first")
+        services = Service.objects.in_bulk([row["service_id"] for row in rows])
+        return [services[row["service_id"]] for row in rows]
+
+    def benchmark(self, service, days, segment, runs):
+        end_time = timezone.now()
+        start_time = end_time - timezone.timedelta(days=days)
+        timings = defaultdict(list)
+        queries = defaultdict(int)
+        error = None
+        for _ in range(runs):
+            started = time.perf_counter()
+            with sharding.service_shard(service), profile_queries("benchmark_stats") as profile:
+                try:
+                    stats = service.get_relative_stats(start_time, end_time, segment)
+                except DatabaseError as e:
+                    # the components timed before the failing query are still reported
+                    stats, error = None, str(e).splitlines()[0]
+            wall = time.perf_counter() - started
+
+            run = defaultdict(float)
+            counts = defaultdict(int)
+            for query in profile.queries:
+                name = component(query.fingerprint)
+                run[name] += query.duration
+                counts[name] += 1
+            run["python"] = wall - profile.total_time
+            run["total"] = wall
+            for name, duration in run.items():
+                timings[name].append(duration * 1000)
+            for name, count in counts.items():
+                queries[name] += count
+
+        return {
+            "service": str(service.uuid),
+            "name": service.name,
+            "days": days,
+            "segment": segment,
+            "sessions": stats["session_count"] if stats else None,
+            "hits": stats["hits_counts"] if stats else None,
+            "error": error,
+            "components": {
+                name: {
+                    "queries": queries[name] // runs,
+                    "median_ms": round(statistics.median(values), 2),
+                    "max_ms": round(max(values), 2),
+                }
+                for name, values in sorted(timings.items(), key=lambda item: -statistics.median(item[1]))
+            },
+        }
+
+    def write_result(self, result):
+        header = f"{result['name']} ({result['service']}), last {result['days']} days"
+        if result["sessions"] is not None:
+            header += f": {result['sessions']} sessions, {result['hits']} hits"
+        if result["segment"]:
+            header += f", segment {result['segment']}"
+        self.stdout.write(header)
+        if result["error"]:
+            self.stdout.write(self.style.ERROR(f"  failed: {result['error']}"))
+        total = result["components"]["total"]["median_ms"] or 1
+        for name, timing in result["components"].items():
+            if name == "total":
+                continue
+            self.stdout.write(
+                f"  {name:<18} {timing['queries']:>3} queries {timing['median_ms']:>10.2f} ms "
+                f"(max {timing['max_ms']:.2f}) {timing['median_ms'] * 100 / total:5.1f}%"
+            )
+        self.stdout.write(f"  {'total':<18} {'':>11} {total:>10.2f} ms")
@@ -0,0 +1,122 @@
+import json
+import random
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from analytics.bulk import bulk_insert
+from analytics.models import Session, Hit
+from analytics.partitions import create_partition, interval_start, is_partitioned, next_interval
+from core.models import Service, User
+from core.profiling import compare_to_baseline, profile_queries
+from crena import sharding
+
+BASELINE = Path(__file__).resolve().parents[2] / "query_baseline.json"
+PAGES = [f"/page/{n}" for n in range(100)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Profile the core stats path on a generated dataset and fail when it needs more "
+        "queries than the committed baseline; DB time only fails with --time-tolerance."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sessions", type=int, default=2000)
+        parser.add_argument("--hits-per-session", type=int, default=4)
+        parser.add_argument("--runs", type=int, default=5, help="The fastest run is compared.")
+        parser.add_argument(
+            "--time-tolerance",
+            type=float,
+            help="Also fail when DB time exceeds the baseline's by this fraction; only on comparable machines.",
+        )
+        parser.add_argument("--baseline", default=str(BASELINE))
+        parser.add_argument("--update", action="store_true", help="Write the baseline instead of checking it.")
+        parser.add_argument("--report", action="store_true", help="Print the per-fingerprint report.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            service = self.generate(options)
+            profiles = []
+            for _ in range(options["runs"]):
+                # every run looks the service's shard up, as a dashboard does once the
+                # placement has left the cache
+                sharding.clear_placement(service.uuid)
+                with profile_queries("core_stats") as profile:
+                    service.get_core_status()
+                profiles.append(profile)
+            # the generated rows are never committed
+            transaction.set_rollback(True)
+
+        profile = min(profiles, key=lambda profile: profile.total_time)
+        self.stdout.write(f"core stats: {profile.count} queries, {profile.total_time * 1000:.1f} ms")
+        if options["report"]:
+            self.stdout.write(json.dumps(profile.report(), indent=2))
+
+        path = Path(options["baseline"])
+        if options["update"]:
+            path.write_text(
+                json.dumps(
+                    {"queries": profile.count, "time_ms": round(profile.total_time * 1000, 1)}, indent=2
+                )
+                + "\n"
+            )
+            self.stdout.write(f"Wrote {path}")
+            return
+
+        if not path.exists():
+            raise CommandError(f"No baseline at {path}; run with --update first")
+        baseline = json.loads(path.read_text())
+        if baseline.get("time_ms") is not None:
+            self.stdout.write(f"baseline: {baseline['queries']} queries, {baseline['time_ms']:.1f} ms when written")
+        failures = compare_to_baseline(profile, baseline, options["time_tolerance"])
+        if failures:
+            raise CommandError("; ".join(failures))
+        self.stdout.write(self.style.SUCCESS("Within the baseline"))
+
+    def generate(self, options):
+        rng = random.Random(0)
+        owner = User.objects.create(email=f"query-budget-{time.time_ns()}@localhost")
+        service = Service.objects.create(owner=owner, collaborators=owner, name="query budget")
+        now = timezone.now()
+        if is_partitioned():
+            # the dataset reaches back 30 days, possibly before the oldest partition
+            start = interval_start((now - timezone.timedelta(days=31)).date())
+            while start <= now.date():
+                create_partition(start)
+                start = next_interval(start)
+
+        sessions = []
+        for _ in range(options["sessions"]):
+            start_time = now - timezone.timedelta(seconds=rng.randrange(30 * 86400))
+            sessions.append(
+                Session(
+                    service=service,
+                    start_time=start_time,
+                    last_seen=start_time + timezone.timedelta(seconds=rng.randrange(600)),
+                    browser=rng.choice(["Firefox", "Chrome", "Safari"]),
+                    device_type=rng.choice(["PHONE", "DESKTOP", "TABLET"]),
+                    os=rng.choice(["Linux", "Windows", "iOS", "Android"]),
+                    country=rng.choice(["DE", "US", "IN", "FR"]),
+                    is_bounce=rng.random() < 0.4,
+                )
+            )
+        sessions = bulk_insert(Session, sessions)
+        bulk_insert(
+            Hit,
+            [
+                Hit(
+                    session=session,
+                    service=service,
+                    start_time=session.start_time + timezone.timedelta(seconds=15 * n),
+                    location=rng.choice(PAGES),
+                    referrer=rng.choice(["", "https://www.google.com/", "https://t.co/"]),
+                )
+                for session in sessions
+                for n in range(options["hits_per_session"])
+            ],
+        )
+        return service
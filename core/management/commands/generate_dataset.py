@@ -0,0 +1,133 @@
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+from factory.random import reseed_random
+
+from analytics import loadtimes
+from analytics.bulk import insert_rows, reserve_ids
+from analytics.models import Session, Hit
+from analytics.partitions import create_partition, interval_start, is_partitioned, next_interval
+from core.factories import ServiceFactory, hit_values, session_values
+from crena import sharding
+
+SESSION_VALUES = (
+    "identifier", "user_agent", "browser", "os", "device_type", "devices", "ip", "asn",
+    "country", "latitude", "longitude", "time_zone", "geohash",
+)
+SESSION_FIELDS = ("id", "uuid", "service", "start_time", "last_seen", "is_bounce", "sample_rate", *SESSION_VALUES)
+HIT_VALUES = ("initial", "heartbeats", "tracker", "location", "referrer", "load_time")
+HIT_FIELDS = ("id", "session", "service", "start_time", "last_seen", *HIT_VALUES)
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-create a synthetic dataset for benchmarks: sessions and hits spread over "
+        "services of very different sizes, with Zipf-distributed pages, referrers and devices."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--services", type=int, default=50)
+        parser.add_argument("--sessions", type=int, default=100_000)
+        parser.add_argument("--hits", type=int, default=1_000_000, help="About this many; hits per session vary.")
+        parser.add_argument("--days", type=int, default=30, help="How far back the sessions reach.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=5000, help="Sessions per insert.")
+        parser.add_argument("--workers", type=int, default=4, help="Batches written at once.")
+
+    def handle(self, *args, **options):
+        reseed_random(options["seed"])
+        started = time.perf_counter()
+
+        services = ServiceFactory.create_batch(options["services"])
+        # a few large sites and a long tail of small ones, Zipf again
+        weights = [1 / rank for rank in range(1, len(services) + 1)]
+        counts = [round(options["sessions"] * weight / sum(weights)) for weight in weights]
+        mean_hits = max(options["hits"] / max(options["sessions"], 1), 1.0)
+
+        prepared = set()
+        for service in services:
+            with sharding.service_shard(service) as alias:
+                if alias not in prepared:
+                    self.ensure_partitions(options["days"])
+                    prepared.add(alias)
+
+        # batches of every service at once: the database indexes one while the next is
+        # generated. Each batch has its own generator, so the data does not depend on
+        # the thread schedule
+        jobs = [
+            (random.Random(f"{options['seed']}-{index}-{offset}"), service, min(options["batch_size"], count - offset))
+            for index, (service, count) in enumerate(zip(services, counts))
+            for offset in range(0, count, options["batch_size"])
+        ]
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            results = list(pool.map(lambda job: self.write_batch(*job, mean_hits, options["days"]), jobs))
+        totals = [sum(column) for column in zip(*results)] or [0, 0]
+        # the load time sketches ingestion would have kept
+        loadtimes.flush()
+
+        for service, count in zip(services, counts):
+            self.stdout.write(f"{service.name} ({service.uuid}): {count} sessions")
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {totals[0]} sessions and {totals[1]} hits in {len(services)} services "
+                f"in {elapsed:.1f} s ({sum(totals) / elapsed:,.0f} rows/s)"
+            )
+        )
+
+    def ensure_partitions(self, days):
+        if not is_partitioned():
+            return
+        now = timezone.now()
+        start = interval_start((now - timezone.timedelta(days=days + 1)).date())
+        while start <= now.date():
+            create_partition(start)
+            start = next_interval(start)
+
+    def write_batch(self, rng, service, size, mean_hits, days):
+        try:
+            with sharding.service_shard(service):
+                return self.write_rows(rng, service, size, mean_hits, days)
+        finally:
+            connections.close_all()
+
+    def write_rows(self, rng, service, size, mean_hits, days):
+        # tuples straight into COPY; model instances would cost more than the insert
+        now = timezone.now()
+        span = days * 86400
+        session_ids = reserve_ids(Session, size)
+        sessions, hits = [], []
+        for session_id in session_ids:
+            start_time = now - timezone.timedelta(seconds=rng.random() * span)
+            # geometric page views per session, averaging mean_hits
+            views = 1 + int(rng.expovariate(1 / (mean_hits - 1))) if mean_hits > 1 else 1
+            time = start_time
+            for view in range(views):
+                values = hit_values(service.link, view == 0, rng)
+                last_seen = min(time + values.pop("duration"), now)
+                hits.append((session_id, service.pk, time, last_seen, *(values[field] for field in HIT_VALUES)))
+                loadtimes.record(service.pk, values["location"], time, values["load_time"])
+                time = min(last_seen + timezone.timedelta(seconds=rng.expovariate(1 / 20)), now)
+            values = session_values(rng)
+            sessions.append(
+                (
+                    session_id,
+                    str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                    service.pk,
+                    start_time,
+                    last_seen,
+                    views == 1,
+                    1.0,
+                    *(values[field] for field in SESSION_VALUES),
+                )
+            )
+
+        insert_rows(Session, SESSION_FIELDS, sessions)
+        hit_ids = reserve_ids(Hit, len(hits))
+        insert_rows(Hit, HIT_FIELDS, [(hit_id, *hit) for hit_id, hit in zip(hit_ids, hits)])
+        return len(sessions), len(hits)
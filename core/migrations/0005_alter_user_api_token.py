@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-19 11:50
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_alter_service_ignored_ips'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='api_token',
+            field=models.TextField(db_index=True, default=core.models._api_token, verbose_name='api token'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 11:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_alter_user_api_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='service',
+            name='retention_days',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='retention days'),
+        ),
+    ]
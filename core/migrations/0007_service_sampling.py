@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:14
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_service_retention_days'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='service',
+            name='sample_rate',
+            field=models.FloatField(default=1.0, validators=[django.core.validators.MinValueValidator(0.0001), django.core.validators.MaxValueValidator(1.0)], verbose_name='sample rate'),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='sampling_target_per_minute',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='sampling target per minute'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_service_sampling'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServicePlacement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('database', models.CharField(default='default', max_length=64, verbose_name='database')),
+                ('status', models.CharField(choices=[('ACTIVE', 'Active'), ('MOVING', 'Copying to target'), ('LOCKED', 'Cutting over')], default='ACTIVE', max_length=8, verbose_name='status')),
+                ('target', models.CharField(blank=True, max_length=64, verbose_name='target')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='updated')),
+                ('service', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='placement', to='core.service', verbose_name='service')),
+            ],
+            options={
+                'verbose_name': 'Service placement',
+                'verbose_name_plural': 'Service placements',
+            },
+        ),
+    ]
@@ -1,5 +1,6 @@
 import uuid
 import ipaddress
+import math
 import re
 
 from django.apps import apps
@@ -9,16 +10,24 @@ from django.contrib.auth.models import AbstractUser
 from django.db.models.functions import TruncDate, TruncHour
 from django.utils.translation import gettext_lazy as _ 
 from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db.utils import NotSupportedError
 from django.urls import reverse
 from django.utils import timezone
 from secrets import token_urlsafe
 
+from crena import sharding
+from crena.routers import use_replica
+from .profiling import query_budget
+
 #How long user needs to go without update to declare as inactive (i.e curenty online)
 ACTIVE_USER_TIMEDELTA = timezone.timedelta(
     milliseconds=settings.SCRIPT_HEARTBEAT_FREQUENCY * 2
 )
 RESULT_LIMITS = 300
+# sampled stats report 95% margins
+SAMPLING_CONFIDENCE = 0.95
+SAMPLING_Z = 1.96
 
 def _default_uuid():
     return str(uuid.uuid4())
@@ -44,10 +53,39 @@ def _validate_regex(regex: str):
 def _api_token():
     return token_urlsafe(32)
 
+def _weight(rate_field):
+    return models.ExpressionWrapper(
+        models.Value(1.0) / models.F(rate_field), output_field=models.FloatField()
+    )
+
+def _top(queryset, field, weight=None, archived=None):
+    # the RESULT_LIMITS most common values, with counts scaled by the weight if given,
+    # and the archived rows' counts (analytics.archive) added in
+    if weight is None:
+        count = models.Count(field)
+    else:
+        count = models.Sum(weight, filter=models.Q(**{f"{field}__isnull": False}))
+    rows = list(queryset.values(field).annotate(count=count).order_by("-count")[:RESULT_LIMITS])
+    if archived:
+        counts = archived.top(queryset.model, field, weight is not None)
+        # the live counts of the values the archive ranks high but the limit cut off
+        listed = {row[field] for row in rows}
+        missing = [value for value, _ in counts.most_common(RESULT_LIMITS) if value not in listed]
+        if missing:
+            rows += list(queryset.filter(**{f"{field}__in": missing}).values(field).annotate(count=count).order_by())
+    if weight is not None:
+        for row in rows:
+            row["count"] = round(row["count"] or 0)
+    if archived:
+        for row in rows:
+            counts[row[field]] += row["count"]
+        rows = [{field: value, "count": round(count)} for value, count in counts.most_common(RESULT_LIMITS)]
+    return rows
+
 class User(AbstractUser):
     username = models.CharField(_("username"), max_length=84, unique=True,  default=_default_uuid)
     email = models.EmailField(_("email"), max_length=254, unique=True)
-    api_token = models.TextField(_(""), default=_api_token)
+    api_token = models.TextField(_("api token"), default=_api_token, db_index=True)
 
     def __str__(self):
         return self.email
@@ -84,6 +122,15 @@ class Service(models.Model):
     collectd_ips = models.BooleanField(_("collected ips"), default=True)
     ignored_ips = models.TextField(_("ignored ips"), default="", blank=True, validators=[_valid_network_list])
     script_inject = models.TextField(_("script inject"), default="", blank=True)
+    retention_days = models.PositiveIntegerField(_("retention days"), null=True, blank=True)
+    # share of visitors whose sessions are stored; stats are scaled back up by 1/rate
+    sample_rate = models.FloatField(
+        _("sample rate"), default=1.0, validators=[MinValueValidator(0.0001), MaxValueValidator(1.0)]
+    )
+    # when set, the rate drops further so roughly this many hits per minute are kept
+    sampling_target_per_minute = models.PositiveIntegerField(
+        _("sampling target per minute"), null=True, blank=True
+    )
 
     class Meta:
         verbose_name = ['Service']
@@ -103,7 +150,7 @@ class Service(models.Model):
         
         else:
             try:
-                re.compile(self.hide_referrer_regex)
+                return re.compile(self.hide_referrer_regex)
             except re.error:
                 return re.compile(r".^")
             
@@ -112,63 +159,151 @@ class Service(models.Model):
             start_time=timezone.now() - timezone.timedelta(days=1)
         )
 
-    def get_core_status(self, start_time=None, end_time=None):
+    @query_budget("core_stats")
+    @sharding.on_service_shard
+    @use_replica
+    def get_core_status(self, start_time=None, end_time=None, segment=None):
         if start_time is None:
             start_time = timezone.now() - timezone.timedelta(days=30)
-        elif end_time is None:
+        if end_time is None:
             end_time = timezone.now()
         
-        main_data = self.get_relative_stats(start_time, end_time)
+        main_data = self.get_relative_stats(start_time, end_time, segment)
         comparsion_data = self.get_relative_stats(
-            start_time - (end_time - start_time), start_time,
+            start_time - (end_time - start_time), start_time, segment,
         )
         main_data["compare"] = comparsion_data
         return main_data
 
     # this method is written to aggregate the datas of the models 
-    def get_relative_stats(self, start_time, end_time):
+    def get_relative_stats(self, start_time, end_time, segment=None):
+        from analytics import archive, loadtimes
+
         Session = apps.get_model('analytics', 'Session')
         Hit = apps.get_model('analytics', 'Hit')
 
         tz_now = timezone.now()
 
-        currently_online = Session.objects.filter(service=self, last_seen__gt=tz_now - ACTIVE_USER_TIMEDELTA).count()
         sessions = Session.objects.filter(service=self, start_time__gt=start_time, start_time__lt=end_time).order_by("-start_time")
-        session_count = sessions.count()
-
         hits = Hit.objects.filter(service=self, start_time__gt=start_time, start_time__lt=end_time).order_by("-start_time")
+        online = Session.objects.filter(service=self, last_seen__gt=tz_now - ACTIVE_USER_TIMEDELTA)
+        segment_data = None
+        if segment:
+            # e.g. {"country": "DE", "device_type": "PHONE"}; the matching session ids come
+            # from the per-day bitmaps in analytics.segments instead of AND-ed predicates
+            from analytics.segments import session_filters
+
+            session_filter, hit_filter, matched = session_filters(self, start_time, end_time, segment)
+            sessions = sessions.filter(session_filter)
+            hits = hits.filter(hit_filter)
+            online = online.filter(**segment)
+            segment_data = {"filters": segment, "indexed_sessions": len(matched)}
+
+        session_totals = sessions.aggregate(count=models.Count("pk"), min_rate=models.Min("sample_rate"))
+        session_count = session_totals["count"]
+
         hits_count = hits.count()
-        has_hits = Hit.objects.filter(service=self).exists()
+        has_hits = Hit.objects.filter(service=self).exists() or archive.has_data(self)
+
+        # closed months moved to cold storage are summed up next to the live rows
+        archived = archive.query(self, start_time, end_time, segment)
+        archived_totals = archived.totals() if archived else None
+        if archived_totals:
+            session_count += archived_totals["sessions"]
+            hits_count += archived_totals["hits"]
+            rates = [rate for rate in (session_totals["min_rate"], archived_totals["min_rate"]) if rate is not None]
+            session_totals["min_rate"] = min(rates, default=None)
+
+        # sampled sessions stand for 1/rate sessions each; unsampled windows keep the plain counts
+        sampled = (session_totals["min_rate"] or 1.0) < 1.0
+        session_weight = _weight("sample_rate") if sampled else None
+        hit_weight = _weight("session__sample_rate") if sampled else None
+        sampling = {
+            "sampled": sampled,
+            "min_rate": session_totals["min_rate"] or 1.0,
+            "confidence": SAMPLING_CONFIDENCE,
+            "session_count_margin": 0,
+            "hits_count_margin": 0,
+        }
+
+        currently_online = online.aggregate(
+            count=models.Sum(_weight("sample_rate"))
+        )["count"]
+        currently_online = round(currently_online or 0)
+
+        if sampled:
+            # Horvitz-Thompson estimates; a session kept with probability p adds (1 - p) / p^2
+            # to the variance of the session count
+            raw_sessions, raw_hits = session_count, hits_count
+            totals = sessions.aggregate(
+                count=models.Sum(session_weight),
+                bounces=models.Sum(session_weight, filter=models.Q(is_bounce=True)),
+                variance=models.Sum(
+                    models.ExpressionWrapper(
+                        (models.Value(1.0) - models.F("sample_rate"))
+                        / (models.F("sample_rate") * models.F("sample_rate")),
+                        output_field=models.FloatField(),
+                    )
+                ),
+            )
+            weighted_hits = hits.aggregate(count=models.Sum(hit_weight))["count"] or 0
+            if archived_totals:
+                totals["count"] = (totals["count"] or 0) + archived_totals["weighted_sessions"]
+                totals["bounces"] = (totals["bounces"] or 0) + archived_totals["weighted_bounces"]
+                totals["variance"] = (totals["variance"] or 0) + archived_totals["variance"]
+                weighted_hits += archived_totals["weighted_hits"]
+            session_count = round(totals["count"] or 0)
+            bounces_count = round(totals["bounces"] or 0)
+            hits_count = round(weighted_hits)
+            margin = SAMPLING_Z * math.sqrt(totals["variance"] or 0)
+            sampling["session_count_margin"] = round(margin)
+            # hits come in whole sessions, so their margin grows with the hits per session
+            sampling["hits_count_margin"] = round(margin * raw_hits / raw_sessions) if raw_sessions else 0
+        else:
+            bounces_count = sessions.filter(is_bounce=True).count()
+            if archived_totals:
+                bounces_count += archived_totals["bounces"]
 
-        bounces = sessions.filter(is_bounce=True)
-        bounces_count = bounces.count()
-        
         #from here till the avg_hit_per_session we are annoting and slicing the database tables to query them much faster through a constant
-        locations = hits.values("location").annotate(count=models.Count("location")).order_by("-count")[:RESULT_LIMITS]
+        #the lists are evaluated here, so the query budget of get_core_status covers them
+        locations = _top(hits, "location", hit_weight, archived)
         referrer_ignore = self.get_ignored_referrer_regex()
 
         referrers = [
-            referrer 
-            for referrer in (
-                hits.values("referrer").annotate(models.Count("referrer")).order_by("-count")[:RESULT_LIMITS]
-            )
+            referrer
+            for referrer in _top(hits, "referrer", hit_weight, archived)
             if not referrer_ignore.match(referrer["referrer"])
         ]
 
-        countries = sessions.values("countries").annotate(models.Count("countries")).order_by("-count")[:RESULT_LIMITS]
-        devices = sessions.values("devices").annotate(models.Count("devices")).order_by("-count")[:RESULT_LIMITS]
-        devices_types = sessions.values("device_type").annotate(models.Count("device_type")).order_by("-count")[:RESULT_LIMITS]
-        operating_system = sessions.values("os").annotate(models.Count("os")).order_by("-count")[:RESULT_LIMITS]
-        browser = sessions.values("browser").annotate(models.Count("browser")).order_by("-count")[:RESULT_LIMITS]
+        countries = _top(sessions, "country", session_weight, archived)
+        devices = _top(sessions, "devices", session_weight, archived)
+        devices_types = _top(sessions, "device_type", session_weight, archived)
+        operating_system = _top(sessions, "os", session_weight, archived)
+        browser = _top(sessions, "browser", session_weight, archived)
 
-        avg_load_time = hits.aggregate(load_time__avg=models.Avg('load_time'))["load_time__avg"]
+        # percentiles of the service's and its top pages' load times, merged from the
+        # per-hour and per-day sketches of analytics.loadtimes; a segment sums its own hits
+        pages = [row["location"] for row in locations[:settings.LOAD_TIME_TOP_PAGES]]
+        if segment:
+            load_times, page_load_times = loadtimes.from_hits(hits, archived, pages)
+        else:
+            load_times, page_load_times = loadtimes.window(self, start_time, end_time, pages)
+        avg_load_time = load_times.mean()
         avg_hit_per_session = hits_count / session_count if session_count > 0 else None
 
-        avg_session_duration = self._get_avg_session_duration(session=sessions, session_counts=session_count)
-        
+        avg_session_duration = self._get_avg_session_duration(sessions, session_totals["count"])
+        if archived_totals and archived_totals["duration_count"]:
+            live_seconds = avg_session_duration or 0
+            if isinstance(live_seconds, timezone.timedelta):
+                live_seconds = live_seconds.total_seconds()
+            live_count = session_totals["count"] if avg_session_duration is not None else 0
+            avg_session_duration = timezone.timedelta(
+                seconds=(live_seconds * live_count + archived_totals["duration_sum"])
+                / (live_count + archived_totals["duration_count"])
+            )
         
         chart_data, chart_tooltip_format, chart_granularity = self._get_chart_data(
-            sessions, hits, start_time, end_time, tz_now
+            sessions, hits, start_time, end_time, tz_now, session_weight, hit_weight, archived
         )
         return {
             "currently_online": currently_online,
@@ -178,6 +313,12 @@ class Service(models.Model):
             "bounce_rate_pct": bounces_count * 100/ session_count if session_count > 0 else None,
             "avg_session_duration": avg_session_duration,
             "avg_load_time": avg_load_time,
+            "load_time_percentiles": loadtimes.summary(load_times),
+            "load_time_pages": [
+                {"location": location, "count": round(sketch.count), **loadtimes.summary(sketch)}
+                for location, sketch in page_load_times.items()
+                if sketch
+            ],
             "avg_hits_per_session": avg_hit_per_session,
             "referrers": referrers,
             "locations": locations,
@@ -190,6 +331,8 @@ class Service(models.Model):
             "chart_tootlip_format": chart_tooltip_format,
             "chart_granularity": chart_granularity,
             "online": True,
+            "sampling": sampling,
+            "segment": segment_data,
         }
     
 
@@ -210,9 +353,73 @@ class Service(models.Model):
 
         return avg_session_duration
 
-    def _get_chart_data(self, session, hits, start_time, end_time, tz_now):
-        pass
+    def _get_chart_data(
+        self, sessions, hits, start_time, end_time, tz_now, session_weight=None, hit_weight=None, archived=None
+    ):
+        # hourly points for ranges of up to three days, daily points otherwise
+        if end_time - start_time <= timezone.timedelta(days=3):
+            trunc, step, tooltip_format, granularity = TruncHour, timezone.timedelta(hours=1), "MM/dd HH:mm", "hourly"
+            current = start_time.replace(minute=0, second=0, microsecond=0)
+        else:
+            trunc, step, tooltip_format, granularity = TruncDate, timezone.timedelta(days=1), "MMM d", "daily"
+            current = start_time.date()
+
+        def _counts(queryset, weight):
+            return {
+                row["bucket"]: round(row["count"] or 0)
+                for row in queryset.annotate(bucket=trunc("start_time"))
+                .order_by()
+                .values("bucket")
+                .annotate(count=models.Sum(weight) if weight is not None else models.Count("pk"))
+            }
+
+        session_counts = _counts(sessions, session_weight)
+        hit_counts = _counts(hits, hit_weight)
+        if archived:
+            for counts, archived_counts in zip(
+                (session_counts, hit_counts), archived.chart(granularity, session_weight is not None)
+            ):
+                for bucket, count in archived_counts.items():
+                    counts[bucket] = counts.get(bucket, 0) + round(count)
+
+        end = min(end_time, tz_now)
+        end = end if granularity == "hourly" else end.date()
+        chart_data = []
+        while current <= end:
+            chart_data.append(
+                {
+                    "date": current,
+                    "sessions": session_counts.get(current, 0),
+                    "hits": hit_counts.get(current, 0),
+                }
+            )
+            current += step
+
+        return chart_data, tooltip_format, granularity
 
     def get_absolute_url(self):
         return reverse("model_detail", kwargs={"pk": self.pk})
+
+
+class ServicePlacement(models.Model):
+    # the database holding a service's sessions and hits (crena.sharding); services
+    # without a placement are on the default one. Moves go through analytics.shards
+    ACTIVE = sharding.ACTIVE
+    MOVING = sharding.MOVING
+    LOCKED = sharding.LOCKED
+    STATUSES = [(ACTIVE, _("Active")), (MOVING, _("Copying to target")), (LOCKED, _("Cutting over"))]
+
+    service = models.OneToOneField(Service, verbose_name=_("service"), related_name="placement", on_delete=models.CASCADE)
+    database = models.CharField(_("database"), max_length=64, default="default")
+    status = models.CharField(_("status"), max_length=8, choices=STATUSES, default=ACTIVE)
+    target = models.CharField(_("target"), max_length=64, blank=True)
+    updated = models.DateTimeField(_("updated"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("Service placement")
+        verbose_name_plural = _("Service placements")
+
+    def __str__(self):
+        return f"{self.service_id} on {self.database}"
+
     
\ No newline at end of file
@@ -0,0 +1,152 @@
+import logging
+import re
+import time
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|\?")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    # literals and placeholders become "?", so one query shape is one fingerprint
+    # whatever its parameters or IN-list length
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _IN_LIST.sub("(...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+@dataclass
+class QueryRecord:
+    alias: str
+    sql: str
+    duration: float
+    # None where the backend does not report it (SQLite for SELECTs)
+    rows: int = None
+
+    @property
+    def fingerprint(self):
+        return fingerprint(self.sql)
+
+
+@dataclass
+class QueryProfile:
+    name: str
+    queries: list = field(default_factory=list)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            rowcount = getattr(context.get("cursor"), "rowcount", -1)
+            self.queries.append(
+                QueryRecord(
+                    alias=context["connection"].alias,
+                    sql=sql,
+                    duration=time.perf_counter() - started,
+                    rows=rowcount if rowcount is not None and rowcount >= 0 else None,
+                )
+            )
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(query.duration for query in self.queries)
+
+    def by_fingerprint(self):
+        groups = {}
+        for query in self.queries:
+            group = groups.setdefault(
+                query.fingerprint,
+                {"fingerprint": query.fingerprint, "count": 0, "time_ms": 0.0, "rows": None},
+            )
+            group["count"] += 1
+            group["time_ms"] += query.duration * 1000
+            if query.rows is not None:
+                group["rows"] = (group["rows"] or 0) + query.rows
+        return sorted(groups.values(), key=lambda group: group["time_ms"], reverse=True)
+
+    def report(self):
+        return {
+            "name": self.name,
+            "queries": self.count,
+            "time_ms": round(self.total_time * 1000, 3),
+            "by_fingerprint": [
+                {**group, "time_ms": round(group["time_ms"], 3)} for group in self.by_fingerprint()
+            ],
+        }
+
+    def over_budget(self, max_queries=None, max_time_ms=None):
+        reasons = []
+        if max_queries is not None and self.count > max_queries:
+            reasons.append(f"{self.count} queries > {max_queries}")
+        if max_time_ms is not None and self.total_time * 1000 > max_time_ms:
+            reasons.append(f"{self.total_time * 1000:.1f} ms > {max_time_ms} ms")
+        return reasons
+
+
+@contextmanager
+def profile_queries(name, max_queries=None, max_time_ms=None):
+    # execute wrappers are per connection (and so per thread), on every alias, so
+    # reads sent to another database are profiled as well
+    profile = QueryProfile(name)
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(profile))
+        yield profile
+
+    reasons = profile.over_budget(max_queries, max_time_ms)
+    if reasons:
+        top = profile.by_fingerprint()[:5]
+        logger.warning(
+            f"Query budget exceeded for {name}: {', '.join(reasons)}; slowest: "
+            + "; ".join(f"{group['time_ms']:.1f} ms x{group['count']} {group['fingerprint'][:200]}" for group in top)
+        )
+
+
+def query_budget(name):
+    # the budget for a profiled code path is STATS_QUERY_BUDGETS[name]
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            budget = settings.STATS_QUERY_BUDGETS.get(name)
+            if budget is None:
+                return func(*args, **kwargs)
+            with profile_queries(name, budget.get("queries"), budget.get("time_ms")):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def compare_to_baseline(profile, baseline, time_tolerance=None):
+    # for CI: the query count may not grow at all. DB time moves with the machine
+    # running the check, so it is only held to the baseline with a tolerance given
+    failures = []
+    if profile.count > baseline["queries"]:
+        failures.append(f"query count rose from {baseline['queries']} to {profile.count}")
+    if time_tolerance is None or baseline.get("time_ms") is None:
+        return failures
+    limit = baseline["time_ms"] * (1 + time_tolerance)
+    if profile.total_time * 1000 > limit:
+        failures.append(
+            f"DB time rose from {baseline['time_ms']:.1f} ms to {profile.total_time * 1000:.1f} ms "
+            f"(limit {limit:.1f} ms)"
+        )
+    return failures
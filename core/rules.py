@@ -0,0 +1,18 @@
+import rules
+
+
+@rules.predicate
+def is_service_owner(user, service):
+    return service is not None and service.owner_id == user.pk
+
+
+@rules.predicate
+def is_service_collaborator(user, service):
+    return service is not None and service.collaborators_id == user.pk
+
+
+can_view_service = is_service_owner | is_service_collaborator | rules.is_superuser
+can_change_service = is_service_owner | rules.is_superuser
+
+rules.add_perm("core.view_service", can_view_service)
+rules.add_perm("core.change_service", can_change_service)
@@ -1,3 +1,168 @@
-from django.test import TestCase
+import io
+import json
+import random
+import time
+from collections import Counter
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import Count, F
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+
+from analytics.models import Hit, Session
+from crena import routers
+from crena.middleware import PrimaryPinMiddleware
+
+from .factories import PAGES, HitFactory, ServiceFactory, UserFactory, Zipf
+from .management.commands.benchmark_stats import component
+from .models import Service
+from .profiling import QueryProfile, QueryRecord, compare_to_baseline, fingerprint, profile_queries
+
+
+class ServicePermissionTests(TestCase):
+    def test_owner_and_collaborator_view_and_only_the_owner_changes(self):
+        owner, collaborator, stranger = UserFactory(), UserFactory(), UserFactory()
+        service = ServiceFactory(owner=owner, collaborators=collaborator)
+        self.assertTrue(owner.has_perm("core.view_service", service))
+        self.assertTrue(collaborator.has_perm("core.view_service", service))
+        self.assertFalse(stranger.has_perm("core.view_service", service))
+        self.assertTrue(owner.has_perm("core.change_service", service))
+        self.assertFalse(collaborator.has_perm("core.change_service", service))
+
+
+class FactoryTests(TestCase):
+    def test_zipf_favours_the_first_values(self):
+        draws = Counter(Zipf("abcdefghij")(random.Random(n)) for n in range(5000))
+        self.assertEqual(set(draws), set("abcdefghij"))
+        ranked = [value for value, _ in draws.most_common()]
+        self.assertEqual(ranked[:2], ["a", "b"])
+        self.assertGreater(draws["a"], 3 * draws["j"])
+
+    def test_zipf_draws_repeat_with_the_seed(self):
+        self.assertEqual(
+            [PAGES(random.Random(7)) for _ in range(5)], [PAGES(random.Random(7)) for _ in range(5)]
+        )
+
+    def test_hits_belong_to_their_session_and_service(self):
+        hit = HitFactory()
+        self.assertEqual(hit.service, hit.session.service)
+        self.assertTrue(hit.location.startswith(hit.service.link))
+        self.assertGreaterEqual(hit.last_seen, hit.start_time)
+        self.assertGreater(hit.load_time, 0)
+
+
+class DatasetTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def generate(self):
+        out = io.StringIO()
+        call_command(
+            "generate_dataset", services=3, sessions=60, hits=240, days=2, batch_size=7, workers=1, stdout=out
+        )
+        return out.getvalue()
+
+    def test_services_get_a_zipf_share_of_the_sessions(self):
+        self.assertIn("Created 60 sessions", self.generate())
+        counts = Session.objects.values("service").annotate(sessions=Count("pk")).order_by("-sessions")
+        self.assertEqual([row["sessions"] for row in counts], [33, 16, 11])
+
+    def test_sessions_hold_their_hits(self):
+        self.generate()
+        self.assertEqual(Hit.objects.values("session").distinct().count(), Session.objects.count())
+        self.assertAlmostEqual(Hit.objects.count() / Session.objects.count(), 4, delta=1.5)
+        for session in Session.objects.annotate(views=Count("hit")):
+            self.assertEqual(session.is_bounce, session.views == 1)
+        self.assertFalse(Hit.objects.exclude(service=F("session__service")).exists())
+
+    def test_the_benchmark_reports_each_component(self):
+        self.generate()
+        out = io.StringIO()
+        call_command("benchmark_stats", largest=1, days="1,2", runs=2, json=True, stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual([result["days"] for result in results], [1, 2])
+        self.assertIsNone(results[1]["error"])
+        self.assertEqual(results[1]["sessions"], 33)
+        self.assertIn("session_count", results[1]["components"])
+        self.assertIn("total", results[1]["components"])
+
+    def test_queries_are_attributed_to_components(self):
+        self.assertEqual(component('SELECT COUNT(*) AS "__count" FROM "analytics_session" WHERE ?'), "session_count")
+        self.assertEqual(
+            component('SELECT "analytics_hit"."location" AS "location", COUNT("analytics_hit"."id") FROM "analytics_hit"'),
+            "top_location",
+        )
+        self.assertEqual(component('SELECT "sketch" FROM "analytics_loadtimesketch"'), "load_time")
+        self.assertEqual(component("SELECT 1"), "other")
+
+
+class QueryProfileTests(TestCase):
+    def test_fingerprints_collapse_literals_and_in_lists(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE a = 'x''y' AND b IN (1, 2,  3) AND c = %s LIMIT 10"),
+            "SELECT * FROM t WHERE a = ? AND b IN (...) AND c = ? LIMIT ?",
+        )
+        self.assertEqual(fingerprint("SELECT 1 FROM t WHERE id IN (%s)"), fingerprint("SELECT 1 FROM t WHERE id IN (%s, %s)"))
+
+    def test_profile_records_queries_and_groups_them(self):
+        ServiceFactory()
+        with profile_queries("test") as profile:
+            list(Service.objects.filter(name="a"))
+            list(Service.objects.filter(name="b"))
+            Service.objects.count()
+        self.assertEqual(profile.count, 3)
+        groups = profile.by_fingerprint()
+        self.assertEqual(sorted(group["count"] for group in groups), [1, 2])
+        self.assertEqual(profile.report()["queries"], 3)
+
+    def test_going_over_the_budget_is_logged(self):
+        with self.assertLogs("core.profiling", "WARNING") as logs:
+            with profile_queries("test", max_queries=1):
+                Service.objects.count()
+                Service.objects.count()
+        self.assertIn("2 queries > 1", logs.output[0])
+
+    def test_baseline_comparison(self):
+        profile = QueryProfile("test", [QueryRecord("default", "SELECT 1", 0.010)] * 3)
+        self.assertEqual(compare_to_baseline(profile, {"queries": 3, "time_ms": 30}), [])
+        # time only counts when asked for, as it depends on the machine
+        self.assertEqual(compare_to_baseline(profile, {"queries": 3, "time_ms": 10}), [])
+        self.assertEqual(compare_to_baseline(profile, {"queries": 3, "time_ms": 20}, time_tolerance=0.6), [])
+        failures = compare_to_baseline(profile, {"queries": 2, "time_ms": 10}, time_tolerance=0.5)
+        self.assertEqual(len(failures), 2)
+        self.assertIn("query count rose from 2 to 3", failures[0])
+
+
+@override_settings(REPLICA_DATABASES=["replica_0", "replica_1"], REPLICA_LAG_CHECK_INTERVAL=60)
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # the lag checks, as if they had just run
+        routers._freshness.clear()
+        routers._freshness.update(replica_0=(time.monotonic(), True), replica_1=(time.monotonic(), False))
+        self.addCleanup(routers._freshness.clear)
+
+    def test_only_opted_in_reads_go_to_a_fresh_replica(self):
+        router = routers.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Service))
+        with routers.replica_reads():
+            self.assertEqual(router.db_for_read(Service), "replica_0")
+            self.assertIsNone(router.db_for_write(Service))
+        self.assertIsNone(router.db_for_read(Service))
+        self.assertFalse(router.allow_migrate("replica_0", "core"))
+        self.assertIsNone(router.allow_migrate("default", "core"))
+
+    def test_without_a_fresh_replica_reads_stay_on_the_primary(self):
+        routers._freshness["replica_0"] = (time.monotonic(), False)
+        with routers.replica_reads():
+            self.assertIsNone(routers.ReplicaRouter().db_for_read(Service))
+
+    def test_a_users_writes_pin_their_reads_to_the_primary(self):
+        user, other = UserFactory(), UserFactory()
+        chosen = []
+        middleware = PrimaryPinMiddleware(lambda request: chosen.append(routers.choose_replica()))
+        for method, requester in (("get", user), ("post", user), ("get", user), ("get", other)):
+            request = getattr(RequestFactory(), method)("/")
+            request.user = requester
+            middleware(request)
+        self.assertEqual(chosen, ["replica_0", None, None, "replica_0"])
@@ -0,0 +1,6 @@
+from django.urls import path, include
+
+# the URLs of PROCESS_PROFILE = "ingest": the tracker endpoints and metrics only
+urlpatterns = [
+    path('analytics/', include('analytics.urls')),
+]
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .routers import pinned_to_primary
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class PrimaryPinMiddleware:
+    # after a user writes something, their reads stay on the primary for
+    # REPLICA_STICKY_SECONDS, so they never see a replica that has not caught up yet
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.REPLICA_DATABASES or not request.user.is_authenticated:
+            return self.get_response(request)
+
+        path = f"replica_pin_{request.user.pk}"
+        if request.method not in SAFE_METHODS:
+            cache.set(path, True, timeout=settings.REPLICA_STICKY_SECONDS)
+        elif cache.get(path) is None:
+            return self.get_response(request)
+
+        with pinned_to_primary():
+            return self.get_response(request)
@@ -0,0 +1,109 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# only code that opted in reads from a replica; ingestion must see its own writes
+_read_alias = ContextVar("read_alias", default=None)
+_pinned = ContextVar("pinned_to_primary", default=False)
+_freshness = {}
+
+
+@contextmanager
+def replica_reads():
+    # one replica for the whole block, so its queries see one consistent snapshot
+    token = _read_alias.set(choose_replica())
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def use_replica(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def pinned_to_primary():
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def replica_lag(alias):
+    # seconds behind the primary; a replica that has replayed all it received is
+    # current, however old its last transaction
+    connection = connections[alias]
+    if connection.vendor != "postgresql":
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT CASE "
+            "WHEN NOT pg_is_in_recovery() THEN 0 "
+            "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+            "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+        )
+        return float(cursor.fetchone()[0])
+
+
+def is_fresh(alias):
+    # checked at most every REPLICA_LAG_CHECK_INTERVAL seconds per process; an
+    # unreachable replica counts as stale until the next check
+    now = time.monotonic()
+    checked = _freshness.get(alias)
+    if checked is not None and now - checked[0] < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return checked[1]
+    try:
+        lag = replica_lag(alias)
+        fresh = lag <= settings.REPLICA_MAX_LAG
+        if not fresh:
+            logger.warning(f"Replica {alias} is {lag:.1f}s behind; reading from the primary")
+    except DatabaseError as e:
+        logger.warning(f"Replica {alias} is unavailable: {e}")
+        fresh = False
+    _freshness[alias] = (now, fresh)
+    return fresh
+
+
+def choose_replica():
+    if not settings.REPLICA_DATABASES or _pinned.get():
+        return None
+    replicas = [alias for alias in settings.REPLICA_DATABASES if is_fresh(alias)]
+    return random.choice(replicas) if replicas else None
+
+
+class ReplicaRouter:
+    # None leaves the choice to Django, i.e. the default database or the one the
+    # instance in the hints came from
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # a replica holds the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.REPLICA_DATABASES}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema from the primary
+        if db in settings.REPLICA_DATABASES:
+            return False
+        return None
@@ -0,0 +1,161 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+# the tables split by service; everything else, services and users included, is read
+# from the default database and mirrored to the shards for their foreign keys
+SHARDED_MODELS = {"analytics.session", "analytics.hit"}
+
+ACTIVE = "ACTIVE"
+MOVING = "MOVING"
+LOCKED = "LOCKED"
+
+_shard = ContextVar("shard", default=None)
+
+
+def shard_aliases():
+    return [DEFAULT_DB_ALIAS, *settings.SHARD_DATABASES]
+
+
+def id_range(alias):
+    # [low, high) of the session and hit ids a shard hands out, so rows keep their ids
+    # when their service moves
+    low = shard_aliases().index(alias) * settings.SHARD_ID_SPACING
+    return low, low + settings.SHARD_ID_SPACING
+
+
+def _placement_path(service_uuid):
+    return f"service_placement_{service_uuid}"
+
+
+def placement(service_uuid):
+    # (alias, status) of a service, from the ServicePlacement table; services without a
+    # row live on the default database. Cached, and overwritten whenever a move changes it
+    path = _placement_path(service_uuid)
+    cached = cache.get(path)
+    if cached is None:
+        from core.models import ServicePlacement
+
+        row = (
+            ServicePlacement.objects.using(DEFAULT_DB_ALIAS)
+            .filter(service__uuid=service_uuid)
+            .values_list("database", "status")
+            .first()
+        )
+        cached = row or (DEFAULT_DB_ALIAS, ACTIVE)
+        cache.set(path, cached, timeout=settings.SHARD_PLACEMENT_CACHE_TIMEOUT)
+    return tuple(cached)
+
+
+def placed_on(alias, field="service_id"):
+    # a filter for the rows of the services that live on alias; the default database
+    # holds every service without a placement elsewhere
+    from core.models import ServicePlacement
+
+    placements = ServicePlacement.objects.using(DEFAULT_DB_ALIAS)
+    if alias == DEFAULT_DB_ALIAS:
+        elsewhere = placements.exclude(database=alias).values_list("service_id", flat=True)
+        return ~Q(**{f"{field}__in": list(elsewhere)})
+    return Q(**{f"{field}__in": list(placements.filter(database=alias).values_list("service_id", flat=True))})
+
+
+def set_placement(service_uuid, alias, status):
+    cache.set(_placement_path(service_uuid), (alias, status), timeout=settings.SHARD_PLACEMENT_CACHE_TIMEOUT)
+
+
+def clear_placement(service_uuid):
+    cache.delete(_placement_path(service_uuid))
+
+
+def activate(alias):
+    # like translation.activate: Session and Hit queries go to this shard until the
+    # token is given back to deactivate()
+    return _shard.set(alias)
+
+
+def deactivate(token):
+    _shard.reset(token)
+
+
+@contextmanager
+def use_shard(alias):
+    token = activate(alias)
+    try:
+        yield alias
+    finally:
+        deactivate(token)
+
+
+def service_shard(service):
+    return use_shard(placement(service.uuid)[0])
+
+
+def on_service_shard(func):
+    # for Service methods that read the service's sessions and hits
+    @wraps(func)
+    def wrapper(service, *args, **kwargs):
+        with service_shard(service):
+            return func(service, *args, **kwargs)
+
+    return wrapper
+
+
+def fan_out(func, aliases=None):
+    # {alias: func(alias)} with every shard queried at once; each thread closes the
+    # connections it opened, since Django's connections are per thread
+    aliases = aliases or shard_aliases()
+    if len(aliases) == 1:
+        with use_shard(aliases[0]):
+            return {aliases[0]: func(aliases[0])}
+
+    def run(alias):
+        try:
+            with use_shard(alias):
+                return func(alias)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=min(len(aliases), settings.SHARD_FAN_OUT_WORKERS)) as pool:
+        return dict(zip(aliases, pool.map(run, aliases)))
+
+
+class ShardRouter:
+    # Session and Hit go to the shard of the instance they were loaded with, or to the
+    # one use_shard() activated; None leaves the choice to the next router, so the
+    # default database keeps its read replicas
+    def _shard_for(self, model, hints):
+        if model._meta.label_lower not in SHARDED_MODELS:
+            return None
+        instance = hints.get("instance")
+        if instance is not None and instance._meta.label_lower in SHARDED_MODELS and instance._state.db:
+            return instance._state.db
+        return _shard.get()
+
+    def db_for_read(self, model, **hints):
+        alias = self._shard_for(model, hints)
+        return None if alias == DEFAULT_DB_ALIAS else alias
+
+    def db_for_write(self, model, **hints):
+        return self._shard_for(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        labels = {obj1._meta.label_lower, obj2._meta.label_lower}
+        if labels <= SHARDED_MODELS:
+            return obj1._state.db == obj2._state.db
+        if labels & SHARDED_MODELS:
+            # services and users are mirrored to every shard that holds their rows
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # shards carry the full schema
+        return None
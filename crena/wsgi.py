@@ -10,7 +10,17 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'crena.settings')
 
 application = get_wsgi_application()
+
+# the URLconf, and through it the views, models and ingestion code, is imported on the
+# first request otherwise; loaded here, a server that imports this module before
+# forking (gunicorn --preload) shares it with every worker
+get_resolver().url_patterns
+
+from analytics.tasks import preload  # noqa: E402
+
+preload()
@@ -1,6 +1,13 @@
 from django.urls import path
 
+from . import views
+
+app_name = "dashboard"
 
 urlpatterns = [
-    
+    path(
+        "service/<int:pk>/export/<str:kind>.<str:format>",
+        views.ServiceExportView.as_view(),
+        name="service_export",
+    ),
 ]
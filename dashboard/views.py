@@ -0,0 +1,56 @@
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from django.views.generic import View
+from django.views.generic.detail import SingleObjectMixin
+from rules.contrib.views import PermissionRequiredMixin
+
+from analytics.exports import FORMATS, ExportError, stream_export
+from core.models import Service
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        # well-formed, but not a date, like 2024-02-30
+        parsed = None
+    if parsed is None:
+        raise ExportError(f"Invalid timestamp {value!r}")
+    return parsed
+
+
+class ServiceExportView(LoginRequiredMixin, PermissionRequiredMixin, SingleObjectMixin, View):
+    model = Service
+    permission_required = "core.view_service"
+
+    def get(self, request, *args, **kwargs):
+        service = self.get_object()
+        kind = kwargs["kind"]
+        fmt = kwargs["format"]
+        compress = request.GET.get("gzip", "0") == "1"
+        columns = [column for column in request.GET.get("columns", "").split(",") if column]
+
+        try:
+            content = stream_export(
+                service,
+                kind,
+                fmt,
+                columns=columns,
+                start_time=_parse_time(request.GET.get("start")),
+                end_time=_parse_time(request.GET.get("end")),
+                compress=compress,
+            )
+        except ExportError as e:
+            return HttpResponseBadRequest(str(e))
+
+        filename = f"{service.uuid}-{kind}.{fmt}"
+        if compress:
+            filename += ".gz"
+        response = StreamingHttpResponse(
+            content, content_type="application/gzip" if compress else FORMATS[fmt]
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response